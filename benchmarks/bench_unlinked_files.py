@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+"""Benchmark of the unlinked files clean on a synthetic attachment tree.
+
+A ZotFile-style attachment tree is generated under a temporary directory,
+along with a synthetic Zotero profile, and `zotutil.zot.Zot` is run against
+an in-memory stand-in of `zotutil.web.WebLibrary` holding the linked files.
+Wall time, filesystem calls and peak memory are reported per operation,
+along with the durations of its phases as reported by the instrumentation,
+e.g. "retrieve_attachments", "scan_files" and "relocate_files",
+the scan being streamed into the moves, its time is part of "relocate_files" too.
+
+    python benchmarks/bench_unlinked_files.py --files 10000 --depth 2
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+import argparse
+import tempfile
+import tracemalloc
+import random
+import shutil
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from zotutil.instrumentation import Instrumentation  # noqa: E402
+from zotutil.tools import remove_empty_directories  # noqa: E402
+from zotutil.zot import Zot  # noqa: E402
+
+# filesystem calls counted as a proxy for the syscalls
+_COUNTED_OS_FUNCTIONS = (
+    "scandir",
+    "stat",
+    "lstat",
+    "listdir",
+    "mkdir",
+    "rename",
+    "replace",
+    "unlink",
+    "rmdir",
+    "open",
+)
+
+
+class FakeLibrary:
+    """An in-memory stand-in of `zotutil.web.WebLibrary`."""
+
+    def __init__(self, attachment_paths, library_version=1):
+        self.attachment_entries = [
+            {
+                "key": "K" + str(index).zfill(7),
+                "version": library_version,
+                "data": {
+                    "itemType": "attachment",
+                    "linkMode": "linked_file",
+                    "path": "attachments:" + attachment_path,
+                },
+            }
+            for index, attachment_path in enumerate(attachment_paths)
+        ]
+        self.library_version = library_version
+
+    def items(self, concurrency=1, **params):
+        return iter(list(self.attachment_entries))
+
+    def last_modified_version(self):
+        return self.library_version
+
+    def deleted(self, since):
+        return {"items": []}
+
+
+class PhaseRecorder(Instrumentation):
+    """An instrumentation recording the phase durations of the operations measured."""
+
+    def __init__(self):
+        super().__init__()
+        self.phase_durations = {}
+
+    def on_phase_end(self, phase, duration):
+        self.phase_durations[phase] = self.phase_durations.get(phase, 0) + duration
+
+
+def generate_attachment_tree(
+    root_directory, files, depth, suffixes, unlinked_ratio, seed=0
+):
+    """Generate a ZotFile-style attachment tree of empty files.
+
+    Parameters
+    ----------
+    root_directory : pathlib.Path
+        Attachment directory to fill.
+    files : int
+        Number of files.
+    depth : int
+        Number of directory levels above the files, e.g. author/year.
+    suffixes : dict
+        Weights keyed on the file suffixes.
+    unlinked_ratio : float
+        Ratio of files left out of the library.
+
+    Returns
+    -------
+    out : list(str)
+        Relative paths of the linked files.
+
+    """
+    generator = random.Random(seed)
+    fanout = max(2, int(round((files / 10) ** (1 / depth)))) if depth else 1
+    suffix_choices = tuple(suffixes)
+    suffix_weights = tuple(suffixes.values())
+    attachment_paths = []
+    created_directories = set()
+    for index in range(files):
+        directory_parts = tuple(
+            "folder_" + str(level) + "_" + str(generator.randrange(fanout))
+            for level in range(depth)
+        )
+        if directory_parts not in created_directories:
+            root_directory.joinpath(*directory_parts).mkdir(parents=True, exist_ok=True)
+            created_directories.add(directory_parts)
+        suffix = generator.choices(suffix_choices, suffix_weights)[0]
+        filename = "file_" + str(index) + "." + suffix
+        root_directory.joinpath(*directory_parts, filename).touch()
+        if generator.random() >= unlinked_ratio:
+            attachment_paths.append("/".join(directory_parts + (filename,)))
+    return attachment_paths
+
+
+def generate_profile(root_directory, attachment_directory, file_types):
+    profile_directory = root_directory / "profile"
+    (profile_directory / "default").mkdir(parents=True)
+    (profile_directory / "profiles.ini").write_text("[Profile0]\nPath=default\n")
+    (root_directory / "data").mkdir()
+    (profile_directory / "default" / "prefs.js").write_text(
+        "".join(
+            "user_pref(" + json.dumps(key) + ", " + json.dumps(value) + ");\n"
+            for key, value in (
+                ("extensions.zotero.dataDir", str(root_directory / "data")),
+                ("extensions.zotfile.dest_dir", str(attachment_directory)),
+                ("extensions.zotfile.filetypes", ",".join(file_types)),
+            )
+        )
+    )
+    return profile_directory
+
+
+@contextmanager
+def _count_os_calls(counts):
+    originals = {}
+    for name in _COUNTED_OS_FUNCTIONS:
+        original = getattr(os, name)
+        originals[name] = original
+
+        def _counted(*args, _name=name, _original=original, **kwargs):
+            counts[_name] = counts.get(_name, 0) + 1
+            return _original(*args, **kwargs)
+
+        setattr(os, name, _counted)
+    try:
+        yield counts
+    finally:
+        for name, original in originals.items():
+            setattr(os, name, original)
+
+
+def measure(phase, function, *args, recorder=None, **kwargs):
+    """Run an operation, measuring its wall time, filesystem calls and peak memory,
+    and the durations of its phases recorded by `recorder`."""
+    counts = {}
+    if recorder is not None:
+        recorder.phase_durations = {}
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    with _count_os_calls(counts):
+        function(*args, **kwargs)
+    wall_time = time.perf_counter() - start_time
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "phase": phase,
+        "wall_time": round(wall_time, 4),
+        "os_calls": sum(counts.values()),
+        "os_calls_by_function": dict(sorted(counts.items())),
+        "peak_memory": peak_memory,
+        "phases": {
+            phase: round(duration, 4)
+            for phase, duration in (
+                recorder.phase_durations if recorder is not None else {}
+            ).items()
+        },
+    }
+
+
+def run_benchmark(files, depth, suffixes, unlinked_ratio, file_types, workers, seed):
+    root_directory = Path(tempfile.mkdtemp(prefix="zotutil-bench-"))
+    try:
+        attachment_directory = root_directory / "attachments"
+        attachment_directory.mkdir()
+        attachment_paths = generate_attachment_tree(
+            attachment_directory, files, depth, suffixes, unlinked_ratio, seed
+        )
+        profile_directory = generate_profile(
+            root_directory, attachment_directory, file_types
+        )
+
+        recorder = PhaseRecorder()
+        zot = Zot("0", "user", "key", instrumentation=recorder)
+        zot.profile_directory = profile_directory
+        zot._web_library = FakeLibrary(attachment_paths)
+
+        results = [
+            measure(
+                "relocate_unlinked_files",
+                zot.relocate_unlinked_files,
+                foldername_suffix="bench",
+                workers=workers,
+                recorder=recorder,
+            ),
+            measure(
+                "restore_unlinked_files",
+                zot.restore_unlinked_files,
+                workers=workers,
+                recorder=recorder,
+            ),
+            measure(
+                "remove_unlinked_files",
+                zot.remove_unlinked_files,
+                this_relocation=False,
+                non_relocation=True,
+                foldername_suffix="bench",
+                workers=workers,
+                recorder=recorder,
+            ),
+            measure(
+                "remove_empty_directories",
+                remove_empty_directories,
+                attachment_directory,
+            ),
+        ]
+        parameters = {
+            "files": files,
+            "depth": depth,
+            "suffixes": suffixes,
+            "unlinked_ratio": unlinked_ratio,
+            "linked_files": len(attachment_paths),
+            "workers": workers,
+        }
+        return {"parameters": parameters, "results": results}
+    finally:
+        shutil.rmtree(str(root_directory), ignore_errors=True)
+
+
+def _parse_suffixes(suffixes):
+    # e.g. "pdf:0.8,djvu:0.1,txt:0.1"
+    parsed_suffixes = {}
+    for suffix in suffixes.split(","):
+        suffix, _, weight = suffix.partition(":")
+        parsed_suffixes[suffix.strip()] = float(weight or 1)
+    return parsed_suffixes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, nargs="+", default=[1000])
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--suffixes", default="pdf:0.8,djvu:0.1,txt:0.1")
+    parser.add_argument("--file-types", default="pdf,djvu")
+    parser.add_argument("--unlinked-ratio", type=float, default=0.2)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print json lines")
+    args = parser.parse_args(argv)
+
+    for files in args.files:
+        benchmark = run_benchmark(
+            files,
+            args.depth,
+            _parse_suffixes(args.suffixes),
+            args.unlinked_ratio,
+            tuple(file_type.strip() for file_type in args.file_types.split(",")),
+            args.workers,
+            args.seed,
+        )
+        if args.json:
+            print(json.dumps(benchmark))
+            continue
+        print(
+            "files={files} depth={depth} linked={linked_files} workers={workers}".format(
+                **benchmark["parameters"]
+            )
+        )
+        for result in benchmark["results"]:
+            print(
+                "  {phase:<26} {wall_time:>9.3f} s {os_calls:>9} os calls"
+                " {peak_memory:>12} B peak".format(**result)
+            )
+            for phase, duration in result["phases"].items():
+                print("    {:<24} {:>9.3f} s".format(phase, duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -39,6 +39,11 @@ setup(
         "Programming Language :: Python :: 3.8",
     ],
     description="A Python Module of Zotero Utilities.",
+    entry_points={
+        "console_scripts": [
+            "zotutil=zotutil.cli:main",
+        ],
+    },
     install_requires=requirements,
     license="MIT license",
     long_description=readme + "\n\n" + history,
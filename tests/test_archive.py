@@ -0,0 +1,40 @@
+from zotutil.archive import *
+
+
+def test_move_files_into_archive(tmp_path):
+    (tmp_path / "folder_0").mkdir()
+    (tmp_path / "folder_0" / "file_0.pdf").write_bytes(b"0")
+    (tmp_path / "file_0.pdf").write_bytes(b"1")
+    archive_path = tmp_path / "archive.zip"
+    moved_path_pairs, errors = move_files_into_archive(
+        (
+            (
+                tmp_path / "folder_0" / "file_0.pdf",
+                archive_path / "folder_0" / "file_0.pdf",
+            ),
+            (tmp_path / "file_0.pdf", archive_path / "file_0.pdf"),
+            (tmp_path / "file_1.pdf", archive_path / "file_1.pdf"),
+        ),
+        archive_path,
+    )
+    assert len(moved_path_pairs) == 2
+    assert list(errors) == [tmp_path / "file_1.pdf"]
+    assert not (tmp_path / "file_0.pdf").exists()
+    assert split_archived_path(archive_path / "folder_0" / "file_0.pdf") == (
+        archive_path,
+        "folder_0/file_0.pdf",
+    )
+    assert split_archived_path(tmp_path / "folder_0" / "file_0.pdf") is None
+    assert archived_file_exists(archive_path / "file_0.pdf")
+    assert not archived_file_exists(archive_path / "file_1.pdf")
+
+    # a single file by random access
+    extracted_path_pairs, errors = extract_archived_files(
+        ((archive_path / "folder_0" / "file_0.pdf", tmp_path / "file_2.pdf"),)
+    )
+    assert errors == {}
+    assert (tmp_path / "file_2.pdf").read_bytes() == b"0"
+    extracted_path_pairs, errors = extract_archived_files(
+        ((archive_path / "file_0.pdf", tmp_path / "file_2.pdf"),)
+    )
+    assert isinstance(errors[archive_path / "file_0.pdf"], FileExistsError)
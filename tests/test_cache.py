@@ -0,0 +1,39 @@
+from zotutil.cache import *
+
+
+def test_attachment_cache(tmp_path):
+    cache_path = tmp_path / "zotutil" / "attachments.json"
+    attachment_cache = AttachmentCache(cache_path, "0", "user")
+    assert attachment_cache.version is None
+
+    attachment_cache.update(
+        (
+            {"key": "AAAAAAAA", "data": {"path": "attachments:file_0.pdf"}},
+            {"key": "BBBBBBBB", "data": {"path": "attachments:file_1.pdf"}},
+            {"key": "CCCCCCCC", "data": {}},
+        ),
+        (),
+        1,
+    )
+    attachment_cache.save()
+    attachment_cache = AttachmentCache(cache_path, "0", "user")
+    assert attachment_cache.version == 1
+    assert attachment_cache.attachment_paths == {
+        "AAAAAAAA": "attachments:file_0.pdf",
+        "BBBBBBBB": "attachments:file_1.pdf",
+    }
+
+    attachment_cache.update(
+        ({"key": "AAAAAAAA", "data": {"path": "attachments:file_2.pdf"}},),
+        ("BBBBBBBB",),
+        2,
+    )
+    assert attachment_cache.version == 2
+    assert attachment_cache.attachment_paths == {"AAAAAAAA": "attachments:file_2.pdf"}
+
+    # a cache of another library is ignored
+    assert AttachmentCache(cache_path, "1", "user").version is None
+
+    attachment_cache.invalidate()
+    assert attachment_cache.version is None
+    assert not cache_path.is_file()
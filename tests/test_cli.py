@@ -0,0 +1,86 @@
+import sqlite3
+import json
+import io
+
+from zotutil import cli
+from zotutil.cli import main
+from .test_zot import tmp_zot
+
+
+def tmp_job_file(root_path, thresholds=None):
+    """Two libraries of their own roots, relocated then listed in one batch."""
+    jobs = []
+    for library_id in ("0", "1"):
+        library_path = root_path / library_id
+        library_path.mkdir()
+        tmp_zot(library_path)
+        connection = sqlite3.connect(str(library_path / "data" / "zotero.sqlite"))
+        connection.executescript("""
+            CREATE TABLE itemAttachments (itemID INTEGER PRIMARY KEY, linkMode INT, path TEXT);
+            CREATE TABLE deletedItems (itemID INTEGER PRIMARY KEY);
+            INSERT INTO itemAttachments VALUES (1, 2, 'attachments:folder_0/file_0_0.pdf');
+            """)
+        connection.commit()
+        connection.close()
+        for command, options in (
+            ("relocate", {"foldername_suffix": "0"}),
+            ("status", {}),
+        ):
+            jobs.append(
+                {
+                    "command": command,
+                    "library_id": library_id,
+                    "profile_directory": str(library_path / "profile"),
+                    "options": options,
+                }
+            )
+    job_file = {"defaults": {"backend": "local"}, "jobs": jobs}
+    if thresholds:
+        job_file["thresholds"] = thresholds
+    job_path = root_path / "jobs.json"
+    job_path.write_text(json.dumps(job_file))
+    return job_path
+
+
+def test_job_file(tmp_path, monkeypatch):
+    created_zots = []
+
+    class CountedZot(cli.Zot):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created_zots.append(self)
+
+    monkeypatch.setattr(cli, "Zot", CountedZot)
+    stream = io.StringIO()
+    assert main(["--job-file", str(tmp_job_file(tmp_path))], stream) == 0
+    # one Zot object per library for the relocate and status jobs
+    assert len(created_zots) == 2
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    job_end_lines = [line for line in lines if line["event"] == "job_end"]
+    assert [line["job"] for line in job_end_lines] == [0, 1, 2, 3]
+    # the files held by the relocations are listed, not counted
+    assert [line["file_count"] for line in job_end_lines] == [2, 0, 2, 0]
+    assert job_end_lines[1]["relocations"][0]["file_count"] == 2
+    assert job_end_lines[0]["summary"]["counters"]["files_moved"] == 2
+    assert job_end_lines[1]["relocations"][0]["foldername"] == "_unlinked_files_0"
+    assert lines[-1]["event"] == "end"
+    assert lines[-1]["error_count"] == 0
+
+    stream = io.StringIO()
+    assert (
+        main(
+            ["--max-files", "3", "--backend", "local"]
+            + ["--profile-directory", str(tmp_path / "0" / "profile"), "restore"],
+            stream,
+        )
+        == 0
+    )
+    assert json.loads(stream.getvalue().splitlines()[-1])["file_count"] == 2
+
+
+def test_thresholds(tmp_path):
+    stream = io.StringIO()
+    job_path = tmp_job_file(tmp_path, {"max_files": 3})
+    assert main(["--job-file", str(job_path)], stream) == 3
+    end_line = json.loads(stream.getvalue().splitlines()[-1])
+    assert end_line["exceeded_thresholds"] == {"max_files": {"limit": 3, "value": 4}}
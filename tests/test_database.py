@@ -0,0 +1,48 @@
+import sqlite3
+
+from zotutil.database import *
+
+
+def tmp_database(data_path):
+    connection = sqlite3.connect(str(data_path / "zotero.sqlite"))
+    connection.executescript("""
+        CREATE TABLE itemAttachments (itemID INTEGER PRIMARY KEY, linkMode INT, path TEXT);
+        CREATE TABLE deletedItems (itemID INTEGER PRIMARY KEY);
+        CREATE TABLE items (itemID INTEGER PRIMARY KEY, key TEXT);
+        INSERT INTO items VALUES (1, 'AAAAAAAA');
+        INSERT INTO items VALUES (3, 'CCCCCCCC');
+        INSERT INTO items VALUES (5, 'EEEEEEEE');
+        INSERT INTO items VALUES (6, 'FFFFFFFF');
+        INSERT INTO itemAttachments VALUES (1, 2, 'attachments:folder_0/file_0.pdf');
+        INSERT INTO itemAttachments VALUES (2, 2, 'attachments:file_1.pdf');
+        INSERT INTO itemAttachments VALUES (3, 0, 'storage:file_2.pdf');
+        INSERT INTO itemAttachments VALUES (4, 3, NULL);
+        INSERT INTO itemAttachments VALUES (5, 2, 'attachments:file_3.pdf');
+        INSERT INTO deletedItems VALUES (5);
+        """)
+    connection.commit()
+    connection.close()
+
+
+def test_retrieve_attachment_paths(tmp_path):
+    tmp_database(tmp_path)
+    connection = connect_database(tmp_path)
+    assert sorted(retrieve_attachment_paths(connection)) == [
+        "attachments:file_1.pdf",
+        "attachments:folder_0/file_0.pdf",
+    ]
+    assert sorted(
+        retrieve_attachment_paths(connection, link_modes=(LINK_MODE_IMPORTED_FILE,))
+    ) == ["storage:file_2.pdf"]
+    connection.close()
+
+
+def test_retrieve_attachment_keys(tmp_path):
+    tmp_database(tmp_path)
+    connection = connect_database(tmp_path)
+    assert sorted(retrieve_attachment_keys(connection)) == [
+        "AAAAAAAA",
+        "CCCCCCCC",
+        "EEEEEEEE",
+    ]
+    connection.close()
@@ -0,0 +1,46 @@
+from zotutil.dedup import *
+
+
+def test_find_duplicates(tmp_path):
+    contents = {
+        "linked_0": b"a" * 10 + b"b" * 10 + b"c" * 10,
+        "linked_1": b"a" * 10 + b"d" * 10 + b"c" * 10,
+        "unlinked_0": b"a" * 10 + b"d" * 10 + b"c" * 10,
+        "unlinked_1": b"a" * 10 + b"e" * 10 + b"c" * 10,
+        "unlinked_2": b"a" * 31,
+        "unlinked_3": b"",
+        "linked_2": b"",
+    }
+    for filename, content in contents.items():
+        (tmp_path / filename).write_bytes(content)
+    candidate_paths = [str(tmp_path / ("unlinked_" + str(index))) for index in range(4)]
+    reference_paths = [str(tmp_path / ("linked_" + str(index))) for index in range(3)]
+    candidate_paths.append(str(tmp_path / "unlinked_4"))
+
+    hash_cache = HashCache(tmp_path / "hashes.json")
+    duplicates, errors = find_duplicates(
+        candidate_paths, reference_paths, 2, hash_cache, block_size=10
+    )
+    assert duplicates == {
+        candidate_paths[0]: (reference_paths[1],),
+        candidate_paths[1]: (),
+        candidate_paths[2]: (),
+        candidate_paths[3]: (reference_paths[2],),
+    }
+    assert list(errors) == [candidate_paths[4]]
+
+    # only the files sharing a size with another group are hashed
+    hash_cache.save()
+    hash_cache = HashCache(tmp_path / "hashes.json")
+    stat_result = (tmp_path / "unlinked_2").stat()
+    assert (
+        hash_cache.get(candidate_paths[2], 31, stat_result.st_mtime_ns, "partial")
+        is None
+    )
+    stat_result = (tmp_path / "linked_1").stat()
+    assert hash_cache.get(
+        reference_paths[1], 30, stat_result.st_mtime_ns, "partial"
+    ) == hash_file(reference_paths[1], 10)
+    assert hash_cache.get(
+        reference_paths[1], 30, stat_result.st_mtime_ns, "full"
+    ) == hash_file(reference_paths[1])
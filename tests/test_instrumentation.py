@@ -0,0 +1,60 @@
+import json
+
+from zotutil.instrumentation import *
+
+from .test_zot import tmp_zot
+
+
+class RecordingInstrumentation(Instrumentation):
+    def __init__(self):
+        super().__init__(progress_interval=0)
+        self.events = []
+
+    def on_run_start(self, run):
+        self.events.append(("run_start", run))
+
+    def on_run_end(self, run, duration, summary):
+        self.events.append(("run_end", run))
+
+    def on_phase_end(self, phase, duration):
+        self.events.append(("phase_end", phase))
+
+    def on_progress(self, phase, done, total):
+        self.events.append(("progress", phase, done, total))
+
+
+def test_instrumentation(tmp_path):
+    zot = tmp_zot(tmp_path)
+    zot._instrumentation = instrumentation = RecordingInstrumentation()
+    assert zot.relocate_unlinked_files(foldername_suffix="0") == {}
+    assert instrumentation.events[0] == ("run_start", "relocate_unlinked_files")
+    assert instrumentation.events[-1] == ("run_end", "relocate_unlinked_files")
+    assert ("progress", "relocate_files", 2, 2) in instrumentation.events
+    summary = instrumentation.summary()
+    assert set(summary["phases"]) == {
+        "retrieve_attachments",
+        "scan_files",
+        "relocate_files",
+        "remove_empty_directories",
+    }
+    assert summary["counters"] == {
+        "attachments_fetched": 1,
+        "files_scanned": 3,
+        "files_moved": 2,
+        "errors": 0,
+        "bytes_moved": 0,
+    }
+
+
+def test_json_summary_exporter(tmp_path):
+    zot = tmp_zot(tmp_path)
+    zot._instrumentation = JSONSummaryExporter(tmp_path / "summaries")
+    zot.relocate_unlinked_files(foldername_suffix="0")
+    zot.restore_unlinked_files()
+    summary_paths = sorted((tmp_path / "summaries").iterdir())
+    assert [summary_path.name.rsplit("_", 1)[0] for summary_path in summary_paths] == [
+        "relocate_unlinked_files",
+        "restore_unlinked_files",
+    ]
+    with summary_paths[1].open() as fh:
+        assert json.load(fh)["counters"]["files_moved"] == 2
@@ -0,0 +1,54 @@
+import json
+
+from zotutil.journal import *
+
+
+def test_read_relocation_records(tmp_path):
+    # a legacy map along with a journal
+    with (tmp_path / RELOCATION_MAP_FILENAME).open("wt") as fh:
+        json.dump({"relocated_0": "original_0", "relocated_1": "original_1"}, fh)
+    with RelocationJournal(tmp_path, "1") as journal:
+        journal.record("move", (("relocated_2", "original_2"),))
+        journal.record("moved", (("relocated_2", "original_2"),))
+        journal.record("restored", (("relocated_0", "original_0"),))
+        journal.record("move", (("relocated_3", "original_3"),))
+        journal.record("failed", (("relocated_3", "original_3"),))
+    assert dict(read_relocation_records(tmp_path)) == {
+        "relocated_1": "original_1",
+        "relocated_2": "original_2",
+    }
+    assert dict(read_relocation_records(tmp_path, "1")) == {"relocated_2": "original_2"}
+
+    with RelocationJournal(tmp_path, "2") as journal:
+        journal.record("removed", (("relocated_1", "original_1"),))
+        journal.record("removed", (("relocated_2", "original_2"),))
+    assert discard_relocation_records(tmp_path)
+    assert not (tmp_path / RELOCATION_MAP_FILENAME).exists()
+    assert not (tmp_path / RELOCATION_JOURNAL_FILENAME).exists()
+
+
+def test_recover_relocation_journal(tmp_path):
+    (tmp_path / "relocated_0").touch()
+    with RelocationJournal(tmp_path, "0") as journal:
+        journal.record(
+            "move",
+            (
+                (tmp_path / "relocated_0", tmp_path / "original_0"),
+                (tmp_path / "relocated_1", tmp_path / "original_1"),
+            ),
+        )
+    # torn by a crash
+    with (tmp_path / RELOCATION_JOURNAL_FILENAME).open("at") as fh:
+        fh.write('{"op": "moved", "run": "0", "relocat')
+    assert dict(read_relocation_records(tmp_path)) == {
+        str(tmp_path / "relocated_0"): str(tmp_path / "original_0")
+    }
+
+    moved_path_pairs, unmoved_path_pairs = recover_relocation_journal(tmp_path)
+    assert moved_path_pairs == {
+        "0": [(str(tmp_path / "relocated_0"), str(tmp_path / "original_0"))]
+    }
+    assert unmoved_path_pairs == {
+        "0": [(str(tmp_path / "relocated_1"), str(tmp_path / "original_1"))]
+    }
+    assert recover_relocation_journal(tmp_path) == ({}, {})
@@ -0,0 +1,54 @@
+import os
+from zipfile import ZipFile
+
+from zotutil.preferences import *
+
+PREFERENCES = r"""
+// Mozilla User Preferences
+user_pref("extensions.zotero.dataDir", "C:\\Users\\user\\Zotero");
+user_pref("extensions.zotero.sync.storage.enabled", false);
+user_pref("extensions.zotero.lastViewedFolder", "L1");
+user_pref("extensions.zotfile.filetypes", "pdf,doc,docx");
+user_pref("extensions.zotero.prefVersion", 6);
+pref("extensions.zotfile.dest_dir", 'folder "dest"');
+"""
+
+
+def test_parse_preferences():
+    assert parse_preferences(PREFERENCES) == {
+        "extensions.zotero.dataDir": "C:\\Users\\user\\Zotero",
+        "extensions.zotero.sync.storage.enabled": False,
+        "extensions.zotero.lastViewedFolder": "L1",
+        "extensions.zotfile.filetypes": "pdf,doc,docx",
+        "extensions.zotero.prefVersion": 6,
+        "extensions.zotfile.dest_dir": 'folder "dest"',
+    }
+
+
+def test_preference_store(tmp_path):
+    preference_store = PreferenceStore()
+    preference_path = tmp_path / "prefs.js"
+    preference_path.write_text(PREFERENCES)
+    preferences = preference_store.read_preferences(preference_path)
+    assert preference_store.read_preferences(preference_path) is preferences
+
+    preference_path.write_text('user_pref("extensions.zotero.prefVersion", 7);')
+    os.utime(str(preference_path), ns=(0, 0))
+    assert preference_store.read_preferences(preference_path) == {
+        "extensions.zotero.prefVersion": 7
+    }
+
+    extensions_directory = tmp_path / "extensions"
+    extensions_directory.mkdir()
+    plugin_xpi_path = extensions_directory / "zotfile@columbia.edu.xpi"
+    with ZipFile(str(plugin_xpi_path), "w") as plugin_xpi:
+        plugin_xpi.writestr(
+            "defaults/preferences/defaults.js",
+            'pref("extensions.zotfile.filetypes", "pdf,epub");',
+        )
+    assert preference_store.find_plugin(extensions_directory, "ZotFile") == (
+        plugin_xpi_path
+    )
+    assert preference_store.read_plugin_preferences(plugin_xpi_path) == {
+        "extensions.zotfile.filetypes": "pdf,epub"
+    }
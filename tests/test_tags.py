@@ -0,0 +1,43 @@
+from zotutil.tags import *
+
+ITEM_ENTRIES = (
+    {
+        "key": "AAAAAAAA",
+        "version": 1,
+        "data": {"tags": [{"tag": "climate change"}, {"tag": "Climate Change"}]},
+    },
+    {"key": "BBBBBBBB", "version": 2, "data": {"tags": [{"tag": "Climate change"}]}},
+    {
+        "key": "CCCCCCCC",
+        "version": 3,
+        "data": {"tags": [{"tag": "climate change", "type": 1}, {"tag": "ﬁre"}]},
+    },
+    {"key": "DDDDDDDD", "version": 4, "data": {"tags": [{"tag": "Fire"}]}},
+    {"key": "EEEEEEEE", "version": 5, "data": {"tags": []}},
+)
+
+
+def test_plan_tag_case_unification():
+    plan = plan_tag_case_unification(ITEM_ENTRIES)
+    assert plan["groups"] == [
+        {
+            "canonical": "climate change",
+            "tags": {"Climate Change": 1, "Climate change": 1, "climate change": 2},
+        },
+        {"canonical": "Fire", "tags": {"Fire": 1, "ﬁre": 1}},
+    ]
+    assert plan["updates"] == [
+        {"key": "AAAAAAAA", "version": 1, "tags": [{"tag": "climate change"}]},
+        {"key": "BBBBBBBB", "version": 2, "tags": [{"tag": "climate change"}]},
+        {
+            "key": "CCCCCCCC",
+            "version": 3,
+            "tags": [{"tag": "climate change", "type": 1}, {"tag": "Fire"}],
+        },
+    ]
+
+    plan = plan_tag_case_unification(ITEM_ENTRIES, rule="title")
+    assert [group["canonical"] for group in plan["groups"]] == [
+        "Climate Change",
+        "Fire",
+    ]
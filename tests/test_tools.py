@@ -67,3 +67,71 @@ def test_remove_empty_directories(tmp_path):
     )
     for sub_path, expected in test_cases:
         assert (tmp_path / sub_path).is_file() == expected
+
+
+def test_walk_files(tmp_path):
+    tmp_file_sys(tmp_path)
+    (tmp_path / "_unlinked_files_0").mkdir()
+    (tmp_path / "_unlinked_files_0" / "file_1.txt").touch()
+    (tmp_path / "folder_1" / "file_1_0.pdf").touch()
+    assert set(walk_files(tmp_path, ("txt",))) == {
+        PurePath("file_0.txt"),
+        PurePath("folder_0", "file_0_0.txt"),
+    }
+    assert set(walk_files(tmp_path, ("txt", "pdf"), excluded_prefixes=())) == {
+        PurePath("file_0.txt"),
+        PurePath("folder_0", "file_0_0.txt"),
+        PurePath("folder_1", "file_1_0.pdf"),
+        PurePath("_unlinked_files_0", "file_1.txt"),
+    }
+    assert set(walk_file_relative_paths(tmp_path, ("txt",))) == {
+        "file_0.txt",
+        "folder_0/file_0_0.txt",
+    }
+
+
+def test_move_files(tmp_path):
+    tmp_file_sys(tmp_path)
+    (tmp_path / "file_1.txt").touch()
+    path_pairs = (
+        (tmp_path / "file_0.txt", tmp_path / "folder_2" / "file_0.txt"),
+        (
+            tmp_path / "folder_0" / "file_0_0.txt",
+            tmp_path / "folder_2" / "file_0_0.txt",
+        ),
+        (tmp_path / "file_1.txt", tmp_path / "folder_0" / "Thumbs.db"),
+        (tmp_path / "file_2.txt", tmp_path / "folder_2" / "file_2.txt"),
+    )
+    moved_path_pairs, errors = move_files(path_pairs, workers=2, replace=False)
+    assert moved_path_pairs == list(path_pairs[:2])
+    assert set(errors) == {tmp_path / "file_1.txt", tmp_path / "file_2.txt"}
+    assert isinstance(errors[tmp_path / "file_1.txt"], FileExistsError)
+    assert (tmp_path / "folder_2" / "file_0.txt").is_file()
+    assert not (tmp_path / "file_0.txt").exists()
+
+
+def test_remove_empty_directories_touched(tmp_path):
+    tmp_file_sys(tmp_path)
+    remove_empty_directories(tmp_path, (tmp_path / "folder_1" / "folder_1_0",))
+    test_cases = (
+        (PurePath(""), True),
+        (PurePath("folder_0", "folder_0_0"), True),
+        (PurePath("folder_1"), False),
+    )
+    for sub_path, expected in test_cases:
+        assert (tmp_path / sub_path).is_dir() == expected
+
+
+def test_find_emptied_directories(tmp_path):
+    tmp_file_sys(tmp_path)
+    emptied_directories = find_emptied_directories(
+        tmp_path,
+        (tmp_path / "folder_0" / "folder_0_0",),
+        (tmp_path / "folder_0" / "file_0_0.txt",),
+    )
+    assert emptied_directories == [
+        str(tmp_path / "folder_0" / "folder_0_0"),
+        str(tmp_path / "folder_0"),
+    ]
+    assert (tmp_path / "folder_0" / "file_0_0.txt").is_file()
+    assert (tmp_path / "folder_0" / "folder_0_0").is_dir()
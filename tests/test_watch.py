@@ -0,0 +1,106 @@
+import pytest
+
+from sys import platform
+
+from zotutil.watch import *
+
+
+def test_file_index(tmp_path):
+    (tmp_path / "folder_0").mkdir()
+    (tmp_path / "folder_0" / "file_0_0.pdf").touch()
+    (tmp_path / "file_0.txt").touch()
+    file_index = FileIndex(tmp_path, ("pdf",))
+    assert set(file_index) == {"folder_0/file_0_0.pdf"}
+
+    (tmp_path / "folder_1").mkdir()
+    (tmp_path / "folder_1" / "file_1_0.pdf").touch()
+    assert file_index.apply(
+        (
+            ("created", "folder_1", True),
+            ("created", "file_1.pdf", False),
+            ("deleted", "file_1.pdf", False),
+            ("created", "_unlinked_files/file_2.pdf", False),
+            ("deleted", "folder_0", True),
+        )
+    ) == ({"folder_1/file_1_0.pdf"}, {"folder_0/file_0_0.pdf"})
+    assert set(file_index) == {"folder_1/file_1_0.pdf"}
+
+    assert file_index.apply((("rescan", "", True),)) == (
+        {"folder_0/file_0_0.pdf"},
+        set(),
+    )
+
+
+@pytest.mark.skipif(not platform.startswith("linux"), reason="inotify on Linux only")
+def test_inotify_watcher(tmp_path):
+    (tmp_path / "folder_0").mkdir()
+    (tmp_path / "_unlinked_files").mkdir()
+    file_index = FileIndex(tmp_path)
+    with InotifyWatcher(tmp_path) as watcher:
+        (tmp_path / "folder_0" / "file_0_0.pdf").touch()
+        (tmp_path / "folder_1" / "folder_1_0").mkdir(parents=True)
+        (tmp_path / "folder_1" / "folder_1_0" / "file_1_0.pdf").touch()
+        (tmp_path / "_unlinked_files" / "file_0.pdf").touch()
+        added_paths = set()
+        for _ in range(10):
+            added_paths.update(file_index.apply(watcher.read_events(0.1))[0])
+        assert added_paths == {
+            "folder_0/file_0_0.pdf",
+            "folder_1/folder_1_0/file_1_0.pdf",
+        }
+
+        # a file created in a new directory after it is watched
+        (tmp_path / "folder_1" / "folder_1_0" / "file_1_1.pdf").touch()
+        (tmp_path / "folder_0" / "file_0_0.pdf").rename(tmp_path / "file_0.pdf")
+        assert file_index.apply(watcher.read_events(1)) == (
+            {"folder_1/folder_1_0/file_1_1.pdf", "file_0.pdf"},
+            {"folder_0/file_0_0.pdf"},
+        )
+
+
+@pytest.mark.skipif(not platform.startswith("linux"), reason="inotify on Linux only")
+def test_inotify_watch_errors(tmp_path):
+    import ctypes
+    import errno
+
+    class FailingLibc:
+        def __init__(self, libc, error_number):
+            self._libc = libc
+            self._error_number = error_number
+
+        def inotify_add_watch(self, *args):
+            ctypes.set_errno(self._error_number)
+            return -1
+
+        def __getattr__(self, name):
+            return getattr(self._libc, name)
+
+    (tmp_path / "folder_0").mkdir()
+    with InotifyWatcher(tmp_path) as watcher:
+        watcher._libc = FailingLibc(watcher._libc, errno.ENOENT)
+        assert not watcher._watch_directory("folder_0")
+        # a subtree left unwatched is an error, not a directory gone
+        watcher._libc = FailingLibc(watcher._libc._libc, errno.ENOSPC)
+        with pytest.raises(OSError) as error_info:
+            watcher._watch_directory("folder_0")
+        assert error_info.value.errno == errno.ENOSPC
+
+
+@pytest.mark.skipif(not platform.startswith("linux"), reason="inotify on Linux only")
+def test_inotify_watcher_closed_on_error(tmp_path, monkeypatch):
+    import errno
+    import os
+
+    file_descriptors = []
+
+    def failing_watch_directory(self, relative_directory):
+        file_descriptors.append(self._file_descriptor)
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    monkeypatch.setattr(InotifyWatcher, "_watch_directory", failing_watch_directory)
+    with pytest.raises(OSError):
+        InotifyWatcher(tmp_path)
+    with pytest.raises(OSError) as error_info:
+        os.fstat(file_descriptors[0])
+    assert error_info.value.errno == errno.EBADF
+    assert isinstance(create_watcher(tmp_path), PollingWatcher)
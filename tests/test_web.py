@@ -0,0 +1,183 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+from socketserver import ThreadingMixIn
+from email.utils import formatdate
+from threading import Thread
+import json
+import time
+
+import pytest
+
+from zotutil.web import *
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """A stand-in of the Web API items endpoint with paging headers, keeping connections alive."""
+
+    protocol_version = "HTTP/1.1"
+    total_results = 250
+    rate_limited = set()
+    client_ports = set()
+    backoff = "0"
+    retry_after = "0"
+    # whether or not to drop each connection once answered, as if idle too long
+    drop_connections = False
+
+    def do_GET(self):
+        self.client_ports.add(self.client_address[1])
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith("/deleted"):
+            self._send_body(json.dumps({"items": ["0"]}).encode("utf-8"))
+            return
+        if query.get("format") == ["keys"]:
+            keys = () if url.path.endswith("/trash") else range(self.total_results)
+            self._send_body("\n".join(str(key) for key in keys).encode("utf-8"))
+            return
+        start = int(query["start"][0])
+        limit = int(query["limit"][0])
+        if start not in self.rate_limited:
+            # every later page is rate limited once
+            if start:
+                self.rate_limited.add(start)
+                self.send_response(429)
+                self.send_header("Retry-After", self.retry_after)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        body = json.dumps(
+            [
+                {"key": str(index), "data": {"itemType": query["itemType"][0]}}
+                for index in range(start, min(start + limit, self.total_results))
+            ]
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Total-Results", str(self.total_results))
+        self.send_header("Backoff", self.backoff)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = self.drop_connections
+
+    def do_POST(self):
+        items = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        assert self.headers["Zotero-Write-Token"]
+        self._send_body(
+            json.dumps(
+                {
+                    "success": {
+                        str(index): item["key"] for index, item in enumerate(items)
+                    }
+                }
+            ).encode("utf-8")
+        )
+
+    def _send_body(self, body):
+        self.send_response(200)
+        self.send_header("Last-Modified-Version", "7")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def stand_in_url():
+    StandInHandler.rate_limited = set()
+    StandInHandler.client_ports = set()
+    StandInHandler.backoff = "0"
+    StandInHandler.retry_after = "0"
+    StandInHandler.drop_connections = False
+    server = StandInServer(("127.0.0.1", 0), StandInHandler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:" + str(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def test_iterate_items(stand_in_url):
+    entries = tuple(
+        iterate_items(
+            "0", "user", concurrency=2, base_url=stand_in_url, itemType="attachment"
+        )
+    )
+    assert sorted(int(entry["key"]) for entry in entries) == list(range(250))
+    assert set(entry["data"]["itemType"] for entry in entries) == {"attachment"}
+
+
+def test_web_session(stand_in_url):
+    with WebSession(stand_in_url, pool_size=1) as session:
+        entries = tuple(
+            iterate_items(
+                "0", "user", concurrency=2, session=session, itemType="attachment"
+            )
+        )
+        assert len(entries) == 250
+        # the connection is kept alive across the pages and the retries
+        assert len(StandInHandler.client_ports) == 1
+        stats = session.stats
+        assert stats["requests"] == 5
+        assert stats["retries"] == 2
+        assert stats["bytes_received"] > 0
+
+        # a backoff pauses every caller of the session
+        StandInHandler.backoff = "0.2"
+        session.request("/users/0/items", {"start": 0, "limit": 1, "itemType": "a"})
+        StandInHandler.backoff = "0"
+        start_time = time.monotonic()
+        session.request("/users/0/items", {"start": 0, "limit": 1, "itemType": "a"})
+        assert time.monotonic() - start_time >= 0.15
+        assert session.stats["wait_time"] > 0
+
+
+def test_web_session_retries(stand_in_url):
+    session = WebSession(stand_in_url, max_retries=0)
+    with pytest.raises(ValueError, match="too many retries"):
+        session.request("/users/0/items", {"start": 100, "limit": 1, "itemType": "a"})
+    session.close()
+
+
+def test_web_session_stale_connections(stand_in_url):
+    StandInHandler.drop_connections = True
+    # a connection dropped by the server is neither retried with backoff nor pausing the session
+    with WebSession(stand_in_url, pool_size=1, backoff_factor=10) as session:
+        start_time = time.monotonic()
+        for _ in range(3):
+            session.request("/users/0/items", {"start": 0, "limit": 1, "itemType": "a"})
+        assert time.monotonic() - start_time < 5
+        assert session.stats["requests"] == 3
+        assert session.stats["retries"] == 0
+        assert session.stats["wait_time"] == 0
+
+
+def test_web_session_retry_after_date(stand_in_url):
+    StandInHandler.retry_after = formatdate(time.time() - 60, usegmt=True)
+    with WebSession(stand_in_url, backoff_factor=10) as session:
+        start_time = time.monotonic()
+        session.request("/users/0/items", {"start": 100, "limit": 1, "itemType": "a"})
+        assert time.monotonic() - start_time < 5
+        assert session.stats["retries"] == 1
+
+
+def test_web_library(stand_in_url):
+    with WebSession(stand_in_url, pool_size=1) as session:
+        library = WebLibrary(session, "0", "user", "key")
+        # one page at a time, the rate limited pages being retried
+        entries = tuple(library.items(itemType="attachment"))
+        assert [int(entry["key"]) for entry in entries] == list(range(250))
+        assert session.stats["retries"] == 2
+        # all the keys in one response
+        assert len(library.item_keys(itemType="attachment")) == 250
+        assert library.item_keys(trash=True, itemType="attachment") == []
+        assert library.last_modified_version() == 7
+        assert library.deleted(0) == {"items": ["0"]}
+        assert library.update_items([{"key": "A"}, {"key": "B"}]) == {
+            "success": {"0": "A", "1": "B"}
+        }
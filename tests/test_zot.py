@@ -0,0 +1,470 @@
+import subprocess
+import sqlite3
+import sys
+import json
+from pathlib import PurePath, Path
+
+import pytest
+
+from zotutil.tools import move_file
+from zotutil.zot import Zot
+import zotutil.zot
+from zotutil.watch import PollingWatcher
+
+
+def fake_key(index):
+    """An 8 characters item key of the Zotero alphabet, e.g. "22222222" for 0."""
+    key = ""
+    for _ in range(8):
+        index, digit = divmod(index, 32)
+        key = "23456789ABCDEFGHIJKLMNPQRSTUVWXYZ"[digit] + key
+    return key
+
+
+class FakeLibrary:
+    """An in-memory stand-in of `zotutil.web.WebLibrary`,
+    answering all the keys unless a `limit` is set, as the Web API does.
+    """
+
+    def __init__(self, attachment_paths):
+        self.attachment_entries = [
+            {
+                "key": fake_key(index),
+                "data": {
+                    "linkMode": "linked_file",
+                    "path": "attachments:" + attachment_path,
+                },
+            }
+            for index, attachment_path in enumerate(attachment_paths)
+        ]
+        self.created_items = []
+
+    def items(self, concurrency=1, **params):
+        return iter(list(self.attachment_entries))
+
+    def item_keys(self, trash=False, limit=None, **params):
+        if trash:
+            return []
+        return [
+            attachment_entry["key"]
+            for attachment_entry in self.attachment_entries[:limit]
+        ]
+
+    def update_items(self, items):
+        self.created_items.extend(items)
+        return {"success": dict((str(index), "") for index in range(len(items)))}
+
+
+def tmp_zot(root_path, attachment_paths=("folder_0/file_0_0.pdf",), **kwargs):
+    """
+    pytest-*/*
+    ├── profile
+    │   ├── profiles.ini
+    │   └── default
+    │       └── prefs.js
+    ├── data
+    └── attachments
+        ├── folder_0
+        │   ├── file_0_0.pdf
+        │   └── file_0_1.pdf
+        ├── file_0.pdf
+        └── file_1.txt
+
+    """
+    profile_path = root_path / "profile"
+    (profile_path / "default").mkdir(parents=True)
+    (profile_path / "profiles.ini").write_text("[Profile0]\nPath=default\n")
+    (root_path / "data").mkdir()
+    (root_path / "attachments" / "folder_0").mkdir(parents=True)
+    (profile_path / "default" / "prefs.js").write_text(
+        "".join(
+            "user_pref(" + json.dumps(key) + ", " + json.dumps(value) + ");\n"
+            for key, value in (
+                ("extensions.zotero.dataDir", str(root_path / "data")),
+                ("extensions.zotfile.dest_dir", str(root_path / "attachments")),
+                ("extensions.zotfile.filetypes", "pdf, djvu"),
+            )
+        )
+    )
+    for path_parts in (
+        ("folder_0", "file_0_0.pdf"),
+        ("folder_0", "file_0_1.pdf"),
+        ("file_0.pdf",),
+        ("file_1.txt",),
+    ):
+        (root_path / "attachments").joinpath(*path_parts).touch()
+
+    zot = Zot("0", "user", "key", **kwargs)
+    zot.profile_directory = profile_path
+    zot._web_library = FakeLibrary(attachment_paths)
+    return zot
+
+
+def test_lazy_construction(tmp_path):
+    zot = Zot("0", "user", "key")
+    assert not hasattr(zot, "_library")
+    assert not hasattr(zot, "_web_library")
+    assert not hasattr(zot, "_data_directory")
+    assert not hasattr(zot, "_session")
+    # in a fresh interpreter, the other tests having imported the Web API stack
+    imported_modules = (
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, zotutil.cli, zotutil.zot; zotutil.zot.Zot('0', 'user', 'key');"
+                " print(' '.join(sys.modules))",
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+            cwd=str(Path(__file__).resolve().parents[1]),
+        )
+        .stdout.decode("utf-8")
+        .split()
+    )
+    for module in ("pyzotero.zotero", "http.client", "asyncio", "ctypes"):
+        assert module not in imported_modules
+
+
+def test_relocate_and_restore_unlinked_files(tmp_path):
+    zot = tmp_zot(tmp_path)
+    attachment_path = tmp_path / "attachments"
+    assert zot.data_directory == tmp_path / "data"
+    assert zot.retrieve_attachment_relative_paths() == (
+        PurePath("folder_0", "file_0_0.pdf"),
+    )
+
+    zot._web_library.attachment_entries.append(
+        {
+            "key": "KEY99999",
+            "data": {"linkMode": "imported_file", "path": "storage:file_0.pdf"},
+        }
+    )
+    assert list(
+        zot.iterate_attachment_relative_paths(("linked_file", "imported_file"))
+    ) == [PurePath("folder_0", "file_0_0.pdf"), PurePath("storage:file_0.pdf")]
+
+    assert zot.relocate_unlinked_files(foldername_suffix="0") == {}
+    relocation_path = attachment_path / "_unlinked_files_0"
+    assert set(item.name for item in relocation_path.iterdir()) == {
+        "file_0_1.pdf",
+        "file_0.pdf",
+        "_relocation_journal.jsonl",
+    }
+    assert (attachment_path / "folder_0" / "file_0_0.pdf").is_file()
+    assert (attachment_path / "file_1.txt").is_file()
+    relocations = zot.list_unlinked_files_relocations()
+    assert [relocation["foldername"] for relocation in relocations] == [
+        "_unlinked_files_0"
+    ]
+    assert relocations[0]["file_count"] == 2
+    assert [
+        relocated_file["relocated"]
+        for relocated_file in zot.locate_unlinked_file("file_0.pdf")
+    ] == [str(relocation_path / "file_0.pdf")]
+
+    assert zot.restore_unlinked_files(workers=2) == {}
+    assert not relocation_path.exists()
+    assert (attachment_path / "folder_0" / "file_0_1.pdf").is_file()
+    assert (attachment_path / "file_0.pdf").is_file()
+    assert zot.list_unlinked_files_relocations() == ()
+
+
+def test_relocate_sharded(tmp_path):
+    zot = tmp_zot(tmp_path)
+    attachment_path = tmp_path / "attachments"
+    # colliding with folder_0/file_0_1.pdf under a flat layout
+    (attachment_path / "file_0_1.pdf").write_bytes(b"0")
+
+    assert zot.relocate_unlinked_files(foldername_suffix="0", sharded=True) == {}
+    relocation_path = attachment_path / "_unlinked_files_0"
+    relocated_paths = sorted(
+        path for path in relocation_path.glob("*/*") if path.suffix == ".pdf"
+    )
+    assert len(relocated_paths) == 3
+    assert all(len(path.parent.name) == 2 for path in relocated_paths)
+    assert not (attachment_path / "file_0_1.pdf").exists()
+
+    assert zot.restore_unlinked_files() == {}
+    assert not relocation_path.exists()
+    assert (attachment_path / "file_0_1.pdf").read_bytes() == b"0"
+    assert (attachment_path / "folder_0" / "file_0_1.pdf").is_file()
+
+    zot.relocate_unlinked_files(foldername_suffix="0", sharded=True)
+    zot.remove_unlinked_files()
+    assert not relocation_path.exists()
+    assert not (attachment_path / "file_0_1.pdf").exists()
+    assert (attachment_path / "folder_0" / "file_0_0.pdf").is_file()
+
+
+def test_relocate_archive(tmp_path):
+    zot = tmp_zot(tmp_path)
+    attachment_path = tmp_path / "attachments"
+    (attachment_path / "file_0.pdf").write_bytes(b"0" * 100)
+
+    assert zot.relocate_unlinked_files(foldername_suffix="0", archive="deflated") == {}
+    relocation_path = attachment_path / "_unlinked_files_0"
+    archive_paths = list(relocation_path.glob("*.zip"))
+    assert len(archive_paths) == 1
+    assert not (attachment_path / "file_0.pdf").exists()
+    assert zot.list_unlinked_files_relocations()[0]["bytes"] == 100
+    assert [
+        relocated_file["relocated"]
+        for relocated_file in zot.locate_unlinked_file(attachment_path / "file_0.pdf")
+    ] == [str(archive_paths[0] / "file_0.pdf")]
+
+    # a single file extracted, then the rest of its batch
+    assert zot.restore_unlinked_files(files=("file_0.pdf",)) == {}
+    assert (attachment_path / "file_0.pdf").read_bytes() == b"0" * 100
+    assert not (attachment_path / "folder_0" / "file_0_1.pdf").exists()
+    assert zot.list_unlinked_files_relocations()[0]["file_count"] == 1
+    assert zot.restore_unlinked_files(files=archive_paths) == {}
+    assert not relocation_path.exists()
+    assert (attachment_path / "file_0.pdf").read_bytes() == b"0" * 100
+    assert (attachment_path / "folder_0" / "file_0_1.pdf").is_file()
+
+    zot.relocate_unlinked_files(foldername_suffix="0", archive="stored")
+    zot.remove_unlinked_files()
+    assert not relocation_path.exists()
+    assert not (attachment_path / "file_0.pdf").exists()
+
+
+def test_relocate_shared_libraries(tmp_path):
+    zot = tmp_zot(tmp_path, shared_libraries=[("1", "group")])
+    attachment_path = tmp_path / "attachments"
+    shared_zot = zot.shared_zots[0]
+    assert shared_zot.attachment_root_directory == attachment_path
+    # the session is created on first use, then shared
+    assert not hasattr(zot, "_session")
+    assert shared_zot.session is zot.session
+    shared_zot._web_library = FakeLibrary(("file_0.pdf",))
+
+    assert zot.relocate_unlinked_files(foldername_suffix="0") == {}
+    assert (attachment_path / "folder_0" / "file_0_0.pdf").is_file()
+    assert (attachment_path / "file_0.pdf").is_file()
+    assert (attachment_path / "_unlinked_files_0" / "file_0_1.pdf").is_file()
+
+
+def test_find_duplicate_unlinked_files(tmp_path):
+    zot = tmp_zot(tmp_path)
+    attachment_path = tmp_path / "attachments"
+    (attachment_path / "folder_0" / "file_0_0.pdf").write_bytes(b"0")
+    (attachment_path / "file_0.pdf").write_bytes(b"0")
+    assert zot.find_duplicate_unlinked_files() == {
+        "duplicates": {"file_0.pdf": ["folder_0/file_0_0.pdf"]},
+        "orphaned": ["folder_0/file_0_1.pdf"],
+        "errors": {},
+    }
+    assert (tmp_path / "data" / "zotutil" / "hashes.json").is_file()
+
+
+def test_check_attachment_consistency(tmp_path):
+    zot = tmp_zot(tmp_path, ("folder_0/file_0_0.pdf", "file_1.txt", "file_2.pdf"))
+    assert sorted(
+        (status["status"], status["path"])
+        for status in zot.check_attachment_consistency()
+    ) == [
+        ("missing", "file_2.pdf"),
+        ("orphaned", "file_0.pdf"),
+        ("orphaned", "folder_0/file_0_1.pdf"),
+    ]
+
+
+def test_watch_unlinked_files(tmp_path):
+    zot = tmp_zot(tmp_path)
+    attachment_path = tmp_path / "attachments"
+    watch = zot.watch_unlinked_files(
+        relocate=True,
+        foldername_suffix="0",
+        cache=False,
+        interval=0,
+        grace_period=0,
+        watcher=PollingWatcher(attachment_path),
+    )
+    assert next(watch) == {
+        "unlinked": ["file_0.pdf", "folder_0/file_0_1.pdf"],
+        "errors": {},
+    }
+    assert (attachment_path / "_unlinked_files_0" / "file_0.pdf").is_file()
+
+    (attachment_path / "folder_0" / "file_0_2.pdf").touch()
+    assert next(watch) == {"unlinked": ["folder_0/file_0_2.pdf"], "errors": {}}
+    assert (attachment_path / "_unlinked_files_0" / "file_0_2.pdf").is_file()
+    assert (attachment_path / "folder_0" / "file_0_0.pdf").is_file()
+    watch.close()
+
+
+def test_tag_case_unification(tmp_path):
+    zot = tmp_zot(tmp_path)
+    zot._web_library.attachment_entries = [
+        {
+            "key": "KEY" + str(index).zfill(5),
+            "version": index,
+            "data": {"tags": [{"tag": tag}]},
+        }
+        for index, tag in enumerate(("Tag",) * 60 + ("tag",) * 40)
+    ]
+    plan = zot.plan_tag_case_unification()
+    assert len(plan["updates"]) == 40
+
+    checkpoint_path = tmp_path / "checkpoint.json"
+    checkpoint_path.write_text('{"next": 30}')
+    result = zot.apply_tag_case_unification(plan, checkpoint_path=checkpoint_path)
+    assert result["next"] == 40
+    assert len(zot._web_library.created_items) == 10
+    assert not checkpoint_path.exists()
+    assert zot.apply_tag_case_unification(plan, dry_run=True)["next"] == 40
+
+
+def test_plan_and_apply_unlinked_files(tmp_path):
+    zot = tmp_zot(tmp_path, ("file_0.pdf",))
+    attachment_path = tmp_path / "attachments"
+    relocation_path = attachment_path / "_unlinked_files_0"
+    plan = json.loads(
+        json.dumps(zot.plan_relocate_unlinked_files(foldername_suffix="0"))
+    )
+    assert plan["operation"] == "relocate"
+    assert plan["file_count"] == 2
+    assert plan["directories"] == [str(attachment_path / "folder_0")]
+    assert not relocation_path.exists()
+
+    (attachment_path / "folder_0" / "file_0_1.pdf").write_text("changed")
+    errors = zot.apply_unlinked_files_plan(plan)
+    assert list(errors) == [attachment_path / "folder_0" / "file_0_1.pdf"]
+    assert (attachment_path / "folder_0" / "file_0_1.pdf").is_file()
+    assert not (attachment_path / "folder_0" / "file_0_0.pdf").exists()
+    assert (relocation_path / "file_0_0.pdf").is_file()
+
+    plan = zot.plan_restore_unlinked_files()
+    assert plan["file_count"] == 1
+    assert plan["directories"] == [str(relocation_path)]
+    assert zot.apply_unlinked_files_plan(plan) == {}
+    assert (attachment_path / "folder_0" / "file_0_0.pdf").is_file()
+    assert not relocation_path.exists()
+
+
+def test_orphaned_storage_folders(tmp_path):
+    # more attachments than a page of keys, the last one linked to a storage folder
+    zot = tmp_zot(tmp_path, ("folder_0/file_0_0.pdf",) * 150)
+    storage_path = tmp_path / "data" / "storage"
+    # the other synced libraries are only known to the local database
+    with pytest.raises(ValueError, match="no database found"):
+        list(zot.find_orphaned_storage_folders())
+    connection = sqlite3.connect(str(tmp_path / "data" / "zotero.sqlite"))
+    connection.executescript("""
+        CREATE TABLE items (itemID INTEGER PRIMARY KEY, key TEXT);
+        CREATE TABLE itemAttachments (itemID INTEGER PRIMARY KEY, linkMode INT, path TEXT);
+        INSERT INTO items VALUES (1, 'GGGGGGGG');
+        INSERT INTO itemAttachments VALUES (1, 0, 'storage:file.pdf');
+        """)
+    connection.commit()
+    connection.close()
+    for key, filename in (
+        (fake_key(149), "file.pdf"),
+        ("GGGGGGGG", "file.pdf"),
+        ("ABCD2345", "file.pdf"),
+        ("ABCD2345", ".zotero-ft-cache"),
+        ("not_a_key", "file.pdf"),
+    ):
+        (storage_path / key).mkdir(parents=True, exist_ok=True)
+        (storage_path / key / filename).write_text("content")
+    assert list(zot.find_orphaned_storage_folders()) == [
+        {
+            "key": "ABCD2345",
+            "path": str(storage_path / "ABCD2345"),
+            "file_count": 2,
+            "size": 14,
+        }
+    ]
+
+    assert zot.relocate_orphaned_storage_folders() == {}
+    relocation_path = tmp_path / "attachments" / "_unlinked_files_storage"
+    assert (relocation_path / "ABCD2345" / ".zotero-ft-cache").is_file()
+    assert not (storage_path / "ABCD2345").exists()
+    assert (storage_path / fake_key(149) / "file.pdf").is_file()
+    assert (storage_path / "GGGGGGGG" / "file.pdf").is_file()
+
+    assert zot.restore_unlinked_files() == {}
+    assert (storage_path / "ABCD2345" / "file.pdf").is_file()
+    assert not relocation_path.exists()
+
+
+def test_absolute_attachment_paths(tmp_path):
+    zot = tmp_zot(tmp_path, ())
+    attachment_path = tmp_path / "attachments"
+    for path in (attachment_path / "folder_0" / "file_0_0.pdf", tmp_path / "file.pdf"):
+        zot._web_library.attachment_entries.append(
+            {"key": "KEY99999", "data": {"linkMode": "linked_file", "path": str(path)}}
+        )
+    assert zot.retrieve_attachment_relative_paths() == (
+        PurePath("folder_0", "file_0_0.pdf"),
+    )
+    assert zot.relocate_unlinked_files(foldername_suffix="0") == {}
+    assert (attachment_path / "folder_0" / "file_0_0.pdf").is_file()
+
+
+def test_relocate_colliding_names(tmp_path):
+    zot = tmp_zot(tmp_path)
+    attachment_path = tmp_path / "attachments"
+    (attachment_path / "folder_1").mkdir()
+    (attachment_path / "folder_1" / "file_0.pdf").write_text("folder_1")
+    (attachment_path / "file_0.pdf").write_text("root")
+    # the second file of a name is prefixed by the hash digits of its path
+    assert zot.relocate_unlinked_files(foldername_suffix="0") == {}
+    assert len(list((attachment_path / "_unlinked_files_0").glob("*file_0.pdf"))) == 2
+    assert zot.restore_unlinked_files() == {}
+    assert (attachment_path / "folder_1" / "file_0.pdf").read_text() == "folder_1"
+    assert (attachment_path / "file_0.pdf").read_text() == "root"
+
+
+def test_relocated_archive_suffix_files_kept(tmp_path):
+    zot = tmp_zot(tmp_path)
+    attachment_path = tmp_path / "attachments"
+    relocation_path = attachment_path / "_unlinked_files_0"
+    (attachment_path / "data.zip").write_text("not ours")
+    assert (
+        zot.relocate_unlinked_files(False, "zip", foldername_suffix="0", archive=None)
+        == {}
+    )
+    assert zot.relocate_unlinked_files(foldername_suffix="0", archive="stored") == {}
+    assert zot.restore_unlinked_files() == {}
+    assert (relocation_path / "data.zip").read_text() == "not ours"
+    assert not list(relocation_path.glob("*_0000.zip"))
+    assert zot.list_unlinked_files_relocations()[0]["file_count"] == 1
+
+    # the relocated file of an archive suffix is removed as any other
+    zot = Zot("0", "user", "key")
+    zot.profile_directory = tmp_path / "profile"
+    assert zot.plan_remove_unlinked_files(False, True)["directories"] == [
+        str(relocation_path)
+    ]
+    zot.remove_unlinked_files(False, True)
+    assert not relocation_path.exists()
+
+
+def test_recover_interrupted_relocation(tmp_path, monkeypatch):
+    zot = tmp_zot(tmp_path)
+    attachment_path = tmp_path / "attachments"
+
+    def interrupted_move_files(path_pairs, *args, **kwargs):
+        move_file(*path_pairs[0])
+        raise RuntimeError("interrupted")
+
+    with monkeypatch.context() as context:
+        context.setattr(zotutil.zot, "move_files", interrupted_move_files)
+        with pytest.raises(RuntimeError):
+            zot.relocate_unlinked_files(foldername_suffix="0")
+    relocation_path = attachment_path / "_unlinked_files_0"
+    assert len(list(relocation_path.glob("*.pdf"))) == 1
+
+    # found by a new session with no index rebuild
+    zot = Zot("0", "user", "key")
+    zot.profile_directory = tmp_path / "profile"
+    assert [
+        relocation["foldername"] for relocation in zot.list_unlinked_files_relocations()
+    ] == ["_unlinked_files_0"]
+    assert zot.recover_unlinked_files(rollback=True) == {}
+    assert not relocation_path.exists()
+    for path_parts in (("folder_0", "file_0_1.pdf"), ("file_0.pdf",)):
+        assert attachment_path.joinpath(*path_parts).is_file()
+    assert zot.list_unlinked_files_relocations() == ()
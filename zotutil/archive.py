@@ -0,0 +1,167 @@
+"""Zip archives packing the relocated files, one per batch of a relocation run.
+
+An archived file is referred to by the path of the archive joined with its member name,
+e.g. ".../_unlinked_files/20200101000000000000_0000.zip/folder/file.pdf",
+the member name being the original path relative to the attachment directory.
+"""
+
+from pathlib import Path, PurePath
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+import shutil
+import time
+import os
+
+ARCHIVE_SUFFIX = ".zip"
+
+ARCHIVE_COMPRESSIONS = {"stored": ZIP_STORED, "deflated": ZIP_DEFLATED}
+
+
+def split_archived_path(path):
+    """Split the path of an archived file into the archive path and the member name.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the archived file.
+
+    Returns
+    -------
+    out : tuple(pathlib.Path, str) or None
+        The archive path and the "/" joined member name, `None` if not in an archive.
+
+    """
+    path_parts = PurePath(path).parts
+    for index, path_part in enumerate(path_parts[:-1]):
+        if path_part.endswith(ARCHIVE_SUFFIX):
+            archive_path = Path(*path_parts[: index + 1])
+            if archive_path.is_file():
+                return archive_path, "/".join(path_parts[index + 1 :])
+    return None
+
+
+def archived_file_exists(path):
+    """Whether or not an archived file is in its archive."""
+    archived_path = split_archived_path(path)
+    if archived_path is None:
+        return False
+    with ZipFile(str(archived_path[0])) as archive:
+        try:
+            archive.getinfo(archived_path[1])
+        except KeyError:
+            return False
+    return True
+
+
+def read_archive_member_sizes(archive_path):
+    """Read the uncompressed sizes of the members from the central directory of an archive."""
+    with ZipFile(str(archive_path)) as archive:
+        return {
+            member_info.filename: member_info.file_size
+            for member_info in archive.infolist()
+        }
+
+
+def move_files_into_archive(path_pairs, archive_path, compression="stored"):
+    """Move files into a new archive, deleting them once the archive is written and synced.
+
+    The archive is written under a temporary name and renamed once complete,
+    so that an interrupted write leaves no archive behind.
+
+    Parameters
+    ----------
+    path_pairs : iterable(tuple(str or pathlib.Path, str or pathlib.Path))
+        Pairs of source path and archived path, i.e. `archive_path` joined with the member name.
+    archive_path : str or pathlib.Path
+        Path to the archive to create.
+    compression : str, optional
+        "stored" or "deflated".
+
+    Returns
+    -------
+    out : tuple(list, dict)
+        Pairs of the files moved, and exceptions raised keyed on the source paths of the files failed to.
+
+    """
+    if compression not in ARCHIVE_COMPRESSIONS:
+        raise ValueError("invalid compression: " + str(compression))
+    archive_path = Path(archive_path)
+    temporary_path = archive_path.with_name(archive_path.name + ".tmp")
+    archived_path_pairs = []
+    errors = {}
+    with ZipFile(
+        str(temporary_path), "w", ARCHIVE_COMPRESSIONS[compression], allowZip64=True
+    ) as archive:
+        for source_path, archived_path in path_pairs:
+            member_name = PurePath(archived_path).relative_to(archive_path).as_posix()
+            try:
+                archive.write(str(source_path), member_name)
+            except OSError as error:
+                errors[source_path] = error
+                continue
+            archived_path_pairs.append((source_path, archived_path))
+    if not archived_path_pairs:
+        temporary_path.unlink()
+        return [], errors
+    with temporary_path.open("rb") as fh:
+        os.fsync(fh.fileno())
+    os.replace(str(temporary_path), str(archive_path))
+
+    moved_path_pairs = []
+    for source_path, archived_path in archived_path_pairs:
+        try:
+            os.unlink(str(source_path))
+        except OSError as error:
+            errors[source_path] = error
+            continue
+        moved_path_pairs.append((source_path, archived_path))
+    return moved_path_pairs, errors
+
+
+def extract_archived_files(path_pairs, replace=False):
+    """Extract archived files by random access, restoring their modification times.
+
+    Parameters
+    ----------
+    path_pairs : iterable(tuple(str or pathlib.Path, str or pathlib.Path))
+        Pairs of archived path and target path, the archives are left untouched.
+    replace : bool, optional
+        Whether or not to replace an existing file at the target path.
+
+    Returns
+    -------
+    out : tuple(list, dict)
+        Pairs of the files extracted, and exceptions raised keyed on the archived paths of the files failed to.
+
+    """
+    archives = {}
+    extracted_path_pairs = []
+    errors = {}
+    try:
+        for archived_path, target_path in path_pairs:
+            try:
+                split_path = split_archived_path(archived_path)
+                if split_path is None:
+                    raise FileNotFoundError("no archive found: " + str(archived_path))
+                archive_path, member_name = split_path
+                if archive_path not in archives:
+                    archives[archive_path] = ZipFile(str(archive_path))
+                member_info = archives[archive_path].getinfo(member_name)
+                target_path = Path(target_path)
+                if (not replace) and target_path.exists():
+                    raise FileExistsError("file exists: " + str(target_path))
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                temporary_path = target_path.with_name(target_path.name + ".tmp")
+                with archives[archive_path].open(member_info) as source_fh:
+                    with temporary_path.open("wb") as target_fh:
+                        shutil.copyfileobj(source_fh, target_fh)
+                modified_time = time.mktime(member_info.date_time + (0, 0, -1))
+                os.utime(str(temporary_path), (modified_time, modified_time))
+                os.replace(str(temporary_path), str(target_path))
+            except (OSError, KeyError) as error:
+                errors[archived_path] = error
+                continue
+            extracted_path_pairs.append((archived_path, target_path))
+    finally:
+        for archive in archives.values():
+            archive.close()
+    return extracted_path_pairs, errors
@@ -0,0 +1,108 @@
+"""On-disk cache of the library attachments."""
+
+from pathlib import Path
+import json
+import os
+
+_CACHE_FORMAT_VERSION = 1
+
+
+class AttachmentCache:
+    """An on-disk map of attachment keys to their paths, keyed on the library version.
+
+    Parameters
+    ----------
+    cache_path : str or pathlib.Path
+        Path to the json cache file.
+    library_id : str
+        Zotero API user ID.
+    library_type : str
+        Zotero API library type: user or group.
+
+    """
+
+    def __init__(self, cache_path, library_id, library_type):
+        self._cache_path = Path(cache_path)
+        self._library_id = str(library_id)
+        self._library_type = str(library_type)
+        self._load()
+
+    def _load(self):
+        self._version = None
+        self._attachment_paths = {}
+        if not self._cache_path.is_file():
+            return
+        try:
+            with self._cache_path.open("rt", encoding="utf-8") as fh:
+                cache = json.load(fh)
+        except ValueError:
+            # a corrupted cache is rebuilt in full
+            return
+        if (
+            cache.get("format_version") != _CACHE_FORMAT_VERSION
+            or cache.get("library_id") != self._library_id
+            or cache.get("library_type") != self._library_type
+        ):
+            return
+        self._version = cache["library_version"]
+        self._attachment_paths = cache["attachments"]
+
+    @property
+    def cache_path(self):
+        return self._cache_path
+
+    @property
+    def version(self):
+        """The library version the cache is up to date with, `None` if empty."""
+        return self._version
+
+    @property
+    def attachment_paths(self):
+        return self._attachment_paths
+
+    def invalidate(self):
+        """Drop the cache, both in memory and on the disk."""
+        if self._cache_path.is_file():
+            self._cache_path.unlink()
+        self._version = None
+        self._attachment_paths = {}
+
+    def update(self, attachment_entries, deleted_keys, library_version):
+        """Apply a delta of the library onto the cache.
+
+        Parameters
+        ----------
+        attachment_entries : iterable(dict)
+            Attachment entries as returned by the Web API, new or modified since `self.version`.
+        deleted_keys : iterable(str)
+            Keys of the items deleted since `self.version`.
+        library_version : int
+            The library version the delta is up to date with.
+
+        """
+        for attachment_entry in attachment_entries:
+            attachment_key = attachment_entry["key"]
+            attachment_path = attachment_entry["data"].get("path")
+            if attachment_path:
+                self._attachment_paths[attachment_key] = attachment_path
+            else:
+                self._attachment_paths.pop(attachment_key, None)
+        for deleted_key in deleted_keys:
+            self._attachment_paths.pop(deleted_key, None)
+        self._version = library_version
+
+    def save(self):
+        """Write the cache to the disk atomically."""
+        if not self._cache_path.parent.is_dir():
+            self._cache_path.parent.mkdir(parents=True)
+        cache = {
+            "format_version": _CACHE_FORMAT_VERSION,
+            "library_id": self._library_id,
+            "library_type": self._library_type,
+            "library_version": self._version,
+            "attachments": self._attachment_paths,
+        }
+        temporary_path = self._cache_path.with_name(self._cache_path.name + ".tmp")
+        with temporary_path.open("wt", encoding="utf-8") as fh:
+            json.dump(cache, fh)
+        os.replace(str(temporary_path), str(self._cache_path))
@@ -0,0 +1,398 @@
+"""Command-line entry point running the unlinked files clean, one job or a batch of them.
+
+The events and results are streamed to stdout as json lines, e.g.
+
+    zotutil --library-id 1234567 --backend local relocate --foldername-suffix 20200101
+    zotutil --job-file jobs.json --max-errors 0 --max-bytes 1000000000
+
+A job file is a json object of "jobs", each with a "command" and the parameters of its library,
+"library_id", "library_type", "api_key", "backend", "concurrency", "shared_libraries",
+"profile_directory" and "installation_directory", along with "options" for the command,
+the keyword arguments of the `zotutil.zot.Zot` method it runs,
+the missing parameters being taken from its "defaults" object, then from the command line.
+Its "thresholds" object sets "max_errors", "max_files" and/or "max_bytes" as the command line does,
+the files and bytes counted being those relocated, restored or removed, not those listed by "status".
+The jobs of a same library, backend and key run on one `zotutil.zot.Zot` object,
+its Web API client, session and parsed files being reused across the batch.
+"""
+
+from pathlib import Path
+import argparse
+import json
+import sys
+import os
+
+from .instrumentation import Instrumentation
+from .preferences import PreferenceStore
+from .zot import Zot
+
+EXIT_OK = 0
+EXIT_JOB_FAILED = 1
+EXIT_THRESHOLD_EXCEEDED = 3
+
+_COMMANDS = ("relocate", "remove", "restore", "status")
+
+_LIBRARY_PARAMETERS = (
+    "library_id",
+    "library_type",
+    "api_key",
+    "backend",
+    "concurrency",
+    "shared_libraries",
+    "profile_directory",
+    "installation_directory",
+)
+
+_THRESHOLDS = ("max_errors", "max_files", "max_bytes")
+
+
+class _JSONLinesReporter(Instrumentation):
+    """An instrumentation writing its events as json lines, tagged with the current job."""
+
+    def __init__(self, stream, progress_interval=1.0):
+        super().__init__(progress_interval)
+        self._stream = stream
+        self.job = None
+        self.last_summary = None
+
+    def write(self, event, **fields):
+        line = {"event": event}
+        if self.job is not None:
+            line["job"] = self.job
+        line.update(fields)
+        self._stream.write(json.dumps(line, default=str) + "\n")
+        self._stream.flush()
+
+    def on_run_start(self, run):
+        self.last_summary = None
+        self.write("run_start", run=run)
+
+    def on_run_end(self, run, duration, summary):
+        self.last_summary = summary
+        self.write("run_end", run=run, duration=duration)
+
+    def on_phase_start(self, phase):
+        self.write("phase_start", phase=phase)
+
+    def on_phase_end(self, phase, duration):
+        self.write("phase_end", phase=phase, duration=duration)
+
+    def on_progress(self, phase, done, total):
+        self.write("progress", phase=phase, done=done, total=total)
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(
+        prog="zotutil", description="Clean the unlinked files of Zotero libraries."
+    )
+    parser.add_argument("--job-file", help="json file of the jobs to run in batch")
+    parser.add_argument("--library-id", help="Zotero API user or group ID")
+    parser.add_argument(
+        "--library-type", default="user", choices=("user", "group"), help="library type"
+    )
+    parser.add_argument(
+        "--api-key",
+        default=os.environ.get("ZOTERO_API_KEY"),
+        help="Zotero API key, $ZOTERO_API_KEY by default",
+    )
+    parser.add_argument(
+        "--backend", default="web", choices=("web", "local"), help="library backend"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, help="maximum number of concurrent Web API requests"
+    )
+    parser.add_argument("--profile-directory", help="Zotero profile directory")
+    parser.add_argument(
+        "--installation-directory", help="Zotero installation directory"
+    )
+    parser.add_argument(
+        "--max-errors", type=int, help="exit with 3 over this number of errors"
+    )
+    parser.add_argument(
+        "--max-files",
+        type=int,
+        help="exit with 3 over this number of files relocated, restored or removed",
+    )
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        help="exit with 3 over this number of bytes relocated, restored or removed",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=float,
+        default=1.0,
+        help="minimum seconds between two progress events of a phase",
+    )
+
+    subparsers = parser.add_subparsers(dest="command")
+    relocate_parser = subparsers.add_parser("relocate", help="relocate unlinked files")
+    relocate_parser.add_argument("--foldername-suffix")
+    relocate_parser.add_argument("--file-types", help='e.g. "pdf, djvu"')
+    relocate_parser.add_argument("--no-zotfile", action="store_true")
+    relocate_parser.add_argument("--cache", action="store_true")
+    relocate_parser.add_argument("--sharded", action="store_true")
+    relocate_parser.add_argument("--archive", choices=("stored", "deflated"))
+    relocate_parser.add_argument("--workers", type=int)
+    for command, help in (
+        ("remove", "remove relocated files"),
+        ("restore", "restore relocated files"),
+        ("status", "list the relocations"),
+    ):
+        command_parser = subparsers.add_parser(command, help=help)
+        command_parser.add_argument("--include", action="append")
+        command_parser.add_argument("--exclude", action="append")
+        if command == "restore":
+            command_parser.add_argument("--workers", type=int)
+            command_parser.add_argument(
+                "--file",
+                action="append",
+                dest="files",
+                help="original or relocated path of a file, or an archive, to restore",
+            )
+    return parser
+
+
+def _retrieve_command_options(arguments):
+    if arguments.command == "relocate":
+        return {
+            "zotfile": not arguments.no_zotfile,
+            "file_types": arguments.file_types,
+            "foldername_suffix": arguments.foldername_suffix,
+            "cache": arguments.cache,
+            "workers": arguments.workers,
+            "sharded": arguments.sharded,
+            "archive": arguments.archive,
+        }
+    options = {"include": arguments.include, "exclude": arguments.exclude}
+    if arguments.command == "restore":
+        options["workers"] = arguments.workers
+        options["files"] = arguments.files
+    return options
+
+
+def _retrieve_jobs(arguments):
+    """Retrieve the jobs and the thresholds from the job file and the command line."""
+    defaults = {
+        parameter: getattr(arguments, parameter)
+        for parameter in _LIBRARY_PARAMETERS
+        if getattr(arguments, parameter, None) is not None
+    }
+    thresholds = {
+        threshold: getattr(arguments, threshold)
+        for threshold in _THRESHOLDS
+        if getattr(arguments, threshold) is not None
+    }
+    if not arguments.job_file:
+        if arguments.command is None:
+            raise ValueError("a command or a job file is required")
+        job = dict(defaults, command=arguments.command)
+        job["options"] = _retrieve_command_options(arguments)
+        return [job], thresholds
+
+    with open(arguments.job_file, "rt", encoding="utf-8") as fh:
+        job_file = json.load(fh)
+    defaults.update(job_file.get("defaults", {}))
+    # the command line overrides the thresholds of the job file
+    thresholds = dict(job_file.get("thresholds", {}), **thresholds)
+    jobs = []
+    for job in job_file["jobs"]:
+        job = dict(defaults, **job)
+        job.setdefault("command", arguments.command)
+        if job["command"] not in _COMMANDS:
+            raise ValueError("invalid command: " + str(job["command"]))
+        jobs.append(job)
+    return jobs, thresholds
+
+
+def _retrieve_zot(zots, job, instrumentation, preference_store, session):
+    """Retrieve the Zot object of a job, created once per library, type, key and backend."""
+    zot_key = (
+        job.get("library_id"),
+        job.get("library_type", "user"),
+        job.get("api_key"),
+        job.get("backend", "web"),
+    )
+    shared_libraries = tuple(
+        (library_id, library_type)
+        for library_id, library_type in (job.get("shared_libraries") or ())
+    )
+    if zot_key not in zots:
+        zots[zot_key] = Zot(
+            *zot_key[:3],
+            backend=zot_key[3],
+            instrumentation=instrumentation,
+            shared_libraries=shared_libraries,
+            session=session
+        )
+        # the preference files read by a job are parsed once for the whole batch
+        zots[zot_key]._preference_store = preference_store
+    zot = zots[zot_key]
+    # each job runs in a session of its own, the relocations of the jobs before are past ones
+    for attribute in ("_unlinked_files_relocation", "_foldername_suffix"):
+        if hasattr(zot, attribute):
+            delattr(zot, attribute)
+    zot._concurrency = job.get("concurrency")
+    if shared_libraries != zot._shared_libraries:
+        zot._shared_libraries = shared_libraries
+        if hasattr(zot, "_shared_zots"):
+            del zot._shared_zots
+    # the directories are set again only when changed, their parsed files being kept otherwise
+    if job.get("installation_directory") and (
+        Path(job["installation_directory"])
+        != getattr(zot, "_installation_directory", None)
+    ):
+        zot.installation_directory = job["installation_directory"]
+    if job.get("profile_directory") and (
+        Path(job["profile_directory"]) != getattr(zot, "_profile_directory", None)
+    ):
+        zot.profile_directory = job["profile_directory"]
+    return zot
+
+
+def _run_job(zot, command, options, reporter):
+    """Run a command, returning its result line fields, the errors, files and bytes,
+    the files and bytes being those moved or removed, none for "status"."""
+    options = dict(options or {})
+    if command == "status":
+        relocations = zot.list_unlinked_files_relocations(
+            options.get("include"), options.get("exclude")
+        )
+        return {"relocations": list(relocations)}, 0, 0, 0
+
+    if command == "relocate":
+        errors = zot.relocate_unlinked_files(**options)
+    else:
+        # each job runs in a session of its own, hence the past relocations by default
+        options.setdefault("this_relocation", False)
+        options.setdefault("past_relocation", True)
+        if command == "remove":
+            # the bytes freed are read off the relocation index
+            relocation_bytes = _sum_relocation_bytes(zot)
+            zot.remove_unlinked_files(**options)
+            errors = {}
+            byte_count = relocation_bytes - _sum_relocation_bytes(zot)
+        else:
+            errors = zot.restore_unlinked_files(**options)
+    counters = (reporter.last_summary or {}).get("counters", {})
+    if command != "remove":
+        byte_count = counters.get("bytes_moved", 0)
+    return (
+        {
+            "errors": {str(path): str(error) for path, error in errors.items()},
+            "summary": reporter.last_summary,
+        },
+        len(errors),
+        counters.get("files_moved", 0) + counters.get("files_removed", 0),
+        byte_count,
+    )
+
+
+def _sum_relocation_bytes(zot):
+    return sum(
+        relocation["bytes"] or 0 for relocation in zot.list_unlinked_files_relocations()
+    )
+
+
+def main(argv=None, stream=None):
+    """Run the command line.
+
+    Parameters
+    ----------
+    argv : list(str), optional
+        Command-line arguments, `sys.argv[1:]` if not specified.
+    stream : file object, optional
+        Stream the json lines are written to, stdout if not specified.
+
+    Returns
+    -------
+    out : int
+        Exit code, 0 for success, 1 for a failed job, 2 for a usage error,
+        3 for a threshold exceeded.
+
+    """
+    parser = _build_parser()
+    arguments = parser.parse_args(argv)
+    try:
+        jobs, thresholds = _retrieve_jobs(arguments)
+    except (OSError, ValueError, KeyError) as error:
+        parser.error(str(error))
+    for threshold in thresholds:
+        if threshold not in _THRESHOLDS:
+            parser.error("invalid threshold: " + str(threshold))
+
+    reporter = _JSONLinesReporter(stream or sys.stdout, arguments.progress_interval)
+    preference_store = PreferenceStore()
+    session = None
+    if any(job.get("backend", "web") == "web" for job in jobs):
+        # the HTTP and asyncio stacks are only imported once the Web API is used
+        from .web import WebSession
+
+        session = WebSession(
+            pool_size=max([job.get("concurrency") or 1 for job in jobs] + [1])
+        )
+    zots = {}
+    failed_count = 0
+    totals = {"max_errors": 0, "max_files": 0, "max_bytes": 0}
+    try:
+        for job_index, job in enumerate(jobs):
+            reporter.job = job_index
+            reporter.write(
+                "job_start",
+                command=job["command"],
+                library_id=job.get("library_id"),
+                profile_directory=job.get("profile_directory"),
+            )
+            try:
+                zot = _retrieve_zot(zots, job, reporter, preference_store, session)
+                result, error_count, file_count, byte_count = _run_job(
+                    zot, job["command"], job.get("options"), reporter
+                )
+            except Exception as error:
+                failed_count += 1
+                reporter.write(
+                    "job_failed", error=type(error).__name__, message=str(error)
+                )
+                continue
+            totals["max_errors"] += error_count
+            totals["max_files"] += file_count
+            totals["max_bytes"] += byte_count
+            reporter.write(
+                "job_end",
+                command=job["command"],
+                error_count=error_count,
+                file_count=file_count,
+                bytes=byte_count,
+                **result
+            )
+    finally:
+        if session is not None:
+            session.close()
+
+    reporter.job = None
+    exceeded_thresholds = {
+        threshold: {"limit": limit, "value": totals[threshold]}
+        for threshold, limit in thresholds.items()
+        if totals[threshold] > limit
+    }
+    if failed_count:
+        exit_code = EXIT_JOB_FAILED
+    elif exceeded_thresholds:
+        exit_code = EXIT_THRESHOLD_EXCEEDED
+    else:
+        exit_code = EXIT_OK
+    reporter.write(
+        "end",
+        job_count=len(jobs),
+        failed_count=failed_count,
+        error_count=totals["max_errors"],
+        file_count=totals["max_files"],
+        bytes=totals["max_bytes"],
+        exceeded_thresholds=exceeded_thresholds,
+        exit_code=exit_code,
+    )
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Read-only access to the local Zotero database."""
+
+from pathlib import Path
+import sqlite3
+
+# https://github.com/zotero/zotero/blob/master/chrome/content/zotero/xpcom/attachments.js
+LINK_MODE_IMPORTED_FILE = 0
+LINK_MODE_IMPORTED_URL = 1
+LINK_MODE_LINKED_FILE = 2
+LINK_MODE_LINKED_URL = 3
+
+# keyed on the link modes as named by the Web API
+LINK_MODES = {
+    "imported_file": LINK_MODE_IMPORTED_FILE,
+    "imported_url": LINK_MODE_IMPORTED_URL,
+    "linked_file": LINK_MODE_LINKED_FILE,
+    "linked_url": LINK_MODE_LINKED_URL,
+}
+
+
+def connect_database(data_directory):
+    """Open `zotero.sqlite` in the data directory read-only.
+
+    Zotero keeps an exclusive lock on its database whilst running, in which case
+    the database is opened as immutable, i.e. as last checkpointed on the disk.
+
+    Parameters
+    ----------
+    data_directory : str or pathlib.Path
+        Zotero data directory.
+
+    Returns
+    -------
+    out : sqlite3.Connection
+        A read-only connection to the Zotero database.
+
+    """
+    database_path = Path(data_directory) / "zotero.sqlite"
+    if not database_path.is_file():
+        raise ValueError("no database found: " + str(database_path))
+    database_uri = database_path.resolve().as_uri()
+    try:
+        connection = sqlite3.connect(database_uri + "?mode=ro", uri=True)
+        connection.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+    except sqlite3.OperationalError:
+        connection = sqlite3.connect(database_uri + "?immutable=1", uri=True)
+    return connection
+
+
+def retrieve_attachment_paths(connection, link_modes=(LINK_MODE_LINKED_FILE,)):
+    """Retrieve the raw paths of the attachments not in the trash.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        Connection from `connect_database`.
+    link_modes : iterable(int), optional
+        Attachment link modes to include, linked files by default.
+
+    Yields
+    ----------
+    out : generator
+        A generator of attachment path strings as stored by Zotero,
+        e.g. "attachments:folder/file.pdf".
+
+    """
+    link_modes = tuple(link_modes)
+    cursor = connection.execute(
+        "SELECT itemAttachments.path FROM itemAttachments"
+        " WHERE itemAttachments.path IS NOT NULL"
+        " AND itemAttachments.linkMode IN (" + ", ".join("?" * len(link_modes)) + ")"
+        " AND itemAttachments.itemID NOT IN (SELECT itemID FROM deletedItems)",
+        link_modes,
+    )
+    for (path,) in cursor:
+        yield path
+
+
+def retrieve_attachment_keys(connection):
+    """Retrieve the keys of the attachments of all the libraries, those in the trash included.
+
+    The stored files of all the libraries share the `storage` directory,
+    in folders named by the keys of their attachments, the linked files having their full-text caches there.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        Connection from `connect_database`.
+
+    Yields
+    ----------
+    out : generator
+        A generator of 8-character attachment keys.
+
+    """
+    cursor = connection.execute(
+        "SELECT items.key FROM items"
+        " JOIN itemAttachments ON itemAttachments.itemID = items.itemID"
+    )
+    for (item_key,) in cursor:
+        yield item_key
+
+
+def retrieve_tagged_item_entries(connection, group_id=None):
+    """Retrieve the tagged items not in the trash, shaped as Web API item entries.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        Connection from `connect_database`.
+    group_id : int, optional
+        Zotero group ID of the library, the user library if not specified.
+
+    Yields
+    ----------
+    out : generator
+        A generator of dicts with "key", "version" and "data"["tags"].
+
+    """
+    if group_id is None:
+        library_clause = "(SELECT libraryID FROM libraries WHERE type = 'user')"
+        parameters = ()
+    else:
+        library_clause = "(SELECT libraryID FROM groups WHERE groupID = ?)"
+        parameters = (group_id,)
+    cursor = connection.execute(
+        "SELECT items.key, items.version, tags.name, itemTags.type FROM itemTags"
+        " JOIN items ON items.itemID = itemTags.itemID"
+        " JOIN tags ON tags.tagID = itemTags.tagID"
+        " WHERE items.libraryID = "
+        + library_clause
+        + " AND items.itemID NOT IN (SELECT itemID FROM deletedItems)"
+        " ORDER BY items.itemID",
+        parameters,
+    )
+    item_entry = None
+    for item_key, item_version, tag, tag_type in cursor:
+        if (item_entry is None) or (item_entry["key"] != item_key):
+            if item_entry is not None:
+                yield item_entry
+            item_entry = {
+                "key": item_key,
+                "version": item_version,
+                "data": {"tags": []},
+            }
+        item_tag = {"tag": tag}
+        if tag_type:
+            item_tag["type"] = tag_type
+        item_entry["data"]["tags"].append(item_tag)
+    if item_entry is not None:
+        yield item_entry
@@ -0,0 +1,217 @@
+"""Detection of the byte-identical files by their content hashes."""
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import hashlib
+import json
+import mmap
+import os
+
+# bytes hashed at each end of a file before its full content is
+DUPLICATE_BLOCK_SIZE = 65536
+
+_HASH_CACHE_FORMAT_VERSION = 1
+
+
+def hash_file(path, block_size=None):
+    """Hash a file through a read-only memory map.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the file.
+    block_size : int, optional
+        Number of bytes to hash at each end of the file, the full content is hashed if not specified.
+
+    Returns
+    -------
+    out : str
+        Hexadecimal SHA-256 digest.
+
+    """
+    with open(str(path), "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if not size:
+            # empty files cannot be memory mapped
+            return hashlib.sha256().hexdigest()
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            if (block_size is None) or (size <= 2 * block_size):
+                return hashlib.sha256(mapped_file).hexdigest()
+            file_hash = hashlib.sha256(mapped_file[:block_size])
+            file_hash.update(mapped_file[-block_size:])
+            return file_hash.hexdigest()
+
+
+class HashCache:
+    """An on-disk map of file paths to their hashes, keyed on their sizes and modification times.
+
+    Parameters
+    ----------
+    cache_path : str or pathlib.Path
+        Path to the json cache file.
+
+    """
+
+    def __init__(self, cache_path):
+        self._cache_path = Path(cache_path)
+        self._load()
+
+    def _load(self):
+        self._hashes = {}
+        if not self._cache_path.is_file():
+            return
+        try:
+            with self._cache_path.open("rt", encoding="utf-8") as fh:
+                cache = json.load(fh)
+        except ValueError:
+            return
+        if cache.get("format_version") != _HASH_CACHE_FORMAT_VERSION:
+            return
+        self._hashes = cache["hashes"]
+
+    @property
+    def cache_path(self):
+        return self._cache_path
+
+    def get(self, path, size, mtime_ns, kind):
+        """Look up the "partial" or "full" hash of a file, `None` if missing or stale."""
+        entry = self._hashes.get(str(path))
+        if (entry is None) or (entry[0] != size) or (entry[1] != mtime_ns):
+            return None
+        return entry[2].get(kind)
+
+    def set(self, path, size, mtime_ns, kind, file_hash):
+        entry = self._hashes.get(str(path))
+        if (entry is None) or (entry[0] != size) or (entry[1] != mtime_ns):
+            entry = self._hashes[str(path)] = [size, mtime_ns, {}]
+        entry[2][kind] = file_hash
+
+    def save(self):
+        """Write the cache of the files still in place to the disk atomically."""
+        if not self._cache_path.parent.is_dir():
+            self._cache_path.parent.mkdir(parents=True)
+        self._hashes = {
+            path: entry for path, entry in self._hashes.items() if os.path.isfile(path)
+        }
+        cache = {"format_version": _HASH_CACHE_FORMAT_VERSION, "hashes": self._hashes}
+        temporary_path = self._cache_path.with_name(self._cache_path.name + ".tmp")
+        with temporary_path.open("wt", encoding="utf-8") as fh:
+            json.dump(cache, fh)
+        os.replace(str(temporary_path), str(self._cache_path))
+
+
+def _stat_file(path):
+    stat_result = os.stat(path)
+    return stat_result.st_size, stat_result.st_mtime_ns
+
+
+def find_duplicates(
+    candidate_paths,
+    reference_paths,
+    workers=None,
+    hash_cache=None,
+    block_size=DUPLICATE_BLOCK_SIZE,
+):
+    """Find the candidate files byte-identical to any of the reference files.
+
+    The files are grouped by size, then by the hash of their first and last blocks,
+    and only then by the hash of their full contents,
+    the groups without both a candidate and a reference being dropped at each stage.
+
+    Parameters
+    ----------
+    candidate_paths : iterable(str)
+        Paths to the files to be matched, e.g. the unlinked files.
+    reference_paths : iterable(str)
+        Paths to the files to be matched against, e.g. the linked attachments.
+    workers : int, optional
+        Maximum number of threads to read and hash the files.
+    hash_cache : zotutil.dedup.HashCache, optional
+        Cache of the hashes read and updated, left unsaved.
+    block_size : int, optional
+        Number of bytes hashed at each end of the files in the second stage.
+
+    Returns
+    -------
+    out : tuple(dict, dict)
+        Tuples of the reference paths identical to each candidate path, empty for no duplicate,
+        and the exceptions raised keyed on the paths of the files failed to read.
+
+    """
+    candidate_paths = tuple(candidate_paths)
+    reference_paths = tuple(reference_paths)
+    errors = {}
+
+    def _hash_file(path, stat, kind):
+        if hash_cache is not None:
+            file_hash = hash_cache.get(path, stat[0], stat[1], kind)
+            if file_hash is not None:
+                return file_hash
+        file_hash = hash_file(path, block_size if kind == "partial" else None)
+        if hash_cache is not None:
+            hash_cache.set(path, stat[0], stat[1], kind, file_hash)
+        return file_hash
+
+    def _regroup(executor, groups, key_function):
+        # the items are (path, is_candidate, (size, mtime_ns)), keyed on their last key
+        keyed_items = [
+            (group_key, item)
+            for group_key, group_items in groups.items()
+            if any(item[1] for item in group_items)
+            and not all(item[1] for item in group_items)
+            for item in group_items
+        ]
+
+        def _key(keyed_item):
+            try:
+                return key_function(*keyed_item)
+            except OSError as error:
+                errors[keyed_item[1][0]] = error
+                return None
+
+        regrouped = {}
+        for keyed_item, key in zip(keyed_items, executor.map(_key, keyed_items)):
+            if key is not None:
+                regrouped.setdefault(key, []).append(keyed_item[1])
+        return regrouped
+
+    with ThreadPoolExecutor(workers) as executor:
+        groups = {}
+        for path, is_candidate in [(path, True) for path in candidate_paths] + [
+            (path, False) for path in reference_paths
+        ]:
+            try:
+                stat = _stat_file(path)
+            except OSError as error:
+                errors[path] = error
+                continue
+            groups.setdefault(stat[0], []).append((path, is_candidate, stat))
+        groups = _regroup(
+            executor,
+            groups,
+            lambda size, item: (size, _hash_file(item[0], item[2], "partial")),
+        )
+        # the partial hashes of the files up to two blocks are their full hashes
+        groups = _regroup(
+            executor,
+            groups,
+            lambda key, item: (
+                key
+                if key[0] <= 2 * block_size
+                else (key[0], _hash_file(item[0], item[2], "full"))
+            ),
+        )
+
+    duplicates = {
+        candidate_path: ()
+        for candidate_path in candidate_paths
+        if candidate_path not in errors
+    }
+    for group_items in groups.values():
+        reference_group_paths = tuple(
+            path for path, is_candidate, _ in group_items if not is_candidate
+        )
+        for path, is_candidate, _ in group_items:
+            if is_candidate:
+                duplicates[path] = reference_group_paths
+    return duplicates, errors
@@ -0,0 +1,240 @@
+"""Index of the unlinked files relocations under the attachment directory."""
+
+from pathlib import Path
+import datetime as dt
+import sqlite3
+import os
+
+from .archive import split_archived_path, read_archive_member_sizes
+from .journal import (
+    RELOCATION_JOURNAL_FILENAME,
+    RELOCATION_MAP_FILENAME,
+    read_relocation_records,
+)
+
+RELOCATION_INDEX_FILENAME = "_relocation_index.sqlite"
+
+_RELOCATION_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS relocations (
+    foldername TEXT PRIMARY KEY,
+    suffix TEXT,
+    created TEXT,
+    updated TEXT,
+    file_count INTEGER,
+    bytes INTEGER,
+    map_path TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    relocated TEXT PRIMARY KEY,
+    original TEXT,
+    foldername TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_original ON files (original);
+CREATE INDEX IF NOT EXISTS files_foldername ON files (foldername);
+"""
+
+_RELOCATION_COLUMNS = (
+    "foldername",
+    "suffix",
+    "created",
+    "updated",
+    "file_count",
+    "bytes",
+    "map_path",
+)
+
+
+class RelocationIndex:
+    """A SQLite index of the relocation directories and their files.
+
+    Parameters
+    ----------
+    attachment_root_directory : str or pathlib.Path
+        Zotero attachment directory, where the index and the relocation directories lie.
+
+    """
+
+    def __init__(self, attachment_root_directory):
+        self._attachment_root_directory = Path(attachment_root_directory)
+        self._index_path = self._attachment_root_directory / RELOCATION_INDEX_FILENAME
+        existing = self._index_path.is_file()
+        self._connection = sqlite3.connect(str(self._index_path))
+        with self._connection:
+            self._connection.executescript(_RELOCATION_INDEX_SCHEMA)
+        if not existing:
+            self.rebuild()
+
+    @property
+    def index_path(self):
+        return self._index_path
+
+    def close(self):
+        self._connection.close()
+
+    def rebuild(self):
+        """Rebuild the index from the relocation directories right under the attachment directory."""
+        with self._connection:
+            self._connection.execute("DELETE FROM relocations")
+            self._connection.execute("DELETE FROM files")
+        with os.scandir(str(self._attachment_root_directory)) as entries:
+            relocation_directories = [
+                Path(entry.path)
+                for entry in entries
+                if entry.name.startswith("_unlinked_files")
+                and entry.is_dir(follow_symlinks=False)
+            ]
+        for relocation_directory in relocation_directories:
+            self.synchronise(relocation_directory)
+
+    def register(self, relocation_directory):
+        """Index a relocation directory before any file is moved into it,
+        so that a run interrupted midway is still found, its counts being filled in on synchronisation.
+
+        Parameters
+        ----------
+        relocation_directory : str or pathlib.Path
+            Directory the unlinked files are relocated to.
+
+        """
+        foldername = Path(relocation_directory).name
+        now = dt.datetime.now().isoformat(timespec="seconds")
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO relocations (foldername, suffix, created, updated)"
+                " VALUES (?, ?, ?, ?)",
+                (foldername, foldername[len("_unlinked_files_") :] or None, now, now),
+            )
+
+    def synchronise(self, relocation_directory):
+        """Bring the index of a relocation directory in line with its records.
+
+        Only the files new to the index have their sizes read from the disk.
+
+        Parameters
+        ----------
+        relocation_directory : str or pathlib.Path
+            Directory the unlinked files are relocated to.
+
+        """
+        relocation_directory = Path(relocation_directory)
+        foldername = relocation_directory.name
+        indexed_sizes = dict(
+            self._connection.execute(
+                "SELECT relocated, size FROM files WHERE foldername = ?", (foldername,)
+            )
+        )
+        file_rows = []
+        archive_member_sizes = {}
+        for relocated_path, original_path in read_relocation_records(
+            relocation_directory
+        ):
+            size = indexed_sizes.get(relocated_path)
+            if size is None:
+                try:
+                    size = os.stat(relocated_path).st_size
+                except OSError:
+                    size = self._read_archived_file_size(
+                        relocated_path, archive_member_sizes
+                    )
+            file_rows.append((relocated_path, original_path, foldername, size))
+
+        now = dt.datetime.now().isoformat(timespec="seconds")
+        map_path = relocation_directory / RELOCATION_JOURNAL_FILENAME
+        if not map_path.is_file():
+            map_path = relocation_directory / RELOCATION_MAP_FILENAME
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM files WHERE foldername = ?", (foldername,)
+            )
+            if not file_rows:
+                self._connection.execute(
+                    "DELETE FROM relocations WHERE foldername = ?", (foldername,)
+                )
+                return
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", file_rows
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO relocations (foldername, suffix, created)"
+                " VALUES (?, ?, ?)",
+                (foldername, foldername[len("_unlinked_files_") :] or None, now),
+            )
+            self._connection.execute(
+                "UPDATE relocations SET updated = ?, file_count = ?, bytes = ?,"
+                " map_path = ? WHERE foldername = ?",
+                (
+                    now,
+                    len(file_rows),
+                    sum(file_row[3] for file_row in file_rows),
+                    str(map_path),
+                    foldername,
+                ),
+            )
+
+    @staticmethod
+    def _read_archived_file_size(relocated_path, archive_member_sizes):
+        # the central directory of each archive is read once per synchronisation
+        archived_path = split_archived_path(relocated_path)
+        if archived_path is None:
+            return 0
+        archive_path, member_name = archived_path
+        if archive_path not in archive_member_sizes:
+            try:
+                archive_member_sizes[archive_path] = read_archive_member_sizes(
+                    archive_path
+                )
+            except (OSError, ValueError):
+                archive_member_sizes[archive_path] = {}
+        return archive_member_sizes[archive_path].get(member_name, 0)
+
+    def list_relocations(self, include=(), exclude=()):
+        """List the indexed relocations.
+
+        Parameters
+        ----------
+        include : iterable(str), optional
+            Relocation foldernames to be included, all if empty.
+        exclude : iterable(str), optional
+            Relocation foldernames to be excluded.
+
+        Returns
+        -------
+        out : tuple(dict)
+            Relocations ordered by foldername, with the keys:
+            foldername, suffix, created, updated, file_count, bytes and map_path.
+
+        """
+        include = frozenset(include)
+        exclude = frozenset(exclude)
+        return tuple(
+            dict(zip(_RELOCATION_COLUMNS, row))
+            for row in self._connection.execute(
+                "SELECT " + ", ".join(_RELOCATION_COLUMNS) + " FROM relocations"
+                " ORDER BY foldername"
+            )
+            if ((not include) or (row[0] in include)) and (row[0] not in exclude)
+        )
+
+    def locate(self, original_path):
+        """Look up where a file has been relocated to.
+
+        Parameters
+        ----------
+        original_path : str or pathlib.Path
+            Original path of the file.
+
+        Returns
+        -------
+        out : tuple(dict)
+            Relocated files with the keys: relocated, original, foldername and size.
+
+        """
+        return tuple(
+            dict(zip(("relocated", "original", "foldername", "size"), row))
+            for row in self._connection.execute(
+                "SELECT relocated, original, foldername, size FROM files"
+                " WHERE original = ?",
+                (str(original_path),),
+            )
+        )
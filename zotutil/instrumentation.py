@@ -0,0 +1,174 @@
+"""Instrumentation of the long running operations: phases, counters and progress."""
+
+from contextlib import contextmanager
+from pathlib import Path
+import datetime as dt
+import json
+import time
+
+
+class Instrumentation:
+    """A receiver of the instrumentation events of `zotutil.zot.Zot`.
+
+    Phase durations and counters are accumulated per run, i.e. per call of a public operation,
+    the `on_*` hooks do nothing and are meant to be overridden.
+
+    Phases: "retrieve_attachments", "scan_files", "hash_files", "relocate_files",
+    "restore_files", "remove_files", "remove_empty_directories", the files being relocated as they are scanned,
+    the "scan_files" phase, timed on the walk alone, and its progress events are emitted within the "relocate_files" phase.
+    Counters: "attachments_fetched", "files_scanned", "directories_scanned", "files_moved",
+    "bytes_moved", "files_removed", "errors".
+
+    Parameters
+    ----------
+    progress_interval : float, optional
+        Minimum interval in seconds between two progress events of a phase.
+
+    """
+
+    def __init__(self, progress_interval=1.0):
+        self._progress_interval = progress_interval
+        self._run_depth = 0
+        self._run_name = None
+        self._run_start_time = None
+        self._phase_durations = {}
+        self._counters = {}
+        self._progress_times = {}
+
+    def on_run_start(self, run):
+        pass
+
+    def on_run_end(self, run, duration, summary):
+        pass
+
+    def on_phase_start(self, phase):
+        pass
+
+    def on_phase_end(self, phase, duration):
+        pass
+
+    def on_progress(self, phase, done, total):
+        """`total` is `None` when unknown, e.g. whilst scanning."""
+        pass
+
+    @contextmanager
+    def run(self, run):
+        """Scope a run, the runs nested in another are part of the outermost one."""
+        self._run_depth += 1
+        if self._run_depth == 1:
+            self._run_name = run
+            self._run_start_time = time.perf_counter()
+            self._phase_durations = {}
+            self._counters = {}
+            self.on_run_start(run)
+        try:
+            yield self
+        finally:
+            self._run_depth -= 1
+            if self._run_depth == 0:
+                self.on_run_end(
+                    run, time.perf_counter() - self._run_start_time, self.summary()
+                )
+
+    @contextmanager
+    def phase(self, phase):
+        self.on_phase_start(phase)
+        start_time = time.perf_counter()
+        try:
+            yield self
+        finally:
+            duration = time.perf_counter() - start_time
+            self._phase_durations[phase] = (
+                self._phase_durations.get(phase, 0) + duration
+            )
+            self._progress_times.pop(phase, None)
+            self.on_phase_end(phase, duration)
+
+    def iterate_phase(self, phase, iterable):
+        """Iterate within a phase interleaved with another, e.g. a scan streamed into moves,
+        only the time spent producing the items being accounted to the phase."""
+        self.on_phase_start(phase)
+        duration = 0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start_time = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    duration += time.perf_counter() - start_time
+                yield item
+        finally:
+            self._phase_durations[phase] = (
+                self._phase_durations.get(phase, 0) + duration
+            )
+            self._progress_times.pop(phase, None)
+            self.on_phase_end(phase, duration)
+
+    def count(self, counter, value=1):
+        self._counters[counter] = self._counters.get(counter, 0) + value
+
+    def progress(self, phase, done, total=None):
+        """Emit a progress event, unless one of the phase is emitted within the interval."""
+        now = time.monotonic()
+        last_progress_time = self._progress_times.get(phase)
+        if (
+            (last_progress_time is not None)
+            and (now - last_progress_time < self._progress_interval)
+            and (done != total)
+        ):
+            return
+        self._progress_times[phase] = now
+        self.on_progress(phase, done, total)
+
+    def summary(self):
+        """Summarise the current or last run.
+
+        Returns
+        -------
+        out : dict
+            The run name, the phase durations in seconds and the counters.
+
+        """
+        return {
+            "run": self._run_name,
+            "phases": dict(self._phase_durations),
+            "counters": dict(self._counters),
+        }
+
+
+class JSONSummaryExporter(Instrumentation):
+    """An instrumentation writing a json summary per run.
+
+    Parameters
+    ----------
+    summary_directory : str or pathlib.Path
+        Directory the summaries are written to, as <run>_<timestamp>.json.
+    progress_interval : float, optional
+        Parameter for `Instrumentation`.
+
+    """
+
+    def __init__(self, summary_directory, progress_interval=1.0):
+        super().__init__(progress_interval)
+        self._summary_directory = Path(summary_directory)
+        self._started = None
+
+    def on_run_start(self, run):
+        self._started = dt.datetime.now()
+
+    def on_run_end(self, run, duration, summary):
+        if not self._summary_directory.is_dir():
+            self._summary_directory.mkdir(parents=True)
+        summary = dict(
+            summary,
+            started=self._started.isoformat(timespec="seconds"),
+            duration=duration,
+        )
+        summary_path = self._summary_directory / (
+            run + "_" + self._started.strftime("%Y%m%d%H%M%S%f") + ".json"
+        )
+        with summary_path.open("wt") as fh:
+            json.dump(summary, fh, indent=4)
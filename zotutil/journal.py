@@ -0,0 +1,279 @@
+"""Append-only journal of the unlinked files relocations."""
+
+from pathlib import Path
+import json
+import re
+import os
+
+from .archive import ARCHIVE_SUFFIX, archived_file_exists
+
+RELOCATION_JOURNAL_FILENAME = "_relocation_journal.jsonl"
+RELOCATION_MAP_FILENAME = "_relocation_map.json"
+
+# Journal operations:
+#   "move": a file is about to be relocated, written and synced before the move
+#   "moved"/"failed": the relocation of a file is done or failed
+#   "restored"/"removed": a relocated file has been restored or removed
+_JOURNAL_OPERATIONS = ("move", "moved", "failed", "restored", "removed")
+
+
+class RelocationJournal:
+    """An append-only json-lines journal in a relocation directory.
+
+    Parameters
+    ----------
+    relocation_directory : str or pathlib.Path
+        Directory the unlinked files are relocated to.
+    run_id : str, optional
+        Identifier of the relocation run, written along with each record.
+
+    """
+
+    def __init__(self, relocation_directory, run_id=None):
+        self._journal_path = Path(relocation_directory) / RELOCATION_JOURNAL_FILENAME
+        self._run_id = run_id
+        self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def journal_path(self):
+        return self._journal_path
+
+    def record(self, operation, path_pairs, sync=False):
+        """Append records of an operation on files.
+
+        Parameters
+        ----------
+        operation : str
+            "move", "moved", "failed", "restored" or "removed".
+        path_pairs : iterable(tuple)
+            Pairs of relocated and original paths.
+        sync : bool, optional
+            Whether or not to flush the records to the disk before returning,
+            always True for "move" so that each move is recorded before it happens.
+
+        """
+        if operation not in _JOURNAL_OPERATIONS:
+            raise ValueError("invalid journal operation: " + str(operation))
+        if self._fh is None:
+            self._open()
+        for relocated_path, original_path in path_pairs:
+            self._fh.write(
+                json.dumps(
+                    {
+                        "op": operation,
+                        "run": self._run_id,
+                        "relocated": str(relocated_path),
+                        "original": str(original_path),
+                    }
+                )
+                + "\n"
+            )
+        if sync or operation == "move":
+            self.sync()
+
+    def _open(self):
+        torn = False
+        if self._journal_path.is_file():
+            with self._journal_path.open("rb") as fh:
+                fh.seek(0, os.SEEK_END)
+                if fh.tell():
+                    fh.seek(-1, os.SEEK_END)
+                    torn = fh.read(1) != b"\n"
+        self._fh = self._journal_path.open("at", encoding="utf-8")
+        if torn:
+            # end a record torn by a crash so that it is skipped on reading
+            self._fh.write("\n")
+
+    def sync(self):
+        if self._fh is not None:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+
+    def close(self):
+        if self._fh is not None:
+            self.sync()
+            self._fh.close()
+            self._fh = None
+
+
+# the archives are named by their runs and batches, e.g. "20200101000000000000_0000.zip"
+_ARCHIVE_BATCH_PATTERN = re.compile(r"_\d{4}" + re.escape(ARCHIVE_SUFFIX))
+
+
+def _read_journal_records(journal_path):
+    with journal_path.open("rt", encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # a record torn by a crash
+                continue
+
+
+def _is_relocated(relocated_path, original_path):
+    if Path(relocated_path).exists():
+        return True
+    # an archived file is only relocated once deleted from its original path
+    return (not Path(original_path).exists()) and archived_file_exists(relocated_path)
+
+
+def read_relocation_records(relocation_directory, run_id=None):
+    """Read the relocated files of a relocation directory.
+
+    Both the journal and the legacy `_relocation_map.json` are read.
+    A move recorded without its outcome, i.e. interrupted, is settled by the disk:
+    it is taken as done if the relocated file exists,
+    or if an archived file is in its archive and gone from its original path.
+
+    Parameters
+    ----------
+    relocation_directory : str or pathlib.Path
+        Directory the unlinked files are relocated to.
+    run_id : str, optional
+        Identifier of the relocation run to read, all runs if not specified.
+
+    Yields
+    ----------
+    out : generator
+        A generator of pairs of relocated and original path strings that are not restored or removed.
+
+    """
+    relocation_directory = Path(relocation_directory)
+    relocated_files = {}
+    pending_files = {}
+    relocation_map_path = relocation_directory / RELOCATION_MAP_FILENAME
+    if (run_id is None) and relocation_map_path.is_file():
+        with relocation_map_path.open("rt") as fh:
+            relocated_files.update(json.load(fh))
+    journal_path = relocation_directory / RELOCATION_JOURNAL_FILENAME
+    if journal_path.is_file():
+        for record in _read_journal_records(journal_path):
+            relocated_path = record["relocated"]
+            if record["op"] in ("restored", "removed"):
+                # restorations and removals may be done by any later run
+                relocated_files.pop(relocated_path, None)
+            elif (run_id is not None) and (record["run"] != run_id):
+                continue
+            elif record["op"] == "move":
+                pending_files[relocated_path] = record["original"]
+            elif record["op"] == "moved":
+                pending_files.pop(relocated_path, None)
+                relocated_files[relocated_path] = record["original"]
+            else:
+                pending_files.pop(relocated_path, None)
+    for relocated_path, original_path in pending_files.items():
+        if _is_relocated(relocated_path, original_path):
+            relocated_files[relocated_path] = original_path
+    for relocated_path, original_path in relocated_files.items():
+        yield relocated_path, original_path
+
+
+def read_relocation_archive_names(relocation_directory):
+    """Read the names of the archives the relocation runs of a directory moved files into,
+    holding any file still or not, as journaled, the files of other names being never taken as archives.
+
+    Parameters
+    ----------
+    relocation_directory : str or pathlib.Path
+        Directory the unlinked files are relocated to.
+
+    Returns
+    -------
+    out : set(str)
+        Names of the archives, e.g. "20200101000000000000_0000.zip".
+
+    """
+    relocation_directory = Path(relocation_directory)
+    archive_names = set()
+    journal_path = relocation_directory / RELOCATION_JOURNAL_FILENAME
+    if not journal_path.is_file():
+        return archive_names
+    for record in _read_journal_records(journal_path):
+        if record["op"] != "move":
+            continue
+        try:
+            relative_parts = (
+                Path(record["relocated"]).relative_to(relocation_directory).parts
+            )
+        except ValueError:
+            continue
+        # an archived file is journaled under the archive path joined with its member name
+        if (
+            (len(relative_parts) > 1)
+            and relative_parts[0].startswith(record["run"])
+            and _ARCHIVE_BATCH_PATTERN.fullmatch(
+                relative_parts[0][len(record["run"]) :]
+            )
+        ):
+            archive_names.add(relative_parts[0])
+    return archive_names
+
+
+def recover_relocation_journal(relocation_directory):
+    """Settle the moves of an interrupted relocation run in its journal.
+
+    Parameters
+    ----------
+    relocation_directory : str or pathlib.Path
+        Directory the unlinked files are relocated to.
+
+    Returns
+    -------
+    out : tuple(dict, dict)
+        Pairs of relocated and original path strings keyed on the run identifiers,
+        of the interrupted moves found done and found not done respectively.
+
+    """
+    relocation_directory = Path(relocation_directory)
+    journal_path = relocation_directory / RELOCATION_JOURNAL_FILENAME
+    if not journal_path.is_file():
+        return {}, {}
+    pending_files = {}
+    for record in _read_journal_records(journal_path):
+        if record["op"] == "move":
+            pending_files[record["relocated"]] = (record["run"], record["original"])
+        elif record["op"] in ("moved", "failed"):
+            pending_files.pop(record["relocated"], None)
+    moved_path_pairs = {}
+    unmoved_path_pairs = {}
+    for relocated_path, (run_id, original_path) in pending_files.items():
+        if _is_relocated(relocated_path, original_path):
+            moved_path_pairs.setdefault(run_id, []).append(
+                (relocated_path, original_path)
+            )
+        else:
+            unmoved_path_pairs.setdefault(run_id, []).append(
+                (relocated_path, original_path)
+            )
+    for operation, path_pairs_by_run in (
+        ("moved", moved_path_pairs),
+        ("failed", unmoved_path_pairs),
+    ):
+        for run_id, path_pairs in path_pairs_by_run.items():
+            with RelocationJournal(relocation_directory, run_id) as journal:
+                journal.record(operation, path_pairs)
+    return moved_path_pairs, unmoved_path_pairs
+
+
+def discard_relocation_records(relocation_directory):
+    """Delete the journal and the legacy map once no relocated file is left.
+
+    Returns
+    -------
+    out : bool
+        Whether or not the records are deleted.
+
+    """
+    relocation_directory = Path(relocation_directory)
+    for _ in read_relocation_records(relocation_directory):
+        return False
+    for filename in (RELOCATION_JOURNAL_FILENAME, RELOCATION_MAP_FILENAME):
+        if (relocation_directory / filename).is_file():
+            (relocation_directory / filename).unlink()
+    return True
@@ -0,0 +1,156 @@
+"""Parsing and caching of Zotero preference files."""
+
+from configparser import ConfigParser
+from pathlib import PurePath, Path
+from io import TextIOWrapper
+from zipfile import ZipFile
+import json
+import re
+
+_PREFERENCE_PATTERN = re.compile(
+    r'^\s*(?:user_)?pref\(\s*"((?:[^"\\]|\\.)*)"\s*,\s*(.*?)\s*\)\s*;', re.MULTILINE
+)
+_INTEGER_PATTERN = re.compile(r"^-?\d+$")
+
+
+def parse_preference_value(value):
+    """Parse a preference value literal into a string, integer or boolean."""
+    if value.startswith('"') or value.startswith("'"):
+        if value.startswith("'"):
+            value = '"' + value[1:-1].replace('"', '\\"') + '"'
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value[1:-1]
+    elif value in ("true", "false"):
+        return value == "true"
+    elif _INTEGER_PATTERN.match(value):
+        return int(value)
+    return value
+
+
+def parse_preferences(preferences):
+    """Parse the `pref` and `user_pref` calls of a preference file.
+
+    Parameters
+    ----------
+    preferences : str
+        Content of a preference file, e.g. prefs.js.
+
+    Returns
+    -------
+    out : dict
+        Preference values keyed on the preference keys, later calls override earlier ones.
+
+    """
+    return {
+        json.loads('"' + preference_key + '"'): parse_preference_value(value)
+        for preference_key, value in _PREFERENCE_PATTERN.findall(preferences)
+    }
+
+
+class PreferenceStore:
+    """A store of parsed preference files, each invalidated by its modification time."""
+
+    def __init__(self):
+        self._cache = {}
+
+    def _load(self, kind, path, loader):
+        path = Path(path)
+        modification_time = path.stat().st_mtime_ns
+        cache_key = (kind, path)
+        if cache_key in self._cache:
+            cached_modification_time, content = self._cache[cache_key]
+            if cached_modification_time == modification_time:
+                return content
+        content = loader(path)
+        self._cache[cache_key] = (modification_time, content)
+        return content
+
+    def clear(self):
+        self._cache.clear()
+
+    def read_profiles(self, profile_directory):
+        """Read `profiles.ini` in the profile directory.
+
+        Returns
+        -------
+        out : configparser.ConfigParser
+            The parsed profiles configuration.
+
+        """
+
+        def _read_profiles(profiles_path):
+            profile_config = ConfigParser()
+            profile_config.read(str(profiles_path))
+            return profile_config
+
+        return self._load(
+            "profiles", Path(profile_directory) / "profiles.ini", _read_profiles
+        )
+
+    def read_preferences(self, preference_path):
+        """Read a preference file on the disk.
+
+        Returns
+        -------
+        out : dict
+            Preference values keyed on the preference keys.
+
+        """
+
+        def _read_preferences(preference_path):
+            with preference_path.open("rt", encoding="utf-8") as fh:
+                return parse_preferences(fh.read())
+
+        return self._load("preferences", preference_path, _read_preferences)
+
+    def read_plugin_preferences(
+        self,
+        plugin_xpi_path,
+        preference_path_in_xpi=PurePath("defaults", "preferences", "defaults.js"),
+    ):
+        """Read a preference file packed in a plugin xpi.
+
+        Returns
+        -------
+        out : dict
+            Preference values keyed on the preference keys.
+
+        """
+
+        def _read_plugin_preferences(plugin_xpi_path):
+            with ZipFile(str(plugin_xpi_path)) as plugin_xpi:
+                # ZipFile.open() needs TextIOWrapper to read as text
+                with TextIOWrapper(
+                    plugin_xpi.open(PurePath(preference_path_in_xpi).as_posix(), "r"),
+                    encoding="utf-8",
+                ) as fh:
+                    return parse_preferences(fh.read())
+
+        return self._load(
+            "plugin_preferences:" + PurePath(preference_path_in_xpi).as_posix(),
+            plugin_xpi_path,
+            _read_plugin_preferences,
+        )
+
+    def find_plugin(self, extensions_directory, plugin_name):
+        """Find the xpi of a plugin in the extensions directory.
+
+        Returns
+        -------
+        out : pathlib.Path
+            Path to the plugin xpi.
+
+        """
+
+        def _list_plugins(extensions_directory):
+            return tuple(sorted(extensions_directory.glob("*.xpi")))
+
+        for plugin_xpi_path in self._load(
+            "plugins", extensions_directory, _list_plugins
+        ):
+            # can there be duplicate plugin packages?
+            if plugin_xpi_path.name.lower().startswith(plugin_name.lower()):
+                return plugin_xpi_path
+        raise ValueError("no plugin found: " + plugin_name)
@@ -0,0 +1,105 @@
+"""Unification of the tags literally the same but in different cases."""
+
+import unicodedata
+
+# Zotero API write requests take at most 50 objects
+TAG_UPDATE_BATCH_SIZE = 50
+
+
+def tag_case_key(tag):
+    """Key the tags literally the same share, i.e. NFKC normalised and case folded."""
+    return unicodedata.normalize("NFKC", tag).casefold()
+
+
+def _choose_canonical_tag_by_count(tag_counts):
+    # the most used, the first in order on a tie
+    return min(tag_counts, key=lambda tag: (-tag_counts[tag], tag))
+
+
+def _choose_canonical_tag_by_case(tag_counts, case):
+    # the one already in the case, the most used otherwise
+    return min(
+        tag_counts,
+        key=lambda tag: (getattr(tag, case)() != tag, -tag_counts[tag], tag),
+    )
+
+
+def plan_tag_case_unification(item_entries, rule="count"):
+    """Plan the unification of the tags in one pass of the items.
+
+    Parameters
+    ----------
+    item_entries : iterable(dict)
+        Item entries as returned by the Web API, i.e. with "key", "version" and "data"["tags"].
+    rule : str or callable, optional
+        How to choose the canonical tag of a group:
+        "count" for the most used, "lower", "upper" or "title" for the one in that case if any,
+        or a callable taking the usage counts keyed on the tags and returning one of them.
+
+    Returns
+    -------
+    out : dict
+        A json serialisable plan with the keys:
+        "groups": the tags of each group and their usage counts, along with the canonical tag,
+        "updates": the keys, versions and new tags of the items to update.
+
+    """
+    if callable(rule):
+        choose_canonical_tag = rule
+    elif rule == "count":
+        choose_canonical_tag = _choose_canonical_tag_by_count
+    elif rule in ("lower", "upper", "title"):
+        choose_canonical_tag = lambda tag_counts: _choose_canonical_tag_by_case(
+            tag_counts, rule
+        )
+    else:
+        raise ValueError("invalid rule: " + str(rule))
+
+    tag_counts = {}
+    tagged_items = []
+    for item_entry in item_entries:
+        item_tags = item_entry["data"].get("tags")
+        if not item_tags:
+            continue
+        for item_tag in item_tags:
+            tag_counts[item_tag["tag"]] = tag_counts.get(item_tag["tag"], 0) + 1
+        tagged_items.append(
+            (item_entry["key"], item_entry["version"], tuple(item_tags))
+        )
+
+    tag_groups = {}
+    for tag, tag_count in tag_counts.items():
+        tag_groups.setdefault(tag_case_key(tag), {})[tag] = tag_count
+    groups = []
+    canonical_tags = {}
+    for tag_group in tag_groups.values():
+        if len(tag_group) < 2:
+            continue
+        canonical_tag = choose_canonical_tag(tag_group)
+        if canonical_tag not in tag_group:
+            raise ValueError("canonical tag out of the group: " + str(canonical_tag))
+        groups.append(
+            {"canonical": canonical_tag, "tags": dict(sorted(tag_group.items()))}
+        )
+        canonical_tags.update((tag, canonical_tag) for tag in tag_group)
+    groups.sort(key=lambda group: tag_case_key(group["canonical"]))
+
+    updates = []
+    for item_key, item_version, item_tags in tagged_items:
+        if not any(
+            canonical_tags.get(item_tag["tag"], item_tag["tag"]) != item_tag["tag"]
+            for item_tag in item_tags
+        ):
+            continue
+        new_item_tags = []
+        seen_tags = set()
+        for item_tag in item_tags:
+            new_tag = canonical_tags.get(item_tag["tag"], item_tag["tag"])
+            if new_tag in seen_tags:
+                continue
+            seen_tags.add(new_tag)
+            new_item_tags.append(dict(item_tag, tag=new_tag))
+        updates.append(
+            {"key": item_key, "version": item_version, "tags": new_item_tags}
+        )
+    return {"groups": groups, "updates": updates}
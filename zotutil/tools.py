@@ -1,21 +1,281 @@
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path, PurePath
+import shutil
+import heapq
+import errno
+import os
 
+IGNORE_FILES = frozenset((".DS_Store", "desktop.ini", "Thumbs.db"))
+
+
+def remove_empty_directories(root_directory, directories=None):
+    """Remove the directories holding nothing but ignorable system files, bottom-up.
+
+    Parameters
+    ----------
+    root_directory : str or pathlib.Path
+        Directory to clean, itself included.
+    directories : iterable(str or pathlib.Path), optional
+        Directories under `root_directory` that have been touched,
+        only they and their ancestors are inspected if specified,
+        otherwise the whole tree is inspected in a single walk.
+
+    """
+    root_directory = os.path.abspath(str(root_directory))
+    removed_directories = set()
+    if directories is None:
+        for directory, subdirectory_names, filenames in os.walk(
+            root_directory, topdown=False
+        ):
+            names = set(filenames)
+            names.update(
+                subdirectory_name
+                for subdirectory_name in subdirectory_names
+                if os.path.join(directory, subdirectory_name) not in removed_directories
+            )
+            if names < IGNORE_FILES:
+                _remove_directory(directory, names)
+                removed_directories.add(directory)
+        return
+
+    for directory, names in _iterate_emptied_directories(root_directory, directories):
+        _remove_directory(directory, names)
+
+
+def find_emptied_directories(root_directory, directories, removed_paths=()):
+    """Find the directories `remove_empty_directories` would remove once some paths are gone,
+    without removing anything.
+
+    Parameters
+    ----------
+    root_directory : str or pathlib.Path
+        Directory to clean, itself included.
+    directories : iterable(str or pathlib.Path)
+        Directories under `root_directory` to be touched.
+    removed_paths : iterable(str or pathlib.Path), optional
+        Paths to be moved or deleted, taken as gone.
+
+    Returns
+    -------
+    out : list(str)
+        Absolute paths of the directories, the deepest first.
+
+    """
+    removed_paths = set(os.path.abspath(str(path)) for path in removed_paths)
+    return [
+        directory
+        for directory, _ in _iterate_emptied_directories(
+            os.path.abspath(str(root_directory)), directories, removed_paths
+        )
+    ]
+
+
+def _iterate_emptied_directories(root_directory, directories, removed_paths=None):
+    # the deepest directories first, the parents of the emptied ones are then inspected
+    pending_directories = []
+    queued_directories = set()
+    if removed_paths is None:
+        removed_paths = set()
+
+    def _queue_directory(directory):
+        if directory not in queued_directories:
+            queued_directories.add(directory)
+            heapq.heappush(pending_directories, (-directory.count(os.sep), directory))
 
-def remove_empty_directories(root_directory):
-    ignore_files = (".DS_Store", "desktop.ini", "Thumbs.db")
-    root_directory = Path(root_directory)
-    directories = tuple(item for item in root_directory.iterdir() if item.is_dir())
     for directory in directories:
-        if set(item.name for item in directory.glob("*")) < set(ignore_files):
-            remove_directory(directory)
-        else:
-            remove_empty_directories(directory)
-    if set(item.name for item in root_directory.glob("*")) < set(ignore_files):
-        remove_directory(root_directory)
+        directory = os.path.abspath(str(directory))
+        if (directory == root_directory) or directory.startswith(
+            os.path.join(root_directory, "")
+        ):
+            _queue_directory(directory)
+    while pending_directories:
+        _, directory = heapq.heappop(pending_directories)
+        try:
+            with os.scandir(directory) as entries:
+                names = set(
+                    entry.name for entry in entries if entry.path not in removed_paths
+                )
+        except FileNotFoundError:
+            continue
+        if names < IGNORE_FILES:
+            yield directory, names
+            removed_paths.add(directory)
+            if directory != root_directory:
+                _queue_directory(os.path.dirname(directory))
+
+
+def _remove_directory(directory, filenames):
+    for filename in filenames:
+        os.unlink(os.path.join(directory, filename))
+    os.rmdir(directory)
 
 
 def remove_directory(directory):
     # the target directory should contains no subdirectories
-    for path in directory.glob("*"):
-        path.unlink()
-    directory.rmdir()
+    _remove_directory(
+        str(directory), tuple(path.name for path in Path(directory).glob("*"))
+    )
+
+
+def walk_files(root_directory, suffixes=None, excluded_prefixes=("_unlinked_files",)):
+    """Walk the files under a directory in a single pass of `os.scandir`.
+
+    Parameters
+    ----------
+    root_directory : str or pathlib.Path
+        Directory to walk.
+    suffixes : iterable(str), optional
+        File suffixes to yield without the leading dot, e.g. ("pdf", "djvu"),
+        all files are yielded if not specified.
+    excluded_prefixes : iterable(str), optional
+        Prefixes of the directory names whose subtrees are not entered.
+
+    Yields
+    ----------
+    out : generator
+        A generator of `pathlib.PurePath` relative to `root_directory`.
+
+    """
+    for file_relative_path in walk_file_relative_paths(
+        root_directory, suffixes, excluded_prefixes
+    ):
+        yield PurePath(file_relative_path)
+
+
+def walk_file_relative_paths(
+    root_directory, suffixes=None, excluded_prefixes=("_unlinked_files",)
+):
+    """Walk the files under a directory as "/" joined relative path strings.
+
+    Unlike `walk_files`, no path object is built per file,
+    the memory held is that of the directories pending a scan.
+
+    Parameters
+    ----------
+    root_directory : str or pathlib.Path
+    suffixes : iterable(str), optional
+    excluded_prefixes : iterable(str), optional
+        Parameters for `walk_files`.
+
+    Yields
+    ----------
+    out : generator
+        A generator of str relative to `root_directory`, e.g. "folder_0/file_0.pdf".
+
+    """
+    suffixes = frozenset(suffixes) if suffixes is not None else None
+    excluded_prefixes = tuple(excluded_prefixes)
+    directories = [(str(root_directory), "")]
+    while directories:
+        directory, relative_directory = directories.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith(excluded_prefixes):
+                        directories.append(
+                            (entry.path, relative_directory + entry.name + "/")
+                        )
+                elif entry.is_file() and (
+                    suffixes is None or os.path.splitext(entry.name)[1][1:] in suffixes
+                ):
+                    yield relative_directory + entry.name
+
+
+def move_file(source_path, target_path, replace=True, created_directories=None):
+    """Move a file, copying and deleting it when the move crosses devices.
+
+    Parameters
+    ----------
+    source_path : str or pathlib.Path
+        Path to the file to move.
+    target_path : str or pathlib.Path
+        Path to move the file to, its parent directories are created if missing.
+    replace : bool, optional
+        Whether or not to replace an existing file at `target_path`.
+    created_directories : set, optional
+        Directories known to exist, updated with the created ones to spare the checks.
+
+    """
+    source_path = Path(source_path)
+    target_path = Path(target_path)
+    target_directory = target_path.parent
+    if (created_directories is None) or (target_directory not in created_directories):
+        target_directory.mkdir(parents=True, exist_ok=True)
+        if created_directories is not None:
+            created_directories.add(target_directory)
+    if (not replace) and target_path.exists():
+        raise FileExistsError("'" + str(target_path) + "' already exists")
+    try:
+        os.replace(str(source_path), str(target_path))
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        shutil.move(str(source_path), str(target_path))
+
+
+def move_files(path_pairs, workers=None, replace=True):
+    """Move files, on a pool of threads if required, collecting the failures per file.
+
+    Parameters
+    ----------
+    path_pairs : iterable(tuple)
+        Pairs of source and target paths.
+    workers : int, optional
+        Maximum number of threads to move the files, the files are moved one by one if not specified.
+    replace : bool, optional
+        Whether or not to replace the existing files at the target paths,
+        when False, the files sharing a target path with one before them fail too.
+
+    Returns
+    -------
+    out : tuple(list, dict)
+        The pairs of source and target paths moved successfully,
+        and the exceptions raised keyed on the source paths of the files failed.
+
+    """
+    created_directories = set()
+
+    def _move_file(path_pair):
+        try:
+            move_file(*path_pair, replace, created_directories)
+        except OSError as error:
+            return path_pair, error
+        return path_pair, None
+
+    moved_path_pairs = []
+    errors = {}
+    if not replace:
+        # the threads cannot see the targets claimed by one another, hence checked here
+        path_pairs = tuple(path_pairs)
+        claimed_target_paths = set()
+        unclaimed_path_pairs = []
+        for source_path, target_path in path_pairs:
+            if Path(target_path) in claimed_target_paths:
+                errors[source_path] = FileExistsError(
+                    "'" + str(target_path) + "' already exists"
+                )
+                continue
+            claimed_target_paths.add(Path(target_path))
+            unclaimed_path_pairs.append((source_path, target_path))
+        path_pairs = unclaimed_path_pairs
+    if workers and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = tuple(executor.map(_move_file, path_pairs))
+    else:
+        results = map(_move_file, path_pairs)
+    for path_pair, error in results:
+        if error is None:
+            moved_path_pairs.append(path_pair)
+        else:
+            errors[path_pair[0]] = error
+    return moved_path_pairs, errors
+
+
+def batched(iterable, size):
+    """Split an iterable into tuples of at most `size` items."""
+    iterator = iter(iterable)
+    batch = tuple(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = tuple(islice(iterator, size))
@@ -0,0 +1,377 @@
+"""Watch of the files under the attachment directory, through inotify on Linux or by polling."""
+
+from pathlib import Path
+import ctypes.util
+import ctypes
+import select
+import struct
+import errno
+import time
+import sys
+import os
+
+from .tools import walk_file_relative_paths
+
+# https://man7.org/linux/man-pages/man7/inotify.7.html
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_DONT_FOLLOW = 0x02000000
+_IN_EXCL_UNLINK = 0x04000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0)
+
+_INOTIFY_WATCH_MASK = (
+    _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_ONLYDIR
+    | _IN_DONT_FOLLOW
+    | _IN_EXCL_UNLINK
+)
+_INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+
+class FileIndex:
+    """An in-memory index of the files under a directory, kept up to date by watch events.
+
+    The events are tuples of kind, "created", "deleted" or "rescan",
+    "/" joined path relative to the directory, and whether or not it is a directory.
+
+    Parameters
+    ----------
+    root_directory : str or pathlib.Path
+        Directory to index.
+    suffixes : iterable(str), optional
+    excluded_prefixes : iterable(str), optional
+        Parameters for `zotutil.tools.walk_files`.
+
+    """
+
+    def __init__(
+        self, root_directory, suffixes=None, excluded_prefixes=("_unlinked_files",)
+    ):
+        self._root_directory = Path(root_directory)
+        self._suffixes = frozenset(suffixes) if suffixes is not None else None
+        self._excluded_prefixes = tuple(excluded_prefixes)
+        self._file_relative_paths = set()
+        self.rebuild()
+
+    def __contains__(self, file_relative_path):
+        return file_relative_path in self._file_relative_paths
+
+    def __iter__(self):
+        return iter(self._file_relative_paths)
+
+    def __len__(self):
+        return len(self._file_relative_paths)
+
+    def _is_indexed(self, relative_path, is_directory=False):
+        # the files and directories under an excluded directory at any level
+        path_parts = relative_path.split("/")
+        if any(
+            path_part.startswith(self._excluded_prefixes)
+            for path_part in (path_parts if is_directory else path_parts[:-1])
+        ):
+            return False
+        return (
+            is_directory
+            or (self._suffixes is None)
+            or (os.path.splitext(path_parts[-1])[1][1:] in self._suffixes)
+        )
+
+    def _walk_directory(self, relative_directory):
+        directory = self._root_directory.joinpath(*relative_directory.split("/"))
+        try:
+            for file_relative_path in walk_file_relative_paths(
+                directory, self._suffixes, self._excluded_prefixes
+            ):
+                yield relative_directory + "/" + file_relative_path
+        except OSError:
+            # gone before being walked
+            return
+
+    def rebuild(self):
+        """Rebuild the index in a full walk of the directory."""
+        self._file_relative_paths = set(
+            walk_file_relative_paths(
+                self._root_directory, self._suffixes, self._excluded_prefixes
+            )
+        )
+
+    def apply(self, events):
+        """Apply watch events to the index.
+
+        Parameters
+        ----------
+        events : iterable(tuple(str, str, bool))
+            Watch events, see `FileIndex`.
+
+        Returns
+        -------
+        out : tuple(set, set)
+            Relative paths of the files added to and removed from the index.
+
+        """
+        added_paths = set()
+        removed_paths = set()
+        for kind, relative_path, is_directory in events:
+            if kind == "rescan":
+                file_relative_paths = self._file_relative_paths
+                self.rebuild()
+                rescanned_added_paths = self._file_relative_paths - file_relative_paths
+                rescanned_removed_paths = (
+                    file_relative_paths - self._file_relative_paths
+                )
+                added_paths.difference_update(rescanned_removed_paths)
+                added_paths.update(rescanned_added_paths)
+                removed_paths.difference_update(rescanned_added_paths)
+                removed_paths.update(rescanned_removed_paths)
+                continue
+            if not self._is_indexed(relative_path, is_directory):
+                continue
+            if is_directory:
+                if kind == "created":
+                    changed_paths = set(self._walk_directory(relative_path))
+                else:
+                    prefix = relative_path + "/"
+                    changed_paths = set(
+                        file_relative_path
+                        for file_relative_path in self._file_relative_paths
+                        if file_relative_path.startswith(prefix)
+                    )
+            else:
+                changed_paths = {relative_path}
+            # the changes cancelling out within the events are left out
+            if kind == "created":
+                changed_paths -= self._file_relative_paths
+                self._file_relative_paths.update(changed_paths)
+                added_paths.update(changed_paths - removed_paths)
+                removed_paths.difference_update(changed_paths)
+            else:
+                changed_paths &= self._file_relative_paths
+                self._file_relative_paths.difference_update(changed_paths)
+                removed_paths.update(changed_paths - added_paths)
+                added_paths.difference_update(changed_paths)
+        return added_paths, removed_paths
+
+
+class PollingWatcher:
+    """A watcher diffing full walks of a directory, the fallback off Linux.
+
+    Parameters
+    ----------
+    root_directory : str or pathlib.Path
+        Directory to watch.
+    excluded_prefixes : iterable(str), optional
+        Prefixes of the directory names whose subtrees are not watched.
+
+    """
+
+    def __init__(self, root_directory, excluded_prefixes=("_unlinked_files",)):
+        self._root_directory = Path(root_directory)
+        self._excluded_prefixes = tuple(excluded_prefixes)
+        self._file_relative_paths = self._walk()
+
+    def _walk(self):
+        return set(
+            walk_file_relative_paths(
+                self._root_directory, excluded_prefixes=self._excluded_prefixes
+            )
+        )
+
+    def close(self):
+        pass
+
+    def read_events(self, timeout=None):
+        """Wait for `timeout` seconds and read the events since the last read, see `FileIndex`."""
+        if timeout:
+            time.sleep(timeout)
+        file_relative_paths = self._walk()
+        events = [
+            ("deleted", file_relative_path, False)
+            for file_relative_path in self._file_relative_paths - file_relative_paths
+        ]
+        events.extend(
+            ("created", file_relative_path, False)
+            for file_relative_path in file_relative_paths - self._file_relative_paths
+        )
+        self._file_relative_paths = file_relative_paths
+        return events
+
+
+class InotifyWatcher:
+    """A watcher of a directory tree through Linux inotify, called by `ctypes`.
+
+    Each directory is watched, the new ones as they are created or moved in,
+    an overflow of the event queue is reported as a "rescan" event, the whole tree being watched again.
+    An `OSError` is raised when a directory fails to be watched other than by being gone,
+    e.g. for the limit of watches reached, `create_watcher` then falling back to a `PollingWatcher`.
+
+    Parameters
+    ----------
+    root_directory : str or pathlib.Path
+        Directory to watch.
+    excluded_prefixes : iterable(str), optional
+        Prefixes of the directory names whose subtrees are not watched.
+
+    """
+
+    def __init__(self, root_directory, excluded_prefixes=("_unlinked_files",)):
+        self._root_directory = Path(root_directory)
+        self._excluded_prefixes = tuple(excluded_prefixes)
+        self._libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        self._file_descriptor = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._file_descriptor < 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number))
+        # relative directories keyed on the watch descriptors, and the other way round
+        self._watched_directories = {}
+        self._watch_descriptors = {}
+        try:
+            self._watch_tree("")
+        except BaseException:
+            # the watches already added are released along with the descriptor
+            self.close()
+            raise
+
+    def close(self):
+        if self._file_descriptor >= 0:
+            os.close(self._file_descriptor)
+            self._file_descriptor = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _watch_directory(self, relative_directory):
+        directory = self._root_directory.joinpath(*relative_directory.split("/"))
+        watch_descriptor = self._libc.inotify_add_watch(
+            self._file_descriptor, os.fsencode(str(directory)), _INOTIFY_WATCH_MASK
+        )
+        if watch_descriptor < 0:
+            error_number = ctypes.get_errno()
+            if error_number in (errno.ENOENT, errno.ENOTDIR):
+                # gone before being watched
+                return False
+            # e.g. ENOSPC once fs.inotify.max_user_watches is reached, leaving the subtree unwatched
+            raise OSError(
+                error_number,
+                os.strerror(error_number) + ": " + str(directory),
+            )
+        self._watched_directories[watch_descriptor] = relative_directory
+        self._watch_descriptors[relative_directory] = watch_descriptor
+        return True
+
+    def _watch_tree(self, relative_directory):
+        directories = [relative_directory]
+        while directories:
+            relative_directory = directories.pop()
+            if not self._watch_directory(relative_directory):
+                continue
+            directory = self._root_directory.joinpath(*relative_directory.split("/"))
+            try:
+                with os.scandir(str(directory)) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False) and not (
+                            entry.name.startswith(self._excluded_prefixes)
+                        ):
+                            directories.append(
+                                _join_relative_path(relative_directory, entry.name)
+                            )
+            except OSError:
+                continue
+
+    def _unwatch_tree(self, relative_directory):
+        prefix = relative_directory + "/"
+        for watched_directory in [
+            watched_directory
+            for watched_directory in self._watch_descriptors
+            if watched_directory == relative_directory
+            or watched_directory.startswith(prefix)
+        ]:
+            watch_descriptor = self._watch_descriptors.pop(watched_directory)
+            self._watched_directories.pop(watch_descriptor, None)
+            self._libc.inotify_rm_watch(self._file_descriptor, watch_descriptor)
+
+    def read_events(self, timeout=None):
+        """Wait up to `timeout` seconds for events and read them, see `FileIndex`."""
+        readable, _, _ = select.select([self._file_descriptor], [], [], timeout)
+        if not readable:
+            return []
+        buffer = b""
+        while True:
+            try:
+                buffer += os.read(self._file_descriptor, 65536)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+        events = []
+        offset = 0
+        while offset < len(buffer):
+            watch_descriptor, mask, _, name_length = _INOTIFY_EVENT_HEADER.unpack_from(
+                buffer, offset
+            )
+            offset += _INOTIFY_EVENT_HEADER.size
+            name = os.fsdecode(buffer[offset : offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & _IN_Q_OVERFLOW:
+                # the directories created whilst the events were dropped are watched as well
+                self._watch_tree("")
+                events.append(("rescan", "", True))
+                continue
+            if mask & _IN_IGNORED:
+                relative_directory = self._watched_directories.pop(
+                    watch_descriptor, None
+                )
+                if (
+                    relative_directory is not None
+                    and self._watch_descriptors.get(relative_directory)
+                    == watch_descriptor
+                ):
+                    del self._watch_descriptors[relative_directory]
+                continue
+            relative_directory = self._watched_directories.get(watch_descriptor)
+            if (relative_directory is None) or (not name):
+                continue
+            relative_path = _join_relative_path(relative_directory, name)
+            is_directory = bool(mask & _IN_ISDIR)
+            if is_directory and name.startswith(self._excluded_prefixes):
+                continue
+            if mask & (_IN_CREATE | _IN_MOVED_TO):
+                if is_directory:
+                    self._watch_tree(relative_path)
+                events.append(("created", relative_path, is_directory))
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                if is_directory:
+                    self._unwatch_tree(relative_path)
+                events.append(("deleted", relative_path, is_directory))
+        return events
+
+
+def _join_relative_path(relative_directory, name):
+    return relative_directory + "/" + name if relative_directory else name
+
+
+def create_watcher(root_directory, excluded_prefixes=("_unlinked_files",)):
+    """Create an `InotifyWatcher` on Linux, a `PollingWatcher` otherwise or if inotify fails."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root_directory, excluded_prefixes)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(root_directory, excluded_prefixes)
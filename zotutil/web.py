@@ -0,0 +1,468 @@
+"""Concurrent access to the Zotero Web API."""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlencode, urlsplit
+import threading
+import asyncio
+import json
+import time
+import uuid
+
+ZOTERO_API_URL = "https://api.zotero.org"
+ZOTERO_API_VERSION = "3"
+ZOTERO_API_PAGE_LIMIT = 100
+
+
+class WebSession:
+    """A pool of keep-alive connections to the Web API, shared by threads and libraries alike.
+
+    It carries the requests zotutil sends itself, i.e. those of `fetch_items` and `WebLibrary`,
+    those sent through pyzotero going through its own HTTP client.
+
+    A `Backoff` or `Retry-After` header from any response pauses every request of the session,
+    the requests answered by 429 or 503 being retried after `Retry-After`, of seconds or an HTTP-date,
+    or with exponential backoff.
+    A request failed on a kept-alive connection, e.g. closed by the server in the meantime,
+    is retried at once on a fresh connection, the requests failed to connect with exponential backoff,
+    neither pausing the other requests.
+    The requests, retries, bytes received and seconds waited are counted in `stats`.
+
+    Parameters
+    ----------
+    base_url : str, optional
+        Base URL of the Web API.
+    pool_size : int, optional
+        Maximum number of connections, i.e. of concurrent requests.
+    timeout : float, optional
+        Timeout in seconds of each request.
+    max_retries : int, optional
+        Maximum number of retries of each request.
+    backoff_factor : float, optional
+        Seconds to wait before the first retry lacking a `Retry-After`, doubled at each further retry.
+
+    """
+
+    def __init__(
+        self,
+        base_url=ZOTERO_API_URL,
+        pool_size=4,
+        timeout=30,
+        max_retries=5,
+        backoff_factor=1.0,
+    ):
+        split_url = urlsplit(base_url)
+        if split_url.scheme not in ("http", "https"):
+            raise ValueError("invalid base URL: " + str(base_url))
+        self._connection_class = (
+            HTTPSConnection if split_url.scheme == "https" else HTTPConnection
+        )
+        self._host = split_url.netloc
+        self._path_prefix = split_url.path.rstrip("/")
+        self._base_url = base_url
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._backoff_factor = backoff_factor
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._idle_connections = []
+        self._resume_time = 0
+        self._stats = {
+            "requests": 0,
+            "retries": 0,
+            "bytes_received": 0,
+            "wait_time": 0.0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, stat, value=1):
+        with self._lock:
+            self._stats[stat] += value
+
+    def defer(self, seconds):
+        """Pause all the requests of the session for `seconds` from now."""
+        with self._lock:
+            self._resume_time = max(self._resume_time, time.monotonic() + seconds)
+
+    def _wait(self):
+        while True:
+            with self._lock:
+                delay = self._resume_time - time.monotonic()
+            if delay <= 0:
+                return
+            self._sleep(delay)
+
+    def _sleep(self, seconds):
+        time.sleep(seconds)
+        self._count("wait_time", seconds)
+
+    def _acquire_connection(self, fresh=False):
+        # an idle connection is reused unless a fresh one is asked for
+        if not fresh:
+            with self._lock:
+                if self._idle_connections:
+                    return self._idle_connections.pop(), True
+        return self._connection_class(self._host, timeout=self._timeout), False
+
+    def _release_connection(self, connection):
+        with self._lock:
+            self._idle_connections.append(connection)
+
+    def close(self):
+        """Close the idle connections, those in use are closed once released."""
+        with self._lock:
+            idle_connections = self._idle_connections
+            self._idle_connections = []
+        for connection in idle_connections:
+            connection.close()
+
+    def request(self, path, params=None, headers=None, method="GET", body=None):
+        """Send a request, retrying it as asked by the server.
+
+        Parameters
+        ----------
+        path : str
+            Path relative to the base URL, e.g. "/users/0/items".
+        params : dict, optional
+            Query parameters.
+        headers : dict, optional
+            Request headers.
+        method : str, optional
+            Request method, e.g. "POST".
+        body : bytes, optional
+            Request body.
+
+        Returns
+        -------
+        out : tuple(http.client.HTTPMessage, bytes)
+            Headers and body of the response.
+
+        """
+        url = self._path_prefix + path
+        if params:
+            url += "?" + urlencode(params)
+        attempt = 0
+        fresh = False
+        while True:
+            self._wait()
+            response_body = None
+            with self._slots:
+                connection, reused = self._acquire_connection(fresh)
+                try:
+                    connection.request(method, url, body=body, headers=headers or {})
+                    response = connection.getresponse()
+                    response_body = response.read()
+                except (OSError, HTTPException):
+                    connection.close()
+                else:
+                    if response.will_close:
+                        connection.close()
+                    else:
+                        self._release_connection(connection)
+            if response_body is None:
+                if reused:
+                    # a stale keep-alive connection, not a server signal
+                    fresh = True
+                    continue
+                retry_delay = self._backoff_factor * 2**attempt
+            else:
+                self._count("requests")
+                self._count("bytes_received", len(response_body))
+                backoff = _parse_delay(response.headers.get("Backoff"))
+                if backoff is not None:
+                    self.defer(backoff)
+                if response.status in (429, 503):
+                    retry_after = _parse_delay(response.headers.get("Retry-After"))
+                    if retry_after is None:
+                        retry_after = self._backoff_factor * 2**attempt
+                    self.defer(retry_after)
+                    retry_delay = 0
+                elif response.status >= 400:
+                    raise ValueError(
+                        "request failed with status "
+                        + str(response.status)
+                        + ": "
+                        + url
+                    )
+                else:
+                    return response.headers, response_body
+            if attempt >= self._max_retries:
+                raise ValueError("too many retries: " + url)
+            attempt += 1
+            fresh = False
+            self._count("retries")
+            if retry_delay:
+                self._sleep(retry_delay)
+
+
+def _parse_delay(value):
+    """Parse the seconds to wait of a `Backoff` or `Retry-After` header,
+    given in seconds or as an HTTP-date, None if missing or invalid."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_time.tzinfo is None:
+        retry_time = retry_time.replace(tzinfo=timezone.utc)
+    return max((retry_time - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def _retrieve_library_path(library_id, library_type):
+    return ("/users/" if library_type == "user" else "/groups/") + str(library_id)
+
+
+def _retrieve_request_headers(api_key=None):
+    headers = {"Zotero-API-Version": ZOTERO_API_VERSION}
+    if api_key:
+        headers["Zotero-API-Key"] = api_key
+    return headers
+
+
+class WebLibrary:
+    """The Web API requests zotutil sends for a library, through a `WebSession`.
+
+    Parameters
+    ----------
+    session : zotutil.web.WebSession
+        Session to send the requests through.
+    library_id : str
+        Zotero API user ID.
+    library_type : str
+        Zotero API library type: user or group.
+    api_key : str, optional
+        Zotero API user key.
+
+    """
+
+    def __init__(self, session, library_id, library_type, api_key=None):
+        self._session = session
+        self._library_id = library_id
+        self._library_type = library_type
+        self._api_key = api_key
+        self._library_path = _retrieve_library_path(library_id, library_type)
+        self._headers = _retrieve_request_headers(api_key)
+
+    def items(self, concurrency=1, **params):
+        """Iterate the items, in the order the pages arrive, see `fetch_items`."""
+        return iterate_items(
+            self._library_id,
+            self._library_type,
+            self._api_key,
+            concurrency,
+            session=self._session,
+            **params
+        )
+
+    def item_keys(self, trash=False, **params):
+        """Retrieve the keys of all the items, or of those in the trash, in one response.
+
+        Parameters
+        ----------
+        trash : bool, optional
+            Whether or not to retrieve the keys of the items in the trash.
+        **params:
+            Query parameters, e.g. itemType="attachment".
+
+        Returns
+        -------
+        out : list(str)
+            Item keys.
+
+        """
+        path = self._library_path + ("/items/trash" if trash else "/items")
+        _, body = self._session.request(
+            path, dict(params, format="keys"), self._headers
+        )
+        return body.decode("utf-8").split()
+
+    def last_modified_version(self):
+        """Retrieve the last modified version of the library."""
+        response_headers, _ = self._session.request(
+            self._library_path + "/items", {"format": "keys", "limit": 1}, self._headers
+        )
+        return int(response_headers["Last-Modified-Version"])
+
+    def deleted(self, since):
+        """Retrieve the keys of the objects deleted since a library version, keyed on their types."""
+        _, body = self._session.request(
+            self._library_path + "/deleted", {"since": since}, self._headers
+        )
+        return json.loads(body.decode("utf-8"))
+
+    def update_items(self, items):
+        """Write at most 50 items at once, those with a key and a version updating the existing items.
+
+        A write token makes a request retried after it reached the server fail rather than apply twice.
+
+        Parameters
+        ----------
+        items : list(dict)
+            Items to write.
+
+        Returns
+        -------
+        out : dict
+            The "successful", "success", "unchanged" and "failed" items keyed on their indices.
+
+        """
+        headers = dict(
+            self._headers,
+            **{
+                "Content-Type": "application/json",
+                "Zotero-Write-Token": uuid.uuid4().hex,
+            }
+        )
+        _, body = self._session.request(
+            self._library_path + "/items",
+            headers=headers,
+            method="POST",
+            body=json.dumps(items).encode("utf-8"),
+        )
+        return json.loads(body.decode("utf-8"))
+
+
+async def fetch_items(
+    library_id,
+    library_type,
+    api_key=None,
+    concurrency=4,
+    base_url=ZOTERO_API_URL,
+    timeout=30,
+    max_retries=5,
+    session=None,
+    **params
+):
+    """Fetch items from the Web API, requesting the pages concurrently.
+
+    The first page is requested alone to read `Total-Results`,
+    the remaining `start` offsets are then requested under the concurrency limit,
+    no more pages being requested than consumed plus `concurrency`.
+
+    Parameters
+    ----------
+    library_id : str
+        Zotero API user ID.
+    library_type : str
+        Zotero API library type: user or group.
+    api_key : str, optional
+        Zotero API user key.
+    concurrency : int, optional
+        Maximum number of concurrent requests.
+    base_url : str, optional
+    timeout : float, optional
+    max_retries : int, optional
+        Parameters for the `WebSession` created when `session` is not specified.
+    session : zotutil.web.WebSession, optional
+        Session to send the requests through, left open.
+    **params:
+        Query parameters of the items request, e.g. itemType="attachment".
+
+    Yields
+    ----------
+    out : async generator
+        An asynchronous generator of item entries, in the order the pages arrive.
+
+    """
+    path = _retrieve_library_path(library_id, library_type) + "/items"
+    headers = _retrieve_request_headers(api_key)
+    params = dict(params, format="json", limit=ZOTERO_API_PAGE_LIMIT)
+
+    own_session = session is None
+    if own_session:
+        session = WebSession(base_url, concurrency, timeout, max_retries)
+    loop = asyncio.get_event_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def _fetch_page(start):
+        # the session retries and backs off within the thread
+        response_headers, body = await loop.run_in_executor(
+            executor, session.request, path, dict(params, start=start), headers
+        )
+        return json.loads(body.decode("utf-8")), response_headers
+
+    tasks = set()
+    try:
+        entries, response_headers = await _fetch_page(0)
+        for entry in entries:
+            yield entry
+        total_results = int(response_headers.get("Total-Results", len(entries)))
+        starts = iter(
+            range(ZOTERO_API_PAGE_LIMIT, total_results, ZOTERO_API_PAGE_LIMIT)
+        )
+        # at most `concurrency` pages are requested or held ahead of the consumer
+        while True:
+            while len(tasks) < concurrency:
+                start = next(starts, None)
+                if start is None:
+                    break
+                tasks.add(loop.create_task(_fetch_page(start)))
+            if not tasks:
+                break
+            done_tasks, tasks = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done_tasks:
+                entries, _ = task.result()
+                for entry in entries:
+                    yield entry
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        executor.shutdown(wait=False)
+        if own_session:
+            session.close()
+
+
+def iterate_items(*args, **kwargs):
+    """Iterate `fetch_items` synchronously on a private event loop.
+
+    Parameters
+    ----------
+    *args, **kwargs:
+        Parameters for `fetch_items`.
+
+    Yields
+    ----------
+    out : generator
+        A generator of item entries, in the order the pages arrive.
+
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        items = fetch_items(*args, **kwargs)
+        try:
+            while True:
+                try:
+                    entry = loop.run_until_complete(items.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield entry
+        finally:
+            loop.run_until_complete(items.aclose())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
@@ -1,26 +1,100 @@
-from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import PurePath, Path
-from io import TextIOWrapper
-from zipfile import ZipFile
 import datetime as dt
+import functools
+import hashlib
 import json
-import sys
+import time
 import re
+import sys
+import os
 
-from pyzotero.zotero import Zotero
-
-from .tools import remove_empty_directories
+from .cache import AttachmentCache
+from .dedup import HashCache, find_duplicates
+from .archive import (
+    ARCHIVE_SUFFIX,
+    ARCHIVE_COMPRESSIONS,
+    split_archived_path,
+    read_archive_member_sizes,
+    move_files_into_archive,
+    extract_archived_files,
+)
+from .preferences import PreferenceStore
+from .database import (
+    LINK_MODES,
+    connect_database,
+    retrieve_attachment_paths,
+    retrieve_attachment_keys,
+    retrieve_tagged_item_entries,
+)
+from .tags import TAG_UPDATE_BATCH_SIZE, plan_tag_case_unification
+from .instrumentation import Instrumentation
+from .index import RelocationIndex
+from .journal import (
+    RELOCATION_JOURNAL_FILENAME,
+    RELOCATION_MAP_FILENAME,
+    RelocationJournal,
+    read_relocation_records,
+    read_relocation_archive_names,
+    recover_relocation_journal,
+    discard_relocation_records,
+)
+from .tools import (
+    remove_empty_directories,
+    find_emptied_directories,
+    walk_file_relative_paths,
+    move_files,
+    batched,
+)
 
 _ZOT_DEFAULT_INSTALLATION_PATHS_PARTS = {
     "darwin": ("/", "Applications", "Zotero.app", "Contents", "Resources"),
     "win32": ("C:\\", "Program Files (x86)", "Zotero"),
+    "linux": ("/", "opt", "zotero"),
 }
 
 _ZOT_DEFAULT_PROFILE_RELATIVE_PATHS_PARTS = {
     "darwin": ("Library", "Application Support", "Zotero"),
     "win32": ("AppData", "Roaming", "Zotero", "Zotero"),
+    "linux": (".zotero", "zotero"),
 }
 
+# number of files journaled and synced at a time before being moved
+_RELOCATION_BATCH_SIZE = 256
+
+_UNLINKED_FILES_PLAN_OPERATIONS = ("relocate", "restore", "remove")
+
+# https://github.com/zotero/zotero/blob/master/chrome/content/zotero/xpcom/data/dataObjectUtilities.js
+_ZOT_KEY_PATTERN = re.compile(r"[23456789ABCDEFGHIJKLMNPQRSTUVWXYZ]{8}")
+
+
+def _split_attachment_path(attachment_path):
+    """Split a relative linked attachment path, e.g. "attachments:folder/file.pdf",
+    into a "/" joined path relative to the attachment directory."""
+    return "/".join(
+        path_part
+        for path_part in attachment_path.split("attachments:")[-1].split("/")
+        if path_part not in ("", ".")
+    )
+
+
+def _shard_relative_path(file_relative_path):
+    """Shard a relative path as ("<2 hex digits>", "<12 hex digits>_<filename>"),
+    the digits being those of its hash, for a relocation name unique to the path."""
+    path_hash = hashlib.sha1(file_relative_path.encode("utf-8")).hexdigest()
+    return path_hash[:2], path_hash[:12] + "_" + file_relative_path.rpartition("/")[2]
+
+
+def _instrumented_run(method):
+    """Scope a public operation as an instrumentation run."""
+
+    @functools.wraps(method)
+    def _method(self, *args, **kwargs):
+        with self._instrumentation.run(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return _method
+
 
 class Zot:
     """A Zotero library object.
@@ -28,10 +102,13 @@ class Zot:
         installation directory:
             Mac: /Applications/Zotero.app/Contents/Resources
             Windows 10/8/7/Vista: C:\\Program Files (x86)\\Zotero
+            Linux: /opt/zotero
         profile directory:
             Mac: /Users/\<username\>/Library/Application Support/Zotero
             Windows 10/8/7/Vista: C:\\Users\\\<User Name\>\\AppData\\Roaming\\Zotero\\Zotero
+            Linux: /home/\<username\>/.zotero/zotero
     they need to be specified if customised.
+    The directories and the Web API client are retrieved lazily on first use.
 
     Parameters
     ----------
@@ -43,27 +120,89 @@ class Zot:
         Zotero API user key.
     locale : str, optional
         Zotero bibliography locale, see https://github.com/citation-style-language/locales.
+    backend : str, optional
+        "web" or "local", where the library data is read from,
+        when "local" is input, the Zotero database in the data directory is read instead of the Web API,
+        and no API user ID, library type or key is needed.
+    concurrency : int, optional
+        Maximum number of concurrent Web API requests when retrieving items,
+        the pages are requested one by one if not specified.
+    instrumentation : zotutil.instrumentation.Instrumentation, optional
+        Receiver of the phase, counter and progress events of the operations.
+    shared_libraries : iterable(tuple(str, str)), optional
+        Pairs of library ID and type of the other libraries linking files in the same attachment directory,
+        e.g. [("1234567", "group")], their files are not taken as unlinked,
+        "web" backend only, the Zotero database read by the "local" backend holds all the libraries.
+    session : zotutil.web.WebSession, optional
+        Pool of keep-alive Web API connections to share, e.g. between the Zot objects of a batch,
+        one of `concurrency` connections is created on first use if not specified,
+        the shared libraries share that of their Zot object.
+        It carries every Web API request zotutil sends, reads and writes alike,
+        only the requests sent through the pyzotero client of `self.library` going through its own.
 
     """
 
     def __init__(
-        self, library_id=None, library_type=None, api_key=None, locale="en-GB"
+        self,
+        library_id=None,
+        library_type=None,
+        api_key=None,
+        locale="en-GB",
+        backend="web",
+        concurrency=None,
+        instrumentation=None,
+        shared_libraries=None,
+        session=None,
     ):
+        if backend.lower() not in ("web", "local"):
+            raise ValueError("invalid backend: " + str(backend))
         self._library_id = library_id
         self._library_type = library_type
         self._api_key = api_key
         self._locale = locale
-        self._installation_directory = self._retrieve_default_installation_directory()
-        self._profile_directory = self._retrieve_default_profile_directory()
-        self._retrieve_data_directory()
-        self._retrieve_attachment_root_directory()
-        self._retrieve_library()
+        self._backend = backend.lower()
+        self._concurrency = concurrency
+        self._instrumentation = instrumentation or Instrumentation()
+        self._shared_libraries = tuple(
+            (library_id, library_type)
+            for library_id, library_type in (shared_libraries or ())
+        )
+        self._preference_store = PreferenceStore()
+        if session is not None:
+            self._session = session
 
     def _retrieve_library(self):
+        # pyzotero and its HTTP stack are only imported once the Web API is used
+        from pyzotero.zotero import Zotero
+
         self._library = Zotero(
             self._library_id, self._library_type, self._api_key, self._locale
         )
 
+    def _retrieve_shared_zots(self):
+        # the shared libraries read the same profile, hence the same attachment directory
+        shared_zots = []
+        for library_id, library_type in self._shared_libraries:
+            shared_zot = Zot(
+                library_id,
+                library_type,
+                self._api_key,
+                self._locale,
+                self._backend,
+                self._concurrency,
+            )
+            shared_zot._preference_store = self._preference_store
+            # the session is shared once created, not created for the sake of sharing it
+            if hasattr(self, "_session"):
+                shared_zot._session = self._session
+            else:
+                shared_zot._session_owner = self
+            for attribute in ("_installation_directory", "_profile_directory"):
+                if hasattr(self, attribute):
+                    setattr(shared_zot, attribute, getattr(self, attribute))
+            shared_zots.append(shared_zot)
+        self._shared_zots = tuple(shared_zots)
+
     @staticmethod
     def _retrieve_default_installation_directory():
         return Path(*_ZOT_DEFAULT_INSTALLATION_PATHS_PARTS[sys.platform])
@@ -81,13 +220,17 @@ class Zot:
         )
 
     def _retrieve_attachment_root_directory(self):
+        preferences = self.get_preferences(
+            ("extensions.zotfile.dest_dir", "extensions.zotero.baseAttachmentPath")
+        )
         try:
             self._attachment_root_directory = Path(
-                self._retrieve_preference("extensions.zotfile.dest_dir")
+                preferences.get("extensions.zotfile.dest_dir")
+                or preferences["extensions.zotero.baseAttachmentPath"]
             )
-        except:
-            self._attachment_root_directory = Path(
-                self._retrieve_preference("extensions.zotero.baseAttachmentPath")
+        except KeyError:
+            raise ValueError(
+                'no "extensions.zotero.baseAttachmentPath" information found'
             )
 
     def _retrieve_preference_path(self, preference_type="user", preference_owner=None):
@@ -106,53 +249,85 @@ class Zot:
         -------
         out : pathlib.Path
             A pathlib.Path object that represents the requested preference path.
-            NOTE: For a Zotero plugin will return its xpi `zipfile.ZipFile` object and its default preference `pathlib.PurePath` relative to the former. A new class `zipfile.Path` is introduced in Python 3.8.
-
-        TODO: future revision for `zipfile` for Python 3.8 and above.
+            NOTE: For a Zotero plugin will return its xpi `pathlib.Path` and its default preference `pathlib.PurePath` relative to the former.
 
         """
         if preference_type.lower() == "user":
-            profile_config = ConfigParser()
-            profile_config.read(self._profile_directory / "profiles.ini")
+            profile_config = self._preference_store.read_profiles(
+                self.profile_directory
+            )
             return (
-                self._profile_directory
-                / profile_config["Profile0"]["Path"]
-                / "prefs.js"
+                self.profile_directory / profile_config["Profile0"]["Path"] / "prefs.js"
             )
         elif preference_type.lower() == "default":
             if not preference_owner:
                 raise ValueError("preference owner undefined")
             elif preference_owner.lower() == "zotero":
                 return (
-                    self._installation_directory
+                    self.installation_directory
                     / "defaults"
                     / "preferences"
                     / "zotero.js"
                 )
             else:
-                profile_config = ConfigParser()
-                profile_config.read(self._profile_directory / "profiles.ini")
+                profile_config = self._preference_store.read_profiles(
+                    self.profile_directory
+                )
                 try:
-                    plugin_xpi_path = tuple(
-                        (
-                            self._profile_directory
-                            / profile_config["Profile0"]["Path"]
-                            / "extensions"
-                        ).glob(preference_owner.lower() + "*.xpi")
-                    )[
-                        0
-                    ]  # can there be duplicate plugin packages?
+                    plugin_xpi_path = self._preference_store.find_plugin(
+                        self.profile_directory
+                        / profile_config["Profile0"]["Path"]
+                        / "extensions",
+                        preference_owner,
+                    )
                 except:
                     raise ValueError("no preference owner found")
                 return (
-                    ZipFile(plugin_xpi_path),
+                    plugin_xpi_path,
                     PurePath("defaults", "preferences", "defaults.js"),
                 )
         else:
             raise ValueError("invalid preference type: " + str(preference_type))
 
+    def get_preferences(
+        self, preference_keys=None, preference_type="user", preference_owner=None
+    ):
+        """Retrieve preferences in bulk, the preference file is parsed once until modified.
+
+        Parameters
+        ----------
+        preference_keys : iterable(str), optional
+            Keys to requested preferences defined by Zotero, all preferences if not specified.
+        preference_type : str, optional
+            Parameter for `self._retrieve_preference_path`.
+        preference_owner : str, optional
+            Parameter for `self._retrieve_preference_path`.
+
+        Returns
+        -------
+        out : dict
+            Preference values, i.e. strings, integers or booleans, keyed on the preference keys,
+            keys not found are left out.
+
+        """
+        if preference_type == "default" and (not preference_owner == "zotero"):
+            preferences = self._preference_store.read_plugin_preferences(
+                *self._retrieve_preference_path(preference_type, preference_owner)
+            )
+        else:
+            preferences = self._preference_store.read_preferences(
+                self._retrieve_preference_path(preference_type, preference_owner)
+            )
+        if preference_keys is None:
+            return dict(preferences)
+        return {
+            preference_key: preferences[preference_key]
+            for preference_key in preference_keys
+            if preference_key in preferences
+        }
+
     def _retrieve_preference(self, preference_key, **kwargs):
-        """Retrieve the preference file path.
+        """Retrieve a single preference.
 
         Parameters
         ----------
@@ -163,52 +338,33 @@ class Zot:
 
         Returns
         -------
-        out : str
-            Preference information string.
-
-        TODO: future revision for `zipfile` for Python 3.8 and above
+        out : str, int or bool
+            Preference value.
 
         """
-        preference_type = kwargs.pop("preference_type", "user")
-        preference_owner = kwargs.pop("preference_owner", None)
-
-        re_pattern = '(?<=pref\("' + preference_key + '", ").*(?="\);)'
-        if preference_type == "default" and (not preference_owner == "zotero"):
-            plugin_xpi_path, preference_path_in_xpi = self._retrieve_preference_path(
-                preference_type, preference_owner
-            )
-            # ZipFile.open() needs TextIOWrapper to read as text in the current Python verison, might be enhanced in the future
-            with TextIOWrapper(
-                plugin_xpi_path.open(str(preference_path_in_xpi), "r"), encoding="utf-8"
-            ) as fh:
-                preferences = fh.read()
-        else:
-            preference_path = self._retrieve_preference_path(
-                preference_type, preference_owner
-            )
-            with preference_path.open("rt") as fh:
-                preferences = fh.read()
         try:
-            return re.search(re_pattern, preferences).group(0)
-        except:
+            return self.get_preferences((preference_key,), **kwargs)[preference_key]
+        except KeyError:
             raise ValueError('no "' + preference_key + '" information found')
 
-    def _retrieve_unlinked_files_relocation_maps(self, **kwargs):
+    def _retrieve_unlinked_files_relocations(self, **kwargs):
+        """Retrieve the relocations as pairs of relocation directory and run identifier,
+        the identifier being `None` for all runs relocated to the directory."""
         this_relocation = kwargs.pop("this_relocation", False)
         past_relocation = kwargs.pop("past_relocation", False)
         non_relocation = kwargs.pop("non_relocation", False)
 
-        relocation_maps = []
+        relocations = []
         if this_relocation:
-            if hasattr(self, "_unlinked_files_relocation_map"):
-                relocation_maps.append(self._unlinked_files_relocation_map)
+            if hasattr(self, "_unlinked_files_relocation"):
+                relocations.append(self._unlinked_files_relocation)
             else:
                 raise ValueError("no relocation done previously in this session")
         if past_relocation:
             include = kwargs.pop("include", None)
             exclude = kwargs.pop("exclude", None)
             relocation_foldername_parts = ["_unlinked_files"]
-            if hasattr(self, "_unlinked_files_relocation_map"):
+            if hasattr(self, "_unlinked_files_relocation"):
                 if hasattr(self, "_foldername_suffix"):
                     relocation_foldername_parts.append(self._foldername_suffix)
                 this_relocation_foldername = "_".join(relocation_foldername_parts)
@@ -221,8 +377,9 @@ class Zot:
                     if exclude
                     else this_relocation_foldername
                 )
-            relocation_maps.extend(
-                self.retrieve_unlinked_files_relocation_maps_by_file(
+            relocations.extend(
+                (relocation_directory, None)
+                for relocation_directory in self._retrieve_unlinked_files_relocation_directories(
                     include=include, exclude=exclude
                 )
             )
@@ -232,32 +389,110 @@ class Zot:
             foldername_suffix = kwargs.pop(
                 "foldername_suffix", dt.datetime.now().strftime("%Y%m%d%H%M%S")
             )
-            self.relocate_unlinked_files(zotfile, file_types, foldername_suffix)
-            relocation_maps.append(self._unlinked_files_relocation_map)
-        return tuple(relocation_maps)
+            cache = kwargs.pop("cache", False)
+            workers = kwargs.pop("workers", None)
+            sharded = kwargs.pop("sharded", False)
+            archive = kwargs.pop("archive", None)
+            last_relocation = getattr(self, "_unlinked_files_relocation", None)
+            self.relocate_unlinked_files(
+                zotfile, file_types, foldername_suffix, cache, workers, sharded, archive
+            )
+            if getattr(self, "_unlinked_files_relocation", None) is not last_relocation:
+                relocations.append(self._unlinked_files_relocation)
+        return tuple(relocations)
+
+    def _retrieve_unlinked_files_relocation_directories(
+        self, include=None, exclude=None
+    ):
+        return tuple(
+            self.attachment_root_directory / relocation["foldername"]
+            for relocation in self.list_unlinked_files_relocations(include, exclude)
+        )
 
     # def retrieve_entries(self, **kwargs):
     #     if "limit" in kwargs:
-    #         entries = self._library.top(**kwargs)
+    #         entries = self.library.top(**kwargs)
     #     else:
-    #         entries = self._library.everything(self.__library.top(**kwargs))
+    #         entries = self.library.everything(self.__library.top(**kwargs))
     #     return entries
 
     @property
     def installation_directory(self):
+        if not hasattr(self, "_installation_directory"):
+            self._installation_directory = (
+                self._retrieve_default_installation_directory()
+            )
         return self._installation_directory
 
     @property
     def profile_directory(self):
+        if not hasattr(self, "_profile_directory"):
+            self._profile_directory = self._retrieve_default_profile_directory()
         return self._profile_directory
 
+    @property
+    def data_directory(self):
+        if not hasattr(self, "_data_directory"):
+            self._retrieve_data_directory()
+        return self._data_directory
+
+    @property
+    def attachment_root_directory(self):
+        if not hasattr(self, "_attachment_root_directory"):
+            self._retrieve_attachment_root_directory()
+        return self._attachment_root_directory
+
+    @property
+    def relocation_index(self):
+        if not hasattr(self, "_relocation_index"):
+            self._relocation_index = RelocationIndex(self.attachment_root_directory)
+        return self._relocation_index
+
+    @property
+    def shared_zots(self):
+        if not hasattr(self, "_shared_zots"):
+            self._retrieve_shared_zots()
+        return self._shared_zots
+
+    @property
+    def session(self):
+        if not hasattr(self, "_session"):
+            if hasattr(self, "_session_owner"):
+                self._session = self._session_owner.session
+            else:
+                # the HTTP and asyncio stacks are only imported once the Web API is used
+                from .web import WebSession
+
+                self._session = WebSession(pool_size=self._concurrency or 1)
+        return self._session
+
+    @property
+    def library(self):
+        # the pyzotero client, for the Web API features zotutil does not request itself
+        if not hasattr(self, "_library"):
+            self._retrieve_library()
+        return self._library
+
+    @property
+    def web_library(self):
+        # the "local" backend still writes through the Web API
+        if not hasattr(self, "_web_library"):
+            from .web import WebLibrary
+
+            self._web_library = WebLibrary(
+                self.session, self._library_id, self._library_type, self._api_key
+            )
+        return self._web_library
+
     @installation_directory.setter
     def installation_directory(self, installation_directory):
         installation_directory = Path(installation_directory)
         if installation_directory.is_dir():
             self._installation_directory = installation_directory
         else:
-            raise ValueError("invalid directory: " + installation_directory)
+            raise ValueError("invalid directory: " + str(installation_directory))
+        if hasattr(self, "_shared_zots"):
+            del self._shared_zots
 
     @profile_directory.setter
     def profile_directory(self, profile_directory):
@@ -265,30 +500,260 @@ class Zot:
         if profile_directory.is_dir():
             self._profile_directory = profile_directory
         else:
-            raise ValueError("invalid directory: " + profile_directory)
-        self._retrieve_data_directory()
-        self._retrieve_attachment_root_directory()
+            raise ValueError("invalid directory: " + str(profile_directory))
+        # the directories depending on the profile are retrieved again on access
+        for attribute in (
+            "_data_directory",
+            "_attachment_root_directory",
+            "_attachment_cache",
+            "_relocation_index",
+            "_shared_zots",
+        ):
+            if hasattr(self, attribute):
+                delattr(self, attribute)
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def instrumentation(self):
+        return self._instrumentation
+
+    @property
+    def attachment_cache(self):
+        if not hasattr(self, "_attachment_cache"):
+            self._attachment_cache = AttachmentCache(
+                self.data_directory
+                / "zotutil"
+                / (
+                    "attachments_"
+                    + str(self._library_type)
+                    + "_"
+                    + str(self._library_id)
+                    + ".json"
+                ),
+                self._library_id,
+                self._library_type,
+            )
+        return self._attachment_cache
+
+    def invalidate_attachment_cache(self):
+        """Drop the on-disk attachment cache of the library."""
+        self.attachment_cache.invalidate()
+
+    def refresh_attachment_cache(self, rebuild=False):
+        """Bring the on-disk attachment cache up to date with the library.
+
+        Only items modified and deleted since the cached library version are requested,
+        the cache is rebuilt in full when empty, stale in format, or ahead of the library.
+
+        Parameters
+        ----------
+        rebuild : bool, optional
+            Whether or not to force a full rebuild of the cache.
+
+        Returns
+        -------
+        out : zotutil.cache.AttachmentCache
+            The refreshed attachment cache.
+
+        """
+        if self._backend != "web":
+            raise ValueError(
+                "attachment cache unavailable for backend: " + self._backend
+            )
+        attachment_cache = self.attachment_cache
+        library_version = self.web_library.last_modified_version()
+        if rebuild or (
+            attachment_cache.version is not None
+            and attachment_cache.version > library_version
+        ):
+            attachment_cache.invalidate()
+        if attachment_cache.version is None:
+            attachment_cache.update(
+                self.web_library.items(self._concurrency or 1, itemType="attachment"),
+                (),
+                library_version,
+            )
+        elif attachment_cache.version < library_version:
+            since = attachment_cache.version
+            attachment_cache.update(
+                self.web_library.items(
+                    self._concurrency or 1, itemType="attachment", since=since
+                ),
+                self.web_library.deleted(since).get("items", ()),
+                library_version,
+            )
+        else:
+            return attachment_cache
+        attachment_cache.save()
+        return attachment_cache
+
+    def retrieve_attachment_relative_paths(self, cache=False, rebuild=False, **kwargs):
+        """Retrieve the paths of linked attachments relative to the attachment directory.
+
+        Parameters
+        ----------
+        cache : bool, optional
+            Whether or not to read through the on-disk attachment cache, "web" backend only,
+            `**kwargs` should be left empty when True.
+        rebuild : bool, optional
+            Whether or not to force a full rebuild of the attachment cache when `cache` is True.
+        **kwargs:
+            Query parameters of the items request, see `zotutil.web.fetch_items`,
+            ignored by the "local" backend.
 
-    def retrieve_attachment_relative_paths(self, **kwargs):
-        attachment_entries = self._library.everything(
-            self._library.items(itemType="attachment", **kwargs)
+        Returns
+        -------
+        out : tuple(pathlib.PurePath)
+            Relative paths of the linked attachments.
+
+        """
+        return tuple(
+            self.iterate_attachment_relative_paths(
+                cache=cache, rebuild=rebuild, **kwargs
+            )
         )
-        attachment_relative_paths = []
-        for attachment_entry in attachment_entries:
+
+    def iterate_attachment_relative_paths(
+        self, link_modes=("linked_file",), cache=False, rebuild=False, **kwargs
+    ):
+        """Iterate the paths of attachments relative to the attachment directory, page by page.
+
+        Only a page of item entries is held at a time, or `concurrency` pages, 100 entries being the most the Web API serves,
+        the Web API has no selection of fields, the entries are read for their link mode and path only.
+
+        Parameters
+        ----------
+        link_modes : iterable(str), optional
+            Link modes of the attachments to include, linked files by default,
+            "imported_file", "imported_url", "linked_file" and/or "linked_url",
+            not applied to the attachment cache, which holds the attachments with a path whatever their link modes.
+        cache : bool, optional
+        rebuild : bool, optional
+        **kwargs:
+            Parameters for `self.retrieve_attachment_relative_paths`.
+
+        Yields
+        ----------
+        out : generator
+            A generator of `pathlib.PurePath` relative to the attachment directory.
+
+        """
+        for attachment_relative_path in self._iterate_attachment_relative_paths(
+            cache, rebuild, link_modes, **kwargs
+        ):
+            yield PurePath(attachment_relative_path)
+
+    def _retrieve_linked_attachment_relative_paths(self, cache=False):
+        """Retrieve the linked attachment paths of the library and the shared libraries.
+
+        The libraries are fetched concurrently, one thread each, and merged.
+
+        Parameters
+        ----------
+        cache : bool, optional
+            Parameter for `self.retrieve_attachment_relative_paths`.
+
+        Returns
+        -------
+        out : set(str)
+            "/" joined relative paths of the linked attachments of all the libraries.
+
+        """
+        if self._backend == "local" or (not self._shared_libraries):
+            return set(self._iterate_attachment_relative_paths(cache=cache))
+        zots = (self,) + self.shared_zots
+        with ThreadPoolExecutor(len(zots)) as executor:
+            attachment_relative_path_sets = list(
+                executor.map(
+                    lambda zot: set(
+                        zot._iterate_attachment_relative_paths(cache=cache)
+                    ),
+                    zots,
+                )
+            )
+        attachment_relative_paths = attachment_relative_path_sets[0]
+        for attachment_relative_path_set in attachment_relative_path_sets[1:]:
+            attachment_relative_paths.update(attachment_relative_path_set)
+        return attachment_relative_paths
+
+    def _iterate_attachment_relative_paths(
+        self, cache=False, rebuild=False, link_modes=("linked_file",), **kwargs
+    ):
+        """Iterate the attachment paths as "/" joined relative path strings."""
+        link_modes = frozenset(link_modes)
+        for link_mode in link_modes:
+            if link_mode not in LINK_MODES:
+                raise ValueError("invalid link mode: " + str(link_mode))
+
+        if self._backend == "local":
+            connection = connect_database(self.data_directory)
+            try:
+                for attachment_path in retrieve_attachment_paths(
+                    connection, (LINK_MODES[link_mode] for link_mode in link_modes)
+                ):
+                    attachment_relative_path = self._parse_attachment_relative_path(
+                        attachment_path
+                    )
+                    if attachment_relative_path is not None:
+                        yield attachment_relative_path
+            finally:
+                connection.close()
+            return
+
+        if cache:
+            if kwargs:
+                raise ValueError(
+                    "item filters cannot be applied to the attachment cache"
+                )
+            for attachment_path in self.refresh_attachment_cache(
+                rebuild
+            ).attachment_paths.values():
+                attachment_relative_path = self._parse_attachment_relative_path(
+                    attachment_path
+                )
+                if attachment_relative_path is not None:
+                    yield attachment_relative_path
+            return
+
+        for attachment_entry in self.web_library.items(
+            self._concurrency or 1, itemType="attachment", **kwargs
+        ):
+            attachment_data = attachment_entry["data"]
+            if attachment_data.get("linkMode") not in link_modes:
+                continue
             try:
-                attachment_relative_path = PurePath(
-                    attachment_entry["data"]["path"].split("attachments:")[-1]
+                attachment_relative_path = self._parse_attachment_relative_path(
+                    attachment_data["path"]
                 )
             except:
                 # Attachments that are not managed by linked file
                 continue
-            attachment_relative_paths.append(attachment_relative_path)
-        return tuple(attachment_relative_paths)
+            if attachment_relative_path is not None:
+                yield attachment_relative_path
+
+    def _parse_attachment_relative_path(self, attachment_path):
+        """Parse an attachment path into a "/" joined path relative to the attachment directory,
+        an absolute path being made relative if under it, `None` otherwise."""
+        if not os.path.isabs(attachment_path):
+            return _split_attachment_path(attachment_path)
+        attachment_root_directory = self.attachment_root_directory
+        try:
+            return (
+                PurePath(attachment_path)
+                .relative_to(attachment_root_directory)
+                .as_posix()
+            )
+        except ValueError:
+            # linked outside the attachment directory, hence matching none of its files
+            return None
 
     def retrieve_unlinked_files_relocation_maps_by_file(
         self, include=None, exclude=None
     ):
-        """Retrieve the files relocation maps written into json files.
+        """Retrieve the files relocation maps written into the relocation journals and json files.
 
         Parameters
         ----------
@@ -302,6 +767,28 @@ class Zot:
         out : generator
             A generator of maps derived from different relocated files directories.
 
+        """
+        for (
+            relocation_directory
+        ) in self._retrieve_unlinked_files_relocation_directories(include, exclude):
+            yield dict(read_relocation_records(relocation_directory))
+
+    def list_unlinked_files_relocations(self, include=None, exclude=None):
+        """List the relocations from the relocation index.
+
+        Parameters
+        ----------
+        include : str or iterable(str), optional
+            Relocation foldernames to be included.
+        exclude : str or iterable(str), optional
+            Relocation foldernames to be excluded.
+
+        Returns
+        -------
+        out : tuple(dict)
+            Relocations with the keys: foldername, suffix, created, updated, file_count, bytes and map_path,
+            file_count, bytes and map_path being None for a first run interrupted before being recovered.
+
         """
         include = (include,) if isinstance(include, str) else include
         exclude = (exclude,) if isinstance(exclude, str) else exclude
@@ -311,24 +798,40 @@ class Zot:
                 raise ValueError(
                     ", ".join(same_suffixes) + " found in both 'include' and 'exclude'"
                 )
-        include = tuple(set(include)) if include else tuple()
-        exclude = tuple(set(exclude)) if exclude else tuple()
-
-        for relocation_map_path in [
-            path
-            for path in self._attachment_root_directory.glob("**/_relocation_map.json")
-            if path.parts[-2].startswith("_unlinked_files")
-            and (path.parents[1] == self._attachment_root_directory)
-        ]:
-            if (include and (relocation_map_path.parts[-2] not in include)) or (
-                exclude and (relocation_map_path.parts[-2] in exclude)
-            ):
-                continue
-            with relocation_map_path.open("rt") as fh:
-                yield json.load(fh)
+        return self.relocation_index.list_relocations(include or (), exclude or ())
+
+    def locate_unlinked_file(self, original_path):
+        """Look up where an unlinked file has been relocated to from the relocation index.
+
+        Parameters
+        ----------
+        original_path : str or pathlib.Path
+            Original path of the file, absolute or relative to the attachment directory.
 
+        Returns
+        -------
+        out : tuple(dict)
+            Relocated files with the keys: relocated, original, foldername and size.
+
+        """
+        return self.relocation_index.locate(
+            self.attachment_root_directory / original_path
+        )
+
+    def rebuild_relocation_index(self):
+        """Rebuild the relocation index from the relocation journals and json files."""
+        self.relocation_index.rebuild()
+
+    @_instrumented_run
     def relocate_unlinked_files(
-        self, zotfile=True, file_types=None, foldername_suffix=None
+        self,
+        zotfile=True,
+        file_types=None,
+        foldername_suffix=None,
+        cache=False,
+        workers=None,
+        sharded=False,
+        archive=None,
     ):
         """Relocate unlinked files from the Zotero attachment directory.
 
@@ -344,133 +847,967 @@ class Zot:
         foldername_suffix : str, optional
             Suffix to "_unlinked_files" as the relocation folder name,
             e.g. a timestamp `dt.datetime.now().strftime("%Y%m%d%H%M%S")`
+        cache : bool, optional
+            Whether or not to read the attachment paths through the on-disk attachment cache.
+        workers : int, optional
+            Maximum number of threads to move the files, the files are moved one by one if not specified.
+        sharded : bool, optional
+            Whether or not to relocate the files into subdirectories named by the first 2 hex digits
+            of the hash of their relative paths, under names prefixed by more of the digits,
+            e.g. "_unlinked_files/3f/3fa2c41b90de_file.pdf", instead of flat under their bare names,
+            sparing large directories, in the flat layout, a name already taken is prefixed by the digits,
+            e.g. "_unlinked_files/3fa2c41b90de_file.pdf".
+        archive : str, optional
+            "stored" or "deflated", the compression of the zip archives to pack the files into instead,
+            one archive per batch under the relocation folder, e.g. "20200101000000000000_0000.zip",
+            whose members are named by the paths relative to the attachment directory,
+            `sharded` is then ignored.
+
+        Returns
+        -------
+        out : dict
+            Exceptions raised keyed on the paths of the files failed to relocate.
 
         """
-        # Retrieve the attachment paths
-        attachment_relative_paths = self.retrieve_attachment_relative_paths()
-        attachment_paths = tuple(
-            self._attachment_root_directory / path for path in attachment_relative_paths
+        if archive and (archive not in ARCHIVE_COMPRESSIONS):
+            raise ValueError("invalid archive compression: " + str(archive))
+
+        # Retrieve the attachment paths of all the libraries sharing the directory,
+        # the only ones held in memory throughout
+        with self._instrumentation.phase("retrieve_attachments"):
+            attachment_relative_paths = self._retrieve_linked_attachment_relative_paths(
+                cache
+            )
+        self._instrumentation.count(
+            "attachments_fetched", len(attachment_relative_paths)
         )
 
         # Retrieve the file types
-        if zotfile:
-            try:
-                file_types = self._retrieve_preference("extensions.zotfile.filetypes")
-            except:
-                file_types = self._retrieve_preference(
-                    "extensions.zotfile.filetypes",
-                    preference_type="default",
-                    preference_owner="zotfile",
-                )
-            file_types = tuple(file_type.strip() for file_type in file_types.split(","))
-        else:
-            if not file_types:
-                raise ValueError("neither ZotFile used or file types specified")
-            try:
-                if isinstance(file_types, str):
-                    file_types = tuple(
-                        file_type.strip() for file_type in file_types.split(",")
-                    )
-                else:
-                    file_types = tuple(file_types)
-            except:
-                raise ValueError("invalid file types")
-
-        # Relocate the unlinked files to a designated directory with a map to their orginal paths
-        relocation_foldername_parts = ["_unlinked_files"]
-        if foldername_suffix:
-            self._foldername_suffix = foldername_suffix
-            relocation_foldername_parts.append(foldername_suffix)
-        relocation_directory = self._attachment_root_directory / "_".join(
-            relocation_foldername_parts
-        )
-        if not relocation_directory.is_dir():
-            relocation_directory.mkdir()
+        file_types = self._retrieve_file_types(zotfile, file_types)
 
-        file_relative_paths = tuple(
-            item
-            for item in self._attachment_root_directory.glob("**/*")
-            if item.is_file()
-            and (item.suffix.strip(".") in file_types)
-            and (not item.parts[-2].startswith("_unlinked_files"))
+        # The files on disk are streamed through the diff and moved batch by batch
+        return self._relocate_file_relative_paths(
+            self._instrumentation.iterate_phase(
+                "scan_files",
+                self._iterate_unlinked_file_relative_paths(
+                    attachment_relative_paths, file_types
+                ),
+            ),
+            foldername_suffix,
+            workers,
+            sharded,
+            archive,
         )
-        unlinked_file_paths = set(file_relative_paths) - set(attachment_paths)
-        relocation_map = {}
-        for unlinked_file_path in unlinked_file_paths:
-            unlinked_file_relocated_path = (
-                relocation_directory / unlinked_file_path.name
-            )
-            relocation_map.update(
-                {str(unlinked_file_relocated_path): str(unlinked_file_path)}
-            )
-            unlinked_file_path.rename(unlinked_file_relocated_path)
-        if relocation_map:
-            self._unlinked_files_relocation_map = relocation_map
-            relocation_map_path = relocation_directory / "_relocation_map.json"
-            if relocation_map_path.is_file():
-                with relocation_map_path.open("rt") as fh:
-                    relocation_map = dict(json.load(fh), **relocation_map)
-            with open(relocation_map_path, "wt") as fh:
-                json.dump(relocation_map, fh, indent=4)
-        else:
-            remove_empty_directories(relocation_directory)
 
-        # Remove the empty directories
-        remove_empty_directories(self._attachment_root_directory)
-
-    def remove_unlinked_files(
+    def watch_unlinked_files(
         self,
-        this_relocation=True,
-        past_relocation=False,
-        non_relocation=False,
-        **kwargs,
+        zotfile=True,
+        file_types=None,
+        relocate=False,
+        foldername_suffix=None,
+        cache=True,
+        workers=None,
+        sharded=False,
+        archive=None,
+        interval=1.0,
+        library_interval=60.0,
+        grace_period=300.0,
+        watcher=None,
     ):
-        """Remove the linked files by the given criterion, only those relocated in the same session are removed by default.
+        """Watch the attachment directory for unlinked files, as a long running generator.
+
+        An index of the files is built in a full walk then kept up to date by the watch events,
+        whilst the linked attachments are polled every `library_interval` seconds,
+        through the attachment cache by default, i.e. requesting the changes since the last version seen only.
+        A file is reported once unlinked for `grace_period` seconds,
+        sparing the files being written or yet to be linked, e.g. by ZotFile.
 
         Parameters
         ----------
-        this_relocation : bool, optional
-            Whether or not to remove files relocated in the current session.
-        past_relocation : bool, optional
-            Whether or not to remove files that have been relocated in previous sessions.
-        non_relocation : bool, optional
-            Whether or not to remove files that have yet to be identified and relocated,
-            `this_relocation` and `non_relocation` should not be both True.
-        **kwargs:
-            Parameters for `self.retrieve_unlinked_files_relocation_maps_by_file` and/or `self.relocate_unlinked_files`.
+        zotfile : bool, optional
+        file_types : str or iterable(str), optional
+        foldername_suffix : str, optional
+        cache : bool, optional
+        workers : int, optional
+        sharded : bool, optional
+        archive : str, optional
+            Parameters for `self.relocate_unlinked_files`, `cache` being ignored by the "local" backend.
+        relocate : bool, optional
+            Whether or not to relocate the unlinked files as they are reported.
+        interval : float, optional
+            Maximum seconds to wait for the watch events at a time.
+        library_interval : float, optional
+            Seconds between two polls of the linked attachments.
+        grace_period : float, optional
+            Seconds a file stays unlinked before being reported.
+        watcher : zotutil.watch.InotifyWatcher or zotutil.watch.PollingWatcher, optional
+            Watcher of the attachment directory, closed with the generator,
+            through inotify on Linux and by polling otherwise if not specified.
+
+        Yields
+        ----------
+        out : generator
+            A generator of dicts with the keys:
+            "unlinked": "/" joined paths relative to the attachment directory of the files newly found unlinked,
+            "errors": exceptions raised keyed on the paths of the files failed to relocate.
 
         """
-        if this_relocation and non_relocation:
-            raise ValueError(
-                "'this_relocation' and 'non_relocation' cannot be both True"
-            )
+        # ctypes and the watchers are only imported once watching
+        from .watch import FileIndex, create_watcher
 
-        relocation_maps = self._retrieve_unlinked_files_relocation_maps(
-            this_relocation=this_relocation,
-            past_relocation=past_relocation,
-            non_relocation=non_relocation,
-            **kwargs,
-        )
+        file_types = self._retrieve_file_types(zotfile, file_types)
+        if watcher is None:
+            watcher = create_watcher(self.attachment_root_directory)
+        try:
+            file_index = FileIndex(self.attachment_root_directory, file_types)
+            library_time = None
+            # the first times the files are found unlinked, and the files reported
+            unlinked_times = {}
+            reported_paths = set()
+            while True:
+                now = time.monotonic()
+                if (library_time is None) or (now - library_time >= library_interval):
+                    attachment_relative_paths = (
+                        self._retrieve_linked_attachment_relative_paths(
+                            cache and (self._backend == "web")
+                        )
+                    )
+                    library_time = now
+                    unlinked_times = {
+                        file_relative_path: unlinked_times.get(file_relative_path, now)
+                        for file_relative_path in file_index
+                        if file_relative_path not in attachment_relative_paths
+                    }
+                    reported_paths.intersection_update(unlinked_times)
 
-        # Remove the unlinked files
-        # pathlib.Path.unlink(missing_ok=True) in Python 3.8
-        for relocation_map in relocation_maps:
-            relocation_map_path = None
-            for path in map(lambda x: Path(x), relocation_map.keys()):
-                if path.is_file():
-                    if not relocation_map_path:
-                        relocation_map_path = path.parent / "_relocation_map.json"
-                    path.unlink()
-            if relocation_map_path.is_file():
-                relocation_map_path.unlink()
+                added_paths, removed_paths = file_index.apply(
+                    watcher.read_events(interval)
+                )
+                now = time.monotonic()
+                for file_relative_path in removed_paths:
+                    unlinked_times.pop(file_relative_path, None)
+                    reported_paths.discard(file_relative_path)
+                for file_relative_path in added_paths:
+                    if file_relative_path not in attachment_relative_paths:
+                        unlinked_times.setdefault(file_relative_path, now)
 
-        # Remove the empty directories
-        remove_empty_directories(self._attachment_root_directory)
+                unlinked_paths = sorted(
+                    file_relative_path
+                    for file_relative_path, unlinked_time in unlinked_times.items()
+                    if (now - unlinked_time >= grace_period)
+                    and (file_relative_path not in reported_paths)
+                )
+                if not unlinked_paths:
+                    continue
+                reported_paths.update(unlinked_paths)
+                errors = {}
+                if relocate:
+                    with self._instrumentation.run("watch_unlinked_files"):
+                        errors = self._relocate_file_relative_paths(
+                            unlinked_paths, foldername_suffix, workers, sharded, archive
+                        )
+                yield {"unlinked": unlinked_paths, "errors": errors}
+        finally:
+            watcher.close()
 
-    def restore_unlinked_files(
-        self, this_relocation=True, past_relocation=False, **kwargs
+    def _retrieve_relocation_directory(self, foldername_suffix=None):
+        relocation_foldername_parts = ["_unlinked_files"]
+        if foldername_suffix:
+            relocation_foldername_parts.append(foldername_suffix)
+        return self.attachment_root_directory / "_".join(relocation_foldername_parts)
+
+    @staticmethod
+    def _retrieve_relocated_path(
+        relocation_directory,
+        file_relative_path,
+        sharded=False,
+        archive=None,
+        claimed_names=None,
     ):
-        """Restore the linked files by the given criterion, only those relocated in the same session are removed by default.
+        """Retrieve the relocated path of a file, in the flat layout,
+        a name taken on the disk or in `claimed_names` is prefixed by the hash digits of the path as if sharded,
+        the name used being added to `claimed_names`."""
+        # an archived file is given by its member name, the archive being known once relocated
+        if archive:
+            return file_relative_path
+        if sharded:
+            return relocation_directory.joinpath(
+                *_shard_relative_path(file_relative_path)
+            )
+        relocated_path = relocation_directory / file_relative_path.rpartition("/")[2]
+        if claimed_names is not None:
+            if (relocated_path.name in claimed_names) or relocated_path.exists():
+                relocated_path = (
+                    relocation_directory / _shard_relative_path(file_relative_path)[1]
+                )
+            claimed_names.add(relocated_path.name)
+        return relocated_path
+
+    def _relocate_file_relative_paths(
+        self,
+        file_relative_paths,
+        foldername_suffix=None,
+        workers=None,
+        sharded=False,
+        archive=None,
+    ):
+        """Relocate files given by "/" joined relative paths, see `self.relocate_unlinked_files`."""
+        relocation_directory = self._retrieve_relocation_directory(foldername_suffix)
+        claimed_names = set()
+        return self._relocate_path_pairs(
+            (
+                (
+                    self.attachment_root_directory / file_relative_path,
+                    self._retrieve_relocated_path(
+                        relocation_directory,
+                        file_relative_path,
+                        sharded,
+                        archive,
+                        claimed_names,
+                    ),
+                )
+                for file_relative_path in file_relative_paths
+            ),
+            relocation_directory,
+            workers,
+            archive,
+        )
+
+    def _relocate_path_pairs(
+        self, path_pairs, relocation_directory, workers=None, archive=None
+    ):
+        """Relocate pairs of original and relocated paths as a new run into a relocation directory."""
+        # Relocate the unlinked files to a designated directory with a map to their orginal paths
+        if relocation_directory.name != "_unlinked_files":
+            self._foldername_suffix = relocation_directory.name[
+                len("_unlinked_files_") :
+            ]
+        if not relocation_directory.is_dir():
+            relocation_directory.mkdir()
+
+        # Settle an interrupted run into the same directory before relocating again
+        recover_relocation_journal(relocation_directory)
+        # indexed ahead of the first move, an interrupted run is found by any later session
+        self.relocation_index.register(relocation_directory)
+        run_id = dt.datetime.now().strftime("%Y%m%d%H%M%S%f")
+        touched_directories = set((relocation_directory,))
+        with self._instrumentation.phase("relocate_files"):
+            relocation_bytes = self._retrieve_relocation_bytes(relocation_directory)
+            relocated_count, errors = self._relocate_files(
+                path_pairs,
+                relocation_directory,
+                run_id,
+                workers,
+                touched_directories,
+                archive=archive,
+            )
+            if relocated_count:
+                self._unlinked_files_relocation = (relocation_directory, run_id)
+            else:
+                discard_relocation_records(relocation_directory)
+            self.relocation_index.synchronise(relocation_directory)
+            self._instrumentation.count(
+                "bytes_moved",
+                self._retrieve_relocation_bytes(relocation_directory)
+                - relocation_bytes,
+            )
+
+        # Remove the empty directories left behind
+        with self._instrumentation.phase("remove_empty_directories"):
+            remove_empty_directories(
+                self.attachment_root_directory, touched_directories
+            )
+
+        return errors
+
+    def _retrieve_file_types(self, zotfile=True, file_types=None):
+        """Retrieve the file types to inspect, see `self.relocate_unlinked_files`."""
+        if zotfile:
+            try:
+                file_types = self._retrieve_preference("extensions.zotfile.filetypes")
+            except:
+                file_types = self._retrieve_preference(
+                    "extensions.zotfile.filetypes",
+                    preference_type="default",
+                    preference_owner="zotfile",
+                )
+            return tuple(file_type.strip() for file_type in file_types.split(","))
+        if not file_types:
+            raise ValueError("neither ZotFile used or file types specified")
+        try:
+            if isinstance(file_types, str):
+                return tuple(file_type.strip() for file_type in file_types.split(","))
+            return tuple(file_types)
+        except:
+            raise ValueError("invalid file types")
+
+    @_instrumented_run
+    def find_duplicate_unlinked_files(
+        self, zotfile=True, file_types=None, cache=False, workers=None
+    ):
+        """Find the unlinked files byte-identical to the linked attachments.
+
+        The attachment directory is walked once, the files being split into linked and unlinked,
+        then matched by size, the hash of their first and last blocks, and their full hash.
+        The hashes are cached by path, size and modification time in the data directory,
+        so that only the files new or modified since are read on the next runs.
+
+        Parameters
+        ----------
+        zotfile : bool, optional
+        file_types : str or iterable(str), optional
+        cache : bool, optional
+            Parameters for `self.relocate_unlinked_files`.
+        workers : int, optional
+            Maximum number of threads to hash the files.
+
+        Returns
+        -------
+        out : dict
+            Paths relative to the attachment directory, "/" joined, with the keys:
+            "duplicates": the linked attachments identical to each unlinked file with any,
+            "orphaned": the unlinked files with no identical linked attachment,
+            "errors": exceptions raised keyed on the paths of the files failed to read.
+
+        """
+        with self._instrumentation.phase("retrieve_attachments"):
+            attachment_relative_paths = self._retrieve_linked_attachment_relative_paths(
+                cache
+            )
+        self._instrumentation.count(
+            "attachments_fetched", len(attachment_relative_paths)
+        )
+        file_types = self._retrieve_file_types(zotfile, file_types)
+
+        root_directory = str(self.attachment_root_directory)
+        linked_file_paths = []
+        unlinked_file_paths = []
+        with self._instrumentation.phase("scan_files"):
+            for file_relative_path in walk_file_relative_paths(
+                root_directory, file_types
+            ):
+                (
+                    linked_file_paths
+                    if file_relative_path in attachment_relative_paths
+                    else unlinked_file_paths
+                ).append(os.path.join(root_directory, file_relative_path))
+        self._instrumentation.count(
+            "files_scanned", len(linked_file_paths) + len(unlinked_file_paths)
+        )
+
+        hash_cache = HashCache(self.data_directory / "zotutil" / "hashes.json")
+        with self._instrumentation.phase("hash_files"):
+            duplicates, errors = find_duplicates(
+                unlinked_file_paths, linked_file_paths, workers, hash_cache
+            )
+            hash_cache.save()
+        self._instrumentation.count("errors", len(errors))
+
+        def _relative_path(file_path):
+            return file_path[len(root_directory) + 1 :]
+
+        return {
+            "duplicates": {
+                _relative_path(unlinked_file_path): [
+                    _relative_path(linked_file_path)
+                    for linked_file_path in linked_file_paths
+                ]
+                for unlinked_file_path, linked_file_paths in duplicates.items()
+                if linked_file_paths
+            },
+            "orphaned": [
+                _relative_path(unlinked_file_path)
+                for unlinked_file_path, linked_file_paths in duplicates.items()
+                if not linked_file_paths
+            ],
+            "errors": {
+                _relative_path(file_path): error for file_path, error in errors.items()
+            },
+        }
+
+    def check_attachment_consistency(self, zotfile=True, file_types=None, cache=False):
+        """Check the linked attachments against the attachment directory both ways.
+
+        The attachments are fetched once and the attachment directory is walked once,
+        the orphaned files being yielded along the walk and the missing files after it.
+
+        Parameters
+        ----------
+        zotfile : bool, optional
+        file_types : str or iterable(str), optional
+            Parameters for `self.relocate_unlinked_files`, only the orphaned files are filtered by.
+        cache : bool, optional
+            Parameter for `self.relocate_unlinked_files`.
+
+        Yields
+        ----------
+        out : generator
+            A generator of json serialisable dicts with the keys:
+            "status": "orphaned" for a file linked by no attachment,
+            or "missing" for an attachment linking no file,
+            "path": the path relative to the attachment directory, "/" joined.
+
+        """
+        with self._instrumentation.run("check_attachment_consistency"):
+            with self._instrumentation.phase("retrieve_attachments"):
+                attachment_relative_paths = (
+                    self._retrieve_linked_attachment_relative_paths(cache)
+                )
+            self._instrumentation.count(
+                "attachments_fetched", len(attachment_relative_paths)
+            )
+            file_types = frozenset(self._retrieve_file_types(zotfile, file_types))
+
+            # the linked files are discarded as found, leaving the missing ones
+            files_scanned = 0
+            with self._instrumentation.phase("scan_files"):
+                for file_relative_path in walk_file_relative_paths(
+                    self.attachment_root_directory
+                ):
+                    files_scanned += 1
+                    self._instrumentation.progress("scan_files", files_scanned)
+                    if file_relative_path in attachment_relative_paths:
+                        attachment_relative_paths.discard(file_relative_path)
+                    elif os.path.splitext(file_relative_path)[1][1:] in file_types:
+                        yield {"status": "orphaned", "path": file_relative_path}
+            self._instrumentation.count("files_scanned", files_scanned)
+            for attachment_relative_path in sorted(attachment_relative_paths):
+                yield {"status": "missing", "path": attachment_relative_path}
+
+    def _retrieve_attachment_keys(self):
+        """Retrieve the attachment keys of all the libraries sharing the storage directory, the trashed ones included.
+
+        The local database next to the storage directory holds all the synced libraries,
+        it is read whatever the backend, a `ValueError` being raised if missing,
+        for the Web API only knows of the library and the shared libraries, not of the other synced ones.
+        For the "web" backend, the keys of the library and the shared libraries are added,
+        fetched concurrently, one thread each, e.g. for those synced since the database was last checkpointed.
+
+        Returns
+        -------
+        out : set(str)
+            Keys of the attachments of all the libraries.
+
+        """
+        connection = connect_database(self.data_directory)
+        try:
+            attachment_keys = set(retrieve_attachment_keys(connection))
+        finally:
+            connection.close()
+        if self._backend == "local":
+            return attachment_keys
+        zots = (self,) + self.shared_zots
+        with ThreadPoolExecutor(len(zots)) as executor:
+            for attachment_key_set in executor.map(
+                lambda zot: zot._retrieve_library_attachment_keys(), zots
+            ):
+                attachment_keys.update(attachment_key_set)
+        return attachment_keys
+
+    def _retrieve_library_attachment_keys(self):
+        # the keys come all in one response each, with no entry to parse
+        attachment_keys = set(self.web_library.item_keys(itemType="attachment"))
+        attachment_keys.update(
+            self.web_library.item_keys(trash=True, itemType="attachment")
+        )
+        return attachment_keys
+
+    def _iterate_orphaned_storage_directories(self, attachment_keys):
+        """Iterate the key named folders of the storage directory in a single scan,
+        yielding those named by none of `attachment_keys`."""
+        storage_directory = self.data_directory / "storage"
+        if not storage_directory.is_dir():
+            return
+        directories_scanned = 0
+        with os.scandir(str(storage_directory)) as entries:
+            for entry in entries:
+                if not (
+                    _ZOT_KEY_PATTERN.fullmatch(entry.name)
+                    and entry.is_dir(follow_symlinks=False)
+                ):
+                    continue
+                directories_scanned += 1
+                self._instrumentation.progress("scan_files", directories_scanned)
+                if entry.name not in attachment_keys:
+                    yield Path(entry.path)
+        self._instrumentation.count("directories_scanned", directories_scanned)
+
+    def find_orphaned_storage_folders(self):
+        """Find the folders of the Zotero storage directory left behind by deleted attachments.
+
+        The folders named by 8-character keys are listed in a single scan of the storage directory
+        and checked against the attachment keys of all the synced libraries from the local database,
+        along with the key listings of the library and the shared libraries for the "web" backend,
+        the trashed attachments included.
+
+        Yields
+        ----------
+        out : generator
+            A generator of json serialisable dicts with the keys:
+            "key": the folder name, "path": the folder path,
+            "file_count" and "size": the number of files and their total bytes in the folder.
+
+        """
+        with self._instrumentation.run("find_orphaned_storage_folders"):
+            with self._instrumentation.phase("retrieve_attachments"):
+                attachment_keys = self._retrieve_attachment_keys()
+            self._instrumentation.count("attachments_fetched", len(attachment_keys))
+            with self._instrumentation.phase("scan_files"):
+                for storage_directory in self._iterate_orphaned_storage_directories(
+                    attachment_keys
+                ):
+                    file_count = 0
+                    size = 0
+                    for file_relative_path in walk_file_relative_paths(
+                        storage_directory, excluded_prefixes=()
+                    ):
+                        file_count += 1
+                        try:
+                            size += os.stat(
+                                str(storage_directory / file_relative_path)
+                            ).st_size
+                        except OSError:
+                            continue
+                    yield {
+                        "key": storage_directory.name,
+                        "path": str(storage_directory),
+                        "file_count": file_count,
+                        "size": size,
+                    }
+
+    @_instrumented_run
+    def relocate_orphaned_storage_folders(
+        self, foldername_suffix="storage", workers=None, archive=None
+    ):
+        """Relocate the files of the orphaned folders of the Zotero storage directory,
+        see `self.find_orphaned_storage_folders`.
+
+        The files are relocated as unlinked files into the relocation folder under their keys,
+        e.g. "_unlinked_files_storage/ABCD2345/file.pdf",
+        to be restored or removed by `self.restore_unlinked_files` or `self.remove_unlinked_files`,
+        the orphaned folders are then removed once emptied.
+
+        Parameters
+        ----------
+        foldername_suffix : str, optional
+            Suffix to "_unlinked_files" as the relocation folder name.
+        workers : int, optional
+        archive : str, optional
+            Parameters for `self.relocate_unlinked_files`.
+
+        Returns
+        -------
+        out : dict
+            Exceptions raised keyed on the paths of the files failed to relocate.
+
+        """
+        if archive and (archive not in ARCHIVE_COMPRESSIONS):
+            raise ValueError("invalid archive compression: " + str(archive))
+
+        with self._instrumentation.phase("retrieve_attachments"):
+            attachment_keys = self._retrieve_attachment_keys()
+        self._instrumentation.count("attachments_fetched", len(attachment_keys))
+
+        relocation_directory = self._retrieve_relocation_directory(foldername_suffix)
+        storage_directories = []
+
+        def _iterate_path_pairs():
+            for storage_directory in self._iterate_orphaned_storage_directories(
+                attachment_keys
+            ):
+                storage_directories.append(storage_directory)
+                # the folder is listed before being moved from
+                for file_relative_path in tuple(
+                    walk_file_relative_paths(storage_directory, excluded_prefixes=())
+                ):
+                    member_name = storage_directory.name + "/" + file_relative_path
+                    yield (
+                        storage_directory / file_relative_path,
+                        (
+                            member_name
+                            if archive
+                            else relocation_directory.joinpath(*member_name.split("/"))
+                        ),
+                    )
+
+        errors = self._relocate_path_pairs(
+            _iterate_path_pairs(), relocation_directory, workers, archive
+        )
+
+        # Remove the orphaned folders emptied, lying outside the attachment directory
+        with self._instrumentation.phase("remove_empty_directories"):
+            for storage_directory in storage_directories:
+                remove_empty_directories(storage_directory)
+
+        return errors
+
+    def _iterate_unlinked_file_relative_paths(
+        self, attachment_relative_paths, file_types=None
+    ):
+        """Walk the attachment directory for the files out of the linked attachments.
+
+        Parameters
+        ----------
+        attachment_relative_paths : set(str)
+            "/" joined relative paths of the linked attachments.
+        file_types : iterable(str), optional
+            File types to inspect, all if not specified.
+
+        Yields
+        ----------
+        out : generator
+            A generator of "/" joined relative paths of the unlinked files.
+
+        """
+        files_scanned = 0
+        for file_relative_path in walk_file_relative_paths(
+            self.attachment_root_directory, file_types
+        ):
+            files_scanned += 1
+            self._instrumentation.progress("scan_files", files_scanned)
+            if file_relative_path not in attachment_relative_paths:
+                yield file_relative_path
+        self._instrumentation.count("files_scanned", files_scanned)
+
+    def _retrieve_relocation_bytes(self, relocation_directory):
+        for relocation in self.relocation_index.list_relocations(
+            (relocation_directory.name,)
+        ):
+            return relocation["bytes"] or 0
+        return 0
+
+    def _relocate_files(
+        self,
+        path_pairs,
+        relocation_directory,
+        run_id,
+        workers=None,
+        touched_directories=None,
+        total=None,
+        archive=None,
+    ):
+        """Move the files in batches, each batch is journaled and synced before moving,
+        the directories moved from are added to `touched_directories`,
+        with `archive`, the files are paired with their member names and each batch is packed into an archive.
+        """
+        relocated_count = 0
+        errors = {}
+        with RelocationJournal(relocation_directory, run_id) as journal:
+            for batch_index, path_pair_batch in enumerate(
+                batched(path_pairs, _RELOCATION_BATCH_SIZE)
+            ):
+                if archive:
+                    archive_path = relocation_directory / (
+                        run_id + "_" + str(batch_index).zfill(4) + ARCHIVE_SUFFIX
+                    )
+                    path_pair_batch = tuple(
+                        (original_path, archive_path.joinpath(*member_name.split("/")))
+                        for original_path, member_name in path_pair_batch
+                    )
+                journal.record(
+                    "move",
+                    (
+                        (relocated_path, original_path)
+                        for original_path, relocated_path in path_pair_batch
+                    ),
+                )
+                if archive:
+                    relocated_path_pairs, batch_errors = move_files_into_archive(
+                        path_pair_batch, archive_path, archive
+                    )
+                else:
+                    # a file already at its relocated path is never overwritten
+                    relocated_path_pairs, batch_errors = move_files(
+                        path_pair_batch, workers, replace=False
+                    )
+                journal.record(
+                    "moved",
+                    (
+                        (relocated_path, original_path)
+                        for original_path, relocated_path in relocated_path_pairs
+                    ),
+                )
+                journal.record(
+                    "failed",
+                    (
+                        (relocated_path, original_path)
+                        for original_path, relocated_path in path_pair_batch
+                        if original_path in batch_errors
+                    ),
+                )
+                relocated_count += len(relocated_path_pairs)
+                errors.update(batch_errors)
+                if touched_directories is not None:
+                    touched_directories.update(
+                        path_pair[0].parent for path_pair in relocated_path_pairs
+                    )
+                self._instrumentation.count("files_moved", len(relocated_path_pairs))
+                self._instrumentation.count("errors", len(batch_errors))
+                self._instrumentation.progress(
+                    "relocate_files", relocated_count + len(errors), total
+                )
+        # the total of streamed files is only known once they are all moved
+        self._instrumentation.progress(
+            "relocate_files",
+            relocated_count + len(errors),
+            relocated_count + len(errors) if total is None else total,
+        )
+        return relocated_count, errors
+
+    def _select_relocated_paths(self, relocation_directory, run_id, files):
+        """Select the relocated paths of a relocation by their original or relocated paths,
+        or by a directory or an archive they are relocated under, `None` for all if `files` is not specified.
+        """
+        if files is None:
+            return None
+        file_paths = set(str(self.attachment_root_directory / file) for file in files)
+        return set(
+            relocated_path
+            for relocated_path, original_path in read_relocation_records(
+                relocation_directory, run_id
+            )
+            if (original_path in file_paths)
+            or (relocated_path in file_paths)
+            or any(
+                str(parent_path) in file_paths
+                for parent_path in PurePath(relocated_path).parents
+            )
+        )
+
+    def _restore_relocation(
+        self,
+        relocation_directory,
+        run_id=None,
+        workers=None,
+        touched_directories=None,
+        relocated_paths=None,
+    ):
+        """Restore the files of a relocation, the failed ones are kept in the journal,
+        the directories restored from are added to `touched_directories`,
+        only the files of `relocated_paths` are restored if specified."""
+        restoration_path_pairs = []
+        extraction_path_pairs = []
+        missing_path_pairs = []
+        for relocated_path, original_path in read_relocation_records(
+            relocation_directory, run_id
+        ):
+            if (relocated_paths is not None) and (
+                relocated_path not in relocated_paths
+            ):
+                continue
+            # very rare that the original path is occupied, just in case
+            if Path(relocated_path).is_file():
+                restoration_path_pairs.append(
+                    (Path(relocated_path), Path(original_path))
+                )
+            elif split_archived_path(relocated_path) is not None:
+                extraction_path_pairs.append(
+                    (Path(relocated_path), Path(original_path))
+                )
+            else:
+                missing_path_pairs.append((relocated_path, original_path))
+        errors = {}
+        restored_count = 0
+        relocation_bytes = self._retrieve_relocation_bytes(relocation_directory)
+        with RelocationJournal(relocation_directory, run_id) as journal:
+            # files gone from the relocation directory have nothing to restore
+            journal.record("removed", missing_path_pairs)
+            for restore_files, path_pairs in (
+                (
+                    lambda path_pairs: move_files(path_pairs, workers, replace=False),
+                    restoration_path_pairs,
+                ),
+                (extract_archived_files, extraction_path_pairs),
+            ):
+                for path_pair_batch in batched(path_pairs, _RELOCATION_BATCH_SIZE):
+                    restored_path_pairs, batch_errors = restore_files(path_pair_batch)
+                    journal.record("restored", restored_path_pairs)
+                    errors.update(batch_errors)
+                    if (touched_directories is not None) and (
+                        path_pairs is restoration_path_pairs
+                    ):
+                        touched_directories.update(
+                            path_pair[0].parent for path_pair in restored_path_pairs
+                        )
+                    restored_count += len(restored_path_pairs)
+                    self._instrumentation.count("files_moved", len(restored_path_pairs))
+                    self._instrumentation.count("errors", len(batch_errors))
+                    self._instrumentation.progress(
+                        "restore_files",
+                        restored_count + len(errors),
+                        len(restoration_path_pairs) + len(extraction_path_pairs),
+                    )
+        self._discard_relocation_archives(relocation_directory)
+        discard_relocation_records(relocation_directory)
+        self.relocation_index.synchronise(relocation_directory)
+        self._instrumentation.count(
+            "bytes_moved",
+            relocation_bytes - self._retrieve_relocation_bytes(relocation_directory),
+        )
+        return errors
+
+    def _remove_relocation(
+        self,
+        relocation_directory,
+        run_id=None,
+        touched_directories=None,
+        relocated_paths=None,
+    ):
+        """Remove the files of a relocation,
+        the directories removed from are added to `touched_directories`,
+        only the files of `relocated_paths` are removed if specified."""
+        removed_path_pairs = []
+        # pathlib.Path.unlink(missing_ok=True) in Python 3.8
+        for relocated_path, original_path in read_relocation_records(
+            relocation_directory, run_id
+        ):
+            if (relocated_paths is not None) and (
+                relocated_path not in relocated_paths
+            ):
+                continue
+            if Path(relocated_path).is_file():
+                Path(relocated_path).unlink()
+                if touched_directories is not None:
+                    touched_directories.add(Path(relocated_path).parent)
+            removed_path_pairs.append((relocated_path, original_path))
+            self._instrumentation.progress("remove_files", len(removed_path_pairs))
+        self._instrumentation.count("files_removed", len(removed_path_pairs))
+        with RelocationJournal(relocation_directory, run_id) as journal:
+            journal.record("removed", removed_path_pairs)
+        # the archives are dropped as a whole once none of their files is left
+        self._discard_relocation_archives(relocation_directory)
+        discard_relocation_records(relocation_directory)
+        self.relocation_index.synchronise(relocation_directory)
+
+    @staticmethod
+    def _discard_relocation_archives(relocation_directory):
+        """Delete the archives of a relocation with no file left, along with the incomplete ones,
+        only the archives journaled as such being deleted, never the relocated files of an archive suffix.
+        """
+        if not relocation_directory.is_dir():
+            return
+        live_archive_paths = set()
+        for relocated_path, _ in read_relocation_records(relocation_directory):
+            if (ARCHIVE_SUFFIX + os.sep) in relocated_path:
+                split_path = split_archived_path(relocated_path)
+                if split_path is not None:
+                    live_archive_paths.add(split_path[0])
+        for archive_name in read_relocation_archive_names(relocation_directory):
+            archive_path = relocation_directory / archive_name
+            if archive_path in live_archive_paths:
+                continue
+            for path in (archive_path, archive_path.with_name(archive_name + ".tmp")):
+                if path.is_file():
+                    path.unlink()
+
+    @_instrumented_run
+    def recover_unlinked_files(self, rollback=False, include=None, exclude=None):
+        """Settle the relocations interrupted in previous sessions, e.g. by a crash.
+
+        The interrupted moves are recorded as done or failed by what is found on the disk,
+        another relocation into the same directory then resumes the run.
+
+        Parameters
+        ----------
+        rollback : bool, optional
+            Whether or not to restore the files of the interrupted runs.
+        include : str or iterable(str), optional
+            Relocation foldernames to be included.
+        exclude : str or iterable(str), optional
+            Relocation foldernames to be excluded.
+
+        Returns
+        -------
+        out : dict
+            Exceptions raised keyed on the relocated paths of the files failed to restore.
+
+        """
+        errors = {}
+        touched_directories = set()
+        for (
+            relocation_directory
+        ) in self._retrieve_unlinked_files_relocation_directories(include, exclude):
+            moved_path_pairs, unmoved_path_pairs = recover_relocation_journal(
+                relocation_directory
+            )
+            self.relocation_index.synchronise(relocation_directory)
+            if not rollback:
+                continue
+            for run_id in set(moved_path_pairs) | set(unmoved_path_pairs):
+                errors.update(
+                    self._restore_relocation(
+                        relocation_directory,
+                        run_id,
+                        touched_directories=touched_directories,
+                    )
+                )
+            touched_directories.add(relocation_directory)
+        if rollback:
+            remove_empty_directories(
+                self.attachment_root_directory, touched_directories
+            )
+        return errors
+
+    @_instrumented_run
+    def remove_unlinked_files(
+        self,
+        this_relocation=True,
+        past_relocation=False,
+        non_relocation=False,
+        **kwargs,
+    ):
+        """Remove the linked files by the given criterion, only those relocated in the same session are removed by default.
+
+        Parameters
+        ----------
+        this_relocation : bool, optional
+            Whether or not to remove files relocated in the current session.
+        past_relocation : bool, optional
+            Whether or not to remove files that have been relocated in previous sessions.
+        non_relocation : bool, optional
+            Whether or not to remove files that have yet to be identified and relocated,
+            `this_relocation` and `non_relocation` should not be both True.
+        **kwargs:
+            Parameters for `self.retrieve_unlinked_files_relocation_maps_by_file` and/or `self.relocate_unlinked_files`.
+
+        """
+        if this_relocation and non_relocation:
+            raise ValueError(
+                "'this_relocation' and 'non_relocation' cannot be both True"
+            )
+
+        relocations = self._retrieve_unlinked_files_relocations(
+            this_relocation=this_relocation,
+            past_relocation=past_relocation,
+            non_relocation=non_relocation,
+            **kwargs,
+        )
+
+        # Remove the unlinked files
+        touched_directories = set()
+        with self._instrumentation.phase("remove_files"):
+            for relocation_directory, run_id in relocations:
+                self._remove_relocation(
+                    relocation_directory, run_id, touched_directories
+                )
+                touched_directories.add(relocation_directory)
+
+        # Remove the empty directories left behind
+        with self._instrumentation.phase("remove_empty_directories"):
+            remove_empty_directories(
+                self.attachment_root_directory, touched_directories
+            )
+
+    @_instrumented_run
+    def restore_unlinked_files(
+        self,
+        this_relocation=True,
+        past_relocation=False,
+        workers=None,
+        files=None,
+        **kwargs,
+    ):
+        """Restore the linked files by the given criterion, only those relocated in the same session are removed by default.
 
         Parameters
         ----------
@@ -478,33 +1815,531 @@ class Zot:
             Whether or not to restore relocated files in the current session.
         past_relocation : bool, optional
             Whether or not to restore files that have been relocated in previous sessions.
+        workers : int, optional
+            Maximum number of threads to move the files, the files are moved one by one if not specified.
+        files : iterable(str or pathlib.Path), optional
+            Original or relocated paths of the files to restore, relative to the attachment directory or absolute,
+            a directory or an archive selecting all the files relocated under it, e.g. a batch of an archived run,
+            all the files of the relocations are restored if not specified.
         **kwargs:
             Parameters for `self.retrieve_unlinked_files_relocation_maps_by_file()`.
 
+        Returns
+        -------
+        out : dict
+            Exceptions raised keyed on the relocated paths of the files failed to restore,
+            their entries are kept in the relocation journals.
+
         """
-        relocation_maps = self._retrieve_unlinked_files_relocation_maps(
+        relocations = self._retrieve_unlinked_files_relocations(
             this_relocation=this_relocation, past_relocation=past_relocation, **kwargs
         )
 
         # Restore the unlinked files
-        for relocation_map in relocation_maps:
-            relocation_map_path = None
-            for relocated_path, original_path in relocation_map.items():
-                relocated_path = Path(relocated_path)
-                original_path = Path(original_path)
-                if relocated_path.is_file():
-                    if not relocation_map_path:
-                        relocation_map_path = (
-                            relocated_path.parent / "_relocation_map.json"
+        errors = {}
+        touched_directories = set()
+        with self._instrumentation.phase("restore_files"):
+            for relocation_directory, run_id in relocations:
+                errors.update(
+                    self._restore_relocation(
+                        relocation_directory,
+                        run_id,
+                        workers,
+                        touched_directories,
+                        self._select_relocated_paths(
+                            relocation_directory, run_id, files
+                        ),
+                    )
+                )
+                touched_directories.add(relocation_directory)
+
+        # Remove the empty directories left behind
+        with self._instrumentation.phase("remove_empty_directories"):
+            remove_empty_directories(
+                self.attachment_root_directory, touched_directories
+            )
+
+        return errors
+
+    def plan_relocate_unlinked_files(
+        self,
+        zotfile=True,
+        file_types=None,
+        foldername_suffix=None,
+        cache=False,
+        sharded=False,
+        archive=None,
+    ):
+        """Plan the relocation of the unlinked files without moving any,
+        to be reviewed and applied later by `self.apply_unlinked_files_plan`.
+
+        Parameters
+        ----------
+        zotfile : bool, optional
+        file_types : str or iterable(str), optional
+        foldername_suffix : str, optional
+        cache : bool, optional
+        sharded : bool, optional
+        archive : str, optional
+            Parameters for `self.relocate_unlinked_files`.
+
+        Returns
+        -------
+        out : dict
+            A json serialisable plan, see `self._build_unlinked_files_plan`.
+
+        """
+        if archive and (archive not in ARCHIVE_COMPRESSIONS):
+            raise ValueError("invalid archive compression: " + str(archive))
+
+        with self._instrumentation.phase("retrieve_attachments"):
+            attachment_relative_paths = self._retrieve_linked_attachment_relative_paths(
+                cache
+            )
+        self._instrumentation.count(
+            "attachments_fetched", len(attachment_relative_paths)
+        )
+        file_types = self._retrieve_file_types(zotfile, file_types)
+
+        relocation_directory = self._retrieve_relocation_directory(foldername_suffix)
+        claimed_names = set()
+        planned_files = []
+        for file_relative_path in self._instrumentation.iterate_phase(
+            "scan_files",
+            self._iterate_unlinked_file_relative_paths(
+                attachment_relative_paths, file_types
+            ),
+        ):
+            original_path = self.attachment_root_directory / file_relative_path
+            size, mtime_ns = self._stat_planned_file(original_path)
+            if size is None:
+                # gone since walked
+                continue
+            relocated_path = self._retrieve_relocated_path(
+                relocation_directory,
+                file_relative_path,
+                sharded,
+                archive,
+                claimed_names,
+            )
+            planned_files.append(
+                {
+                    "source": str(original_path),
+                    "target": str(relocated_path),
+                    "size": size,
+                    "mtime_ns": mtime_ns,
+                }
+            )
+        return self._build_unlinked_files_plan(
+            "relocate",
+            [
+                {
+                    "directory": str(relocation_directory),
+                    "run": None,
+                    "archive": archive,
+                    "files": planned_files,
+                }
+            ],
+        )
+
+    def plan_restore_unlinked_files(
+        self, this_relocation=True, past_relocation=False, include=None, exclude=None
+    ):
+        """Plan the restoration of the relocated files without moving any,
+        to be reviewed and applied later by `self.apply_unlinked_files_plan`.
+
+        Parameters
+        ----------
+        this_relocation : bool, optional
+        past_relocation : bool, optional
+            Parameters for `self.restore_unlinked_files`.
+        include : str or iterable(str), optional
+            Relocation foldernames to be included.
+        exclude : str or iterable(str), optional
+            Relocation foldernames to be excluded.
+
+        Returns
+        -------
+        out : dict
+            A json serialisable plan, see `self._build_unlinked_files_plan`.
+
+        """
+        return self._plan_relocated_files(
+            "restore", this_relocation, past_relocation, include, exclude
+        )
+
+    def plan_remove_unlinked_files(
+        self, this_relocation=True, past_relocation=False, include=None, exclude=None
+    ):
+        """Plan the removal of the relocated files without removing any,
+        to be reviewed and applied later by `self.apply_unlinked_files_plan`,
+        the files yet to be relocated are to be planned for relocation first.
+
+        Parameters
+        ----------
+        this_relocation : bool, optional
+        past_relocation : bool, optional
+            Parameters for `self.remove_unlinked_files`.
+        include : str or iterable(str), optional
+            Relocation foldernames to be included.
+        exclude : str or iterable(str), optional
+            Relocation foldernames to be excluded.
+
+        Returns
+        -------
+        out : dict
+            A json serialisable plan, see `self._build_unlinked_files_plan`.
+
+        """
+        return self._plan_relocated_files(
+            "remove", this_relocation, past_relocation, include, exclude
+        )
+
+    def _plan_relocated_files(
+        self, operation, this_relocation, past_relocation, include, exclude
+    ):
+        relocations = self._retrieve_unlinked_files_relocations(
+            this_relocation=this_relocation,
+            past_relocation=past_relocation,
+            include=include,
+            exclude=exclude,
+        )
+        planned_relocations = []
+        archive_member_sizes = {}
+        for relocation_directory, run_id in relocations:
+            planned_files = []
+            for relocated_path, original_path in read_relocation_records(
+                relocation_directory, run_id
+            ):
+                # the files gone from the relocation directory are planned with no size
+                size, mtime_ns = self._stat_planned_file(
+                    relocated_path, archive_member_sizes
+                )
+                planned_files.append(
+                    {
+                        "source": relocated_path,
+                        "target": original_path if operation == "restore" else None,
+                        "size": size,
+                        "mtime_ns": mtime_ns,
+                    }
+                )
+            planned_relocations.append(
+                {
+                    "directory": str(relocation_directory),
+                    "run": run_id,
+                    "archive": None,
+                    "files": planned_files,
+                }
+            )
+        return self._build_unlinked_files_plan(operation, planned_relocations)
+
+    @staticmethod
+    def _stat_planned_file(path, archive_member_sizes=None):
+        """Retrieve the size and modification time in nanoseconds of a file,
+        only the size for an archived file, and neither for a missing one."""
+        try:
+            stat_result = os.stat(str(path))
+            return stat_result.st_size, stat_result.st_mtime_ns
+        except OSError:
+            pass
+        split_path = split_archived_path(path)
+        if split_path is None:
+            return None, None
+        if archive_member_sizes is None:
+            archive_member_sizes = {}
+        if split_path[0] not in archive_member_sizes:
+            archive_member_sizes[split_path[0]] = read_archive_member_sizes(
+                split_path[0]
+            )
+        return archive_member_sizes[split_path[0]].get(split_path[1]), None
+
+    def _build_unlinked_files_plan(self, operation, relocations):
+        """Build a plan of the files to move or delete and the directories to be emptied.
+
+        The plan is a json serialisable dict of
+        "operation": "relocate", "restore" or "remove",
+        "created": ISO 8601 time of planning,
+        "attachment_root_directory": the directory planned for,
+        "relocations": list of dicts of "directory", "run" identifier, "archive" compression and "files",
+        each planned file being a dict of "source" and "target" paths, "size" and "mtime_ns",
+        "target" being the member name for an archive and `None` for a removal,
+        "mtime_ns" being `None` for an archived file and both `None` for a missing file,
+        "directories": the directories to be removed once emptied, the deepest first,
+        "file_count" and "bytes": totals of the planned files.
+        """
+        touched_directories = set()
+        removed_paths = set()
+        kept_directories = set()
+        for relocation in relocations:
+            relocation_directory = Path(relocation["directory"])
+            source_paths = set(
+                planned_file["source"] for planned_file in relocation["files"]
+            )
+            removed_paths.update(source_paths)
+            if operation == "relocate":
+                touched_directories.update(
+                    Path(source_path).parent for source_path in source_paths
+                )
+                kept_directories.add(relocation_directory)
+                continue
+            touched_directories.update(
+                Path(source_path).parent
+                for source_path in source_paths
+                if (ARCHIVE_SUFFIX + os.sep) not in source_path
+            )
+            touched_directories.add(relocation_directory)
+            if operation == "restore":
+                kept_directories.update(
+                    Path(planned_file["target"]).parent
+                    for planned_file in relocation["files"]
+                )
+            # the archives and the records are dropped with the last of their files
+            live_archive_paths = set()
+            live_records = False
+            for relocated_path, _ in read_relocation_records(relocation_directory):
+                if relocated_path in source_paths:
+                    continue
+                live_records = True
+                split_path = split_archived_path(relocated_path)
+                if split_path is not None:
+                    live_archive_paths.add(str(split_path[0]))
+            if not live_records:
+                removed_paths.update(
+                    str(relocation_directory / filename)
+                    for filename in (
+                        RELOCATION_JOURNAL_FILENAME,
+                        RELOCATION_MAP_FILENAME,
+                    )
+                )
+            for archive_name in read_relocation_archive_names(relocation_directory):
+                archive_path = str(relocation_directory / archive_name)
+                if archive_path not in live_archive_paths:
+                    removed_paths.update((archive_path, archive_path + ".tmp"))
+
+        # the directories files are moved to are kept along with their ancestors
+        for directory in tuple(kept_directories):
+            kept_directories.update(str(parent) for parent in directory.parents)
+            kept_directories.add(str(directory))
+        emptied_directories = [
+            directory
+            for directory in find_emptied_directories(
+                self.attachment_root_directory, touched_directories, removed_paths
+            )
+            if directory not in kept_directories
+        ]
+        planned_files = [
+            planned_file
+            for relocation in relocations
+            for planned_file in relocation["files"]
+        ]
+        return {
+            "operation": operation,
+            "created": dt.datetime.now().isoformat(),
+            "attachment_root_directory": str(self.attachment_root_directory),
+            "relocations": relocations,
+            "directories": emptied_directories,
+            "file_count": len(planned_files),
+            "bytes": sum(planned_file["size"] or 0 for planned_file in planned_files),
+        }
+
+    @_instrumented_run
+    def apply_unlinked_files_plan(self, plan, workers=None):
+        """Apply a plan from `self.plan_relocate_unlinked_files`, `self.plan_restore_unlinked_files`
+        or `self.plan_remove_unlinked_files`, e.g. one saved as json and reviewed.
+
+        Each file is checked against its size and modification time at planning,
+        the files changed since are left untouched and reported failed, to be planned again.
+
+        Parameters
+        ----------
+        plan : dict
+            Plan to apply.
+        workers : int, optional
+            Maximum number of threads to move the files, the files are moved one by one if not specified.
+
+        Returns
+        -------
+        out : dict
+            Exceptions raised keyed on the source paths of the files failed to move or delete.
+
+        """
+        operation = plan["operation"]
+        if operation not in _UNLINKED_FILES_PLAN_OPERATIONS:
+            raise ValueError("invalid plan operation: " + str(operation))
+        if Path(plan["attachment_root_directory"]) != self.attachment_root_directory:
+            raise ValueError(
+                "plan for another attachment directory: "
+                + str(plan["attachment_root_directory"])
+            )
+
+        errors = {}
+        archive_member_sizes = {}
+        touched_directories = set()
+        for relocation in plan["relocations"]:
+            relocation_directory = Path(relocation["directory"])
+            verified_files = []
+            for planned_file in relocation["files"]:
+                if self._stat_planned_file(
+                    planned_file["source"], archive_member_sizes
+                ) != (planned_file["size"], planned_file["mtime_ns"]):
+                    errors[Path(planned_file["source"])] = OSError(
+                        "file changed since planning: " + planned_file["source"]
+                    )
+                    continue
+                verified_files.append(planned_file)
+            self._instrumentation.count(
+                "errors", len(relocation["files"]) - len(verified_files)
+            )
+
+            if operation == "relocate":
+                archive = relocation["archive"]
+                errors.update(
+                    self._relocate_path_pairs(
+                        (
+                            (
+                                Path(planned_file["source"]),
+                                (
+                                    planned_file["target"]
+                                    if archive
+                                    else Path(planned_file["target"])
+                                ),
+                            )
+                            for planned_file in verified_files
+                        ),
+                        relocation_directory,
+                        workers,
+                        archive,
+                    )
+                )
+                continue
+            relocated_paths = set(
+                planned_file["source"] for planned_file in verified_files
+            )
+            if operation == "restore":
+                with self._instrumentation.phase("restore_files"):
+                    errors.update(
+                        self._restore_relocation(
+                            relocation_directory,
+                            relocation["run"],
+                            workers,
+                            touched_directories,
+                            relocated_paths,
                         )
-                    if not original_path.parent.is_dir():
-                        original_path.parent.mkdir(parents=True)
-                    if original_path.is_file():
-                        # very rare, just in case
-                        raise ValueError("'" + str(original_path) + "' already exists")
-                    relocated_path.rename(original_path)
-            if relocation_map_path.is_file():
-                relocation_map_path.unlink()
-
-        # Remove the empty directories
-        remove_empty_directories(self._attachment_root_directory)
+                    )
+            else:
+                with self._instrumentation.phase("remove_files"):
+                    self._remove_relocation(
+                        relocation_directory,
+                        relocation["run"],
+                        touched_directories,
+                        relocated_paths,
+                    )
+            touched_directories.add(relocation_directory)
+
+        # Remove the empty directories left behind, done with each relocation if relocating
+        if operation != "relocate":
+            with self._instrumentation.phase("remove_empty_directories"):
+                remove_empty_directories(
+                    self.attachment_root_directory, touched_directories
+                )
+
+        return errors
+
+    def _retrieve_tagged_item_entries(self):
+        if self._backend == "local":
+            connection = connect_database(self.data_directory)
+            try:
+                for item_entry in retrieve_tagged_item_entries(
+                    connection,
+                    self._library_id if self._library_type == "group" else None,
+                ):
+                    yield item_entry
+            finally:
+                connection.close()
+            return
+        # stream the items page by page rather than collecting them all
+        for item_entry in self.web_library.items(self._concurrency or 1):
+            yield item_entry
+
+    def plan_tag_case_unification(self, rule="count"):
+        """Plan the unification of the tags literally the same but in different cases,
+        e.g. climate change, Climate change & Climate Change.
+
+        The tags are pulled in one streamed pass of the items, from the local database for the "local" backend,
+        and grouped by their NFKC normalised and case folded forms.
+
+        Parameters
+        ----------
+        rule : str or callable, optional
+            Parameter for `zotutil.tags.plan_tag_case_unification`.
+
+        Returns
+        -------
+        out : dict
+            A json serialisable plan, see `zotutil.tags.plan_tag_case_unification`.
+
+        """
+        return plan_tag_case_unification(self._retrieve_tagged_item_entries(), rule)
+
+    def apply_tag_case_unification(
+        self, plan, dry_run=False, start=0, checkpoint_path=None
+    ):
+        """Apply a tag unification plan through the Web API, in batches of 50 items.
+
+        Each item is updated on the condition that it is unmodified since planned,
+        the items modified since are reported failed, to be planned again.
+
+        Parameters
+        ----------
+        plan : dict
+            Plan from `self.plan_tag_case_unification`.
+        dry_run : bool, optional
+            Whether or not to go through the batches without sending any.
+        start : int, optional
+            Index of the plan update to start from, e.g. "next" of an interrupted application.
+        checkpoint_path : str or pathlib.Path, optional
+            Path to a json file the index to resume from is written to after each batch,
+            and read from to resume when `start` is 0, it is deleted once the plan is fully applied.
+
+        Returns
+        -------
+        out : dict
+            "next": index of the plan update to resume from,
+            "updated": keys of the items updated,
+            "failed": error messages keyed on the keys of the items failed.
+
+        """
+        updates = plan["updates"]
+        if checkpoint_path:
+            checkpoint_path = Path(checkpoint_path)
+            if (not start) and checkpoint_path.is_file():
+                with checkpoint_path.open("rt") as fh:
+                    start = json.load(fh)["next"]
+        result = {"next": start, "updated": [], "failed": {}}
+        for batch_start in range(start, len(updates), TAG_UPDATE_BATCH_SIZE):
+            update_batch = updates[batch_start : batch_start + TAG_UPDATE_BATCH_SIZE]
+            if dry_run:
+                result["updated"].extend(update["key"] for update in update_batch)
+            else:
+                # objects with a key and a version update the existing items
+                response = self.web_library.update_items(
+                    [dict(update) for update in update_batch]
+                )
+                failed_indices = set()
+                for index, failure in response.get("failed", {}).items():
+                    failed_indices.add(int(index))
+                    result["failed"][update_batch[int(index)]["key"]] = failure.get(
+                        "message"
+                    )
+                result["updated"].extend(
+                    update["key"]
+                    for index, update in enumerate(update_batch)
+                    if index not in failed_indices
+                )
+            result["next"] = batch_start + len(update_batch)
+            if checkpoint_path and not dry_run:
+                with checkpoint_path.open("wt") as fh:
+                    json.dump({"next": result["next"]}, fh)
+        if checkpoint_path and (not dry_run) and checkpoint_path.is_file():
+            checkpoint_path.unlink()
+        return result